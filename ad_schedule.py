@@ -0,0 +1,89 @@
+import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from loguru import logger
+from tzlocal import get_localzone
+
+# Расписание объявления задается тремя строками (колонки ads.schedule_days/hours/tz):
+#   days  — дни недели ISO, 1 = понедельник: "1-5", "6,7", "1-3,5"; пусто — все дни
+#   hours — интервалы времени: "9-18", "22:00-06:30", "8-12,14-20"; пусто — круглые сутки.
+#           Интервал через полночь относится к дню, в который он начался
+#   tz    — часовой пояс, например "Europe/Moscow"; пусто — пояс компьютера
+
+
+def parse_days(text: str | None) -> set[int]:
+    days = set()
+    for part in (text or "").replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+        else:
+            start = end = int(part)
+        if not (1 <= start <= 7 and 1 <= end <= 7 and start <= end):
+            raise ValueError(f"Неверные дни недели: {part}")
+        days.update(range(start, end + 1))
+    return days
+
+
+def _parse_time(text: str) -> int:
+    hours, _, minutes = text.partition(":")
+    minutes = int(minutes or 0)
+    value = int(hours) * 60 + minutes
+    if not 0 <= minutes < 60 or not 0 <= value <= 24 * 60:
+        raise ValueError(f"Неверное время: {text}")
+    return value
+
+
+def parse_hours(text: str | None) -> list[tuple[int, int]]:
+    """Интервалы в минутах от начала суток"""
+    ranges = []
+    for part in (text or "").replace(" ", "").split(","):
+        if not part:
+            continue
+        start, sep, end = part.partition("-")
+        if not sep:
+            raise ValueError(f"Неверный интервал времени: {part}")
+        ranges.append((_parse_time(start), _parse_time(end)))
+    return ranges
+
+
+def schedule_zone(tz: str | None):
+    if tz:
+        return ZoneInfo(tz)
+    return get_localzone()
+
+
+def validate_schedule(days: str | None, hours: str | None, tz: str | None) -> bool:
+    try:
+        parse_days(days)
+        parse_hours(hours)
+        schedule_zone(tz)
+        return True
+    except (ValueError, ZoneInfoNotFoundError):
+        return False
+
+
+def is_within_schedule(days: str | None, hours: str | None, tz: str | None,
+                       now: datetime.datetime | None = None) -> bool:
+    """Попадает ли текущий момент в окно работы объявления.
+    При ошибке в расписании объявление считается активным, чтобы не пропасть из работы молча"""
+    if not days and not hours:
+        return True
+    try:
+        weekdays = parse_days(days) or set(range(1, 8))
+        ranges = parse_hours(hours) or [(0, 24 * 60)]
+        local = (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(schedule_zone(tz))
+    except (ValueError, ZoneInfoNotFoundError) as err:
+        logger.warning(f"Неверное расписание объявления ({days!r}, {hours!r}, {tz!r}): {err}")
+        return True
+    day = local.isoweekday()
+    previous_day = 7 if day == 1 else day - 1
+    minute = local.hour * 60 + local.minute
+    for start, end in ranges:
+        if start < end:
+            if day in weekdays and start <= minute < end:
+                return True
+        elif (day in weekdays and minute >= start) or (previous_day in weekdays and minute < end):
+            return True
+    return False
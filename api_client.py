@@ -0,0 +1,128 @@
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+from loguru import logger
+
+from rate_limiter import get_rate_limiter
+
+API_BASE_URL = "https://api.avito.ru"
+DEFAULT_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+MAX_CONNECTIONS = 20
+
+# Лимиты задаются из конфига в основном цикле (api_rate_per_minute, api_rate_burst);
+# по умолчанию ограничения нет, как и до появления ограничителя
+api_limiter = get_rate_limiter("avito-api", rate_per_minute=0, burst=5)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@dataclass
+class ApiResult:
+    """Ответ API Авито в едином виде: data при успехе, иначе код и текст ошибки"""
+    status_code: int | None  # None — запрос не дошел до сервера
+    data: Any = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status_code is not None and 200 <= self.status_code < 300
+
+
+class AvitoApiClient:
+    """Общий на процесс клиент api.avito.ru: пул keep-alive соединений вместо
+    нового TCP+TLS рукопожатия на каждый вызов, таймауты по умолчанию,
+    авторизация и ограничение частоты по токену"""
+
+    def __init__(self, http2: bool = False, timeout: httpx.Timeout = DEFAULT_TIMEOUT, max_connections: int = MAX_CONNECTIONS):
+        self.requested_http2 = http2
+        self.http2 = http2 and _http2_available()
+        if http2 and not self.http2:
+            logger.warning("HTTP/2 для API недоступен (нет пакета h2), работаем по HTTP/1.1")
+        self._client = httpx.Client(
+            base_url=API_BASE_URL,
+            http2=self.http2,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def request(
+            self,
+            method: str,
+            path: str,
+            token: str | None = None,
+            *,
+            json: dict | None = None,
+            data: dict | None = None,
+            timeout: float | None = None
+    ) -> ApiResult:
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        if token:
+            api_limiter.acquire(token)
+        try:
+            response = self._client.request(
+                method,
+                path,
+                headers=headers,
+                json=json,
+                data=data,
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT
+            )
+        except httpx.HTTPError as err:
+            logger.debug(f"API {method} {path}: {err}")
+            return ApiResult(status_code=None, error=str(err) or type(err).__name__)
+
+        if token:
+            if response.status_code == 429:
+                api_limiter.throttled(token)
+            elif response.is_success:
+                api_limiter.succeeded(token)
+        try:
+            payload = response.json() if response.text.strip() else None
+        except ValueError:
+            payload = None
+        if response.is_success:
+            return ApiResult(status_code=response.status_code, data=payload)
+        return ApiResult(status_code=response.status_code, data=payload, error=self._error_message(response, payload))
+
+    @staticmethod
+    def _error_message(response: httpx.Response, payload: Any) -> str:
+        if isinstance(payload, dict):
+            error = payload.get("error")
+            if isinstance(error, dict) and error.get("message"):
+                return str(error["message"])
+            for key in ("message", "error_description", "error"):
+                if payload.get(key):
+                    return str(payload[key])
+        return response.text[:200] or f"HTTP {response.status_code}"
+
+    def get(self, path: str, token: str | None = None, **kwargs) -> ApiResult:
+        return self.request("GET", path, token, **kwargs)
+
+    def post(self, path: str, token: str | None = None, **kwargs) -> ApiResult:
+        return self.request("POST", path, token, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+
+_client: AvitoApiClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_api_client(http2: bool | None = None) -> AvitoApiClient:
+    """Общий клиент API; http2 — пересоздать его, если режим отличается от текущего"""
+    global _client
+    with _client_lock:
+        if _client is None or (http2 is not None and http2 != _client.requested_http2):
+            if _client is not None:
+                _client.close()
+            _client = AvitoApiClient(http2=bool(http2))
+        return _client
@@ -0,0 +1,344 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from urllib.parse import urlparse
+
+from curl_cffi.requests import AsyncSession
+from loguru import logger
+
+from cookie_pool import CookiePool
+from avito_db import AvitoDB
+from cookie_store import DIRECT_KEY
+from dto import AvitoConfig, MobileProxy, Proxy, ScanTarget
+from get_cookies import get_cookies
+from page_extractor import soft_block_reason
+from parser_cls import AvitoParse
+from retry_policy import ErrorKind, FetchOutcome, backoff_delay, classify_exception, classify_status
+from traffic import CURL_INFOS
+
+
+@dataclass
+class ProxySlot:
+    """Состояние одного мобильного прокси в асинхронном режиме"""
+    name: str
+    proxy: MobileProxy | None
+    session: AsyncSession
+    semaphore: asyncio.Semaphore
+    ip_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    ready: asyncio.Event = field(default_factory=asyncio.Event)  # сброшен, пока прокси меняет IP
+    cookies: dict | None = None
+    cookies_confirmed: bool = False  # cookies прошли хотя бы один запрос после последней блокировки
+    failed_requests_count: int = 0
+    last_ip_change: float = 0
+
+    def __post_init__(self):
+        self.ready.set()
+
+    @property
+    def key(self) -> str:
+        return self.proxy.key if self.proxy else DIRECT_KEY
+
+    @property
+    def proxy_data(self) -> dict | None:
+        if not self.proxy:
+            return None
+        return {"https": f"http://{self.proxy.proxy_string}"}
+
+
+class AsyncAvitoParse(AvitoParse):
+    """Асинхронный режим парсера: категории сканируются параллельно,
+    число одновременных запросов ограничено семафором на каждый прокси"""
+
+    def __init__(self, config: AvitoConfig, stop_event=None, cookie_pool: CookiePool | None = None):
+        super().__init__(config, stop_event, cookie_pool=cookie_pool)
+        self.proxy_concurrency = max(1, int(getattr(config, 'proxy_concurrency', 2) or 1))
+        self._slots: list[ProxySlot] = []
+        # Цены (getBids по сети с ожиданием лимита) и записи в SQLite не должны
+        # останавливать цикл событий: их выполняет один поток со своим соединением,
+        # туда же уходят сохранение статистики запросов и сброс cookies прокси
+        self._db_executor: ThreadPoolExecutor | None = None
+        self._writer_db: AvitoDB | None = None
+
+    def _stopped(self) -> bool:
+        return bool(self.stop_event and self.stop_event.is_set())
+
+    def _create_slots(self) -> list[ProxySlot]:
+        proxies = self.mobile_proxies or [None]
+        slots = []
+        for proxy in proxies:
+            slot = ProxySlot(
+                name=proxy.name if proxy else DIRECT_KEY,
+                proxy=proxy,
+                session=AsyncSession(curl_infos=CURL_INFOS),
+                semaphore=asyncio.Semaphore(self.proxy_concurrency),
+            )
+            # У каждого прокси только свои cookies
+            slot.cookies = self.cookie_store.get(slot.key)
+            if slot.cookies:
+                self._saved_cookies[slot.key] = slot.cookies
+            slots.append(slot)
+        logger.info(f"Асинхронный режим: {len(slots)} прокси, до {self.proxy_concurrency} запросов на прокси")
+        return slots
+
+    async def change_ip_async(self, slot: ProxySlot, max_attempts: int = 2) -> bool:
+        """Меняет IP только у прокси слота, остальные слоты продолжают работу"""
+        if not slot.proxy:
+            return False
+        async with slot.ip_lock:
+            if time.time() - slot.last_ip_change <= 15:
+                # IP только что сменили в соседней задаче этого прокси
+                return True
+            # Остальные задачи этого прокси ждут новый IP и cookies, другие прокси работают дальше
+            slot.ready.clear()
+            try:
+                return await self._change_slot_ip(slot, max_attempts)
+            finally:
+                slot.ready.set()
+
+    async def _change_slot_ip(self, slot: ProxySlot, max_attempts: int) -> bool:
+        # Ссылку смены IP вызываем отдельной сессией: без cookies Авито и заголовков профиля
+        async with AsyncSession() as control:
+            return await self._call_change_ip(slot, control, max_attempts)
+
+    async def _call_change_ip(self, slot: ProxySlot, control: AsyncSession, max_attempts: int) -> bool:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                logger.info(f"[{slot.name}] Попытка смены IP {attempt}/{max_attempts}")
+                res = await control.get(slot.proxy.proxy_change_url, timeout=20, verify=False)
+                if res.status_code == 200:
+                    slot.failed_requests_count = 0
+                    slot.last_ip_change = time.time()
+                    self.health.record_ip_change(slot.key)
+                    self.breakers.proxy(slot.key).record_success()
+                    if self.impersonation:
+                        self.impersonation.repin(slot.key)
+                    wait_time = random.randint(1, 5)
+                    logger.info(f"[{slot.name}] ✅ IP изменен, пауза {wait_time} сек для стабилизации")
+                    await asyncio.sleep(wait_time)
+                    # Сохраненные cookies и наборы из пула получены со старого IP
+                    await self._run_db(self.cookie_store.invalidate, slot.key)
+                    slot.session.cookies.clear()
+                    if self.cookie_pool:
+                        self.cookie_pool.invalidate(slot.key)
+                    proxy_obj = Proxy(proxy_string=slot.proxy.proxy_string, change_ip_link=slot.proxy.proxy_change_url)
+                    cookies = await get_cookies(
+                        proxy=proxy_obj,
+                        headless=True,
+                        use_cache=not self.cookie_pool,
+                        browser_manager=self.browser_manager,
+                        resource_policy=self.resource_policy,
+                        profile=self.impersonation.profile_for(slot.key) if self.impersonation else None
+                    )
+                    if cookies:
+                        slot.cookies = cookies
+                    return True
+                logger.warning(f"[{slot.name}] Ошибка смены IP: статус {res.status_code}")
+            except Exception as err:
+                logger.error(f"[{slot.name}] Ошибка при смене IP (попытка {attempt}): {err}")
+            if attempt < max_attempts:
+                await asyncio.sleep(random.randint(1, 2) * attempt)
+        return False
+
+    async def fetch_data_async(self, slot: ProxySlot, url: str, retries: int = 5, backoff_factor: float = 1) -> str | None:
+        outcome = await self.fetch_async(slot, url, retries=retries, backoff_factor=backoff_factor)
+        return outcome.text if outcome.ok else None
+
+    def _slot_with_closed_breaker(self, slot: ProxySlot) -> ProxySlot | None:
+        """Слот для запроса: свой, а если его предохранитель открыт — любой другой с закрытым"""
+        if self.breakers.proxy(slot.key).allow():
+            return slot
+        for other in self._slots:
+            if other is not slot and other.ready.is_set() and self.breakers.proxy(other.key).allow():
+                logger.info(f"🔌 [{slot.name}] исключен предохранителем, запрос идет через {other.name}")
+                return other
+        return None
+
+    async def fetch_async(self, slot: ProxySlot, url: str, retries: int = 5, backoff_factor: float = 1) -> FetchOutcome:
+        host = urlparse(url).netloc
+        pool_cookies_used = False
+        outcome = FetchOutcome(kind=ErrorKind.UNEXPECTED)
+        home_slot = slot
+        for attempt in range(1, retries + 1):
+            if self._stopped():
+                return FetchOutcome(kind=ErrorKind.CANCELLED, attempts=attempt - 1)
+            await home_slot.ready.wait()
+            # Сначала прокси: пробный слот сайта занимаем, только если запрос точно уйдет
+            slot = self._slot_with_closed_breaker(home_slot)
+            if slot is None:
+                return FetchOutcome(kind=ErrorKind.CIRCUIT_OPEN, attempts=attempt - 1, error="все прокси исключены")
+            if not self.breakers.host(host).allow():
+                self.breakers.proxy(slot.key).release()
+                return FetchOutcome(kind=ErrorKind.CIRCUIT_OPEN, attempts=attempt - 1, error=f"сайт {host} недоступен")
+            headers, impersonate, profile_name = self.request_profile(slot.key)
+            await self.rate_limiter.acquire_async(slot.key)
+            started = time.time()
+            try:
+                response = await slot.session.get(
+                    url,
+                    headers=headers,
+                    impersonate=impersonate,
+                    proxies=slot.proxy_data,
+                    cookies=slot.cookies,
+                    timeout=30,
+                    verify=False,
+                    allow_redirects=True
+                )
+            except Exception as err:
+                kind = classify_exception(err)
+                outcome = FetchOutcome(kind=kind, attempts=attempt, proxy_key=slot.key, error=str(err))
+                logger.warning(f"[{slot.name}] Попытка {attempt}: ошибка {kind.value}: {err}")
+                self.health.record(slot.key, None, None)
+            else:
+                kind = classify_status(response.status_code)
+                # Капча или «проблема с IP» со статусом 200 — блокировка, а не страница без объявлений
+                reason = soft_block_reason(response.text) if kind == ErrorKind.OK else None
+                if reason:
+                    kind = ErrorKind.SOFT_BLOCK
+                outcome = FetchOutcome(kind=kind, status_code=response.status_code, attempts=attempt, proxy_key=slot.key,
+                                       error=reason)
+                logger.debug(f"[{slot.name}] Попытка {attempt}: {response.status_code}")
+                self.health.record(slot.key, time.time() - started, response.status_code, blocked=bool(reason))
+                self.traffic.record(slot.key, url, response.status_code, response)
+                if self.impersonation:
+                    self.impersonation.record(profile_name, response.status_code, blocked=bool(reason))
+                if kind == ErrorKind.OK:
+                    outcome.text = response.text
+            self.breakers.record(slot.key, host, kind)
+
+            if kind == ErrorKind.OK:
+                slot.failed_requests_count = 0
+                slot.cookies_confirmed = True
+                self.rate_limiter.succeeded(slot.key)
+                return outcome
+            slot.failed_requests_count += 1
+            if kind == ErrorKind.RATE_LIMITED:
+                logger.warning(f"[{slot.name}] Rate limit {response.status_code}")
+                self.rate_limiter.throttled(slot.key)
+                if await self.change_ip_async(slot):
+                    continue
+            elif kind in (ErrorKind.BLOCKED, ErrorKind.SOFT_BLOCK):
+                if kind == ErrorKind.SOFT_BLOCK:
+                    logger.warning(f"[{slot.name}] Мягкая блокировка: {reason}")
+                else:
+                    logger.warning(f"[{slot.name}] Блокировка {response.status_code}")
+                await self._run_db(self.cookie_store.invalidate, slot.key)
+                slot.session.cookies.clear()
+                slot.cookies_confirmed = False
+                if not pool_cookies_used and self.cookie_pool:
+                    cookies = self.cookie_pool.take(slot.key)
+                    if cookies:
+                        pool_cookies_used = True
+                        slot.cookies = cookies
+                        continue
+                if await self.change_ip_async(slot):
+                    continue
+            elif kind in (ErrorKind.TRANSPORT, ErrorKind.TLS, ErrorKind.TIMEOUT):
+                if slot.failed_requests_count >= 2 and await self.change_ip_async(slot):
+                    continue
+            elif kind == ErrorKind.SERVER:
+                logger.warning(f"[{slot.name}] Ошибка сервера {response.status_code}")
+            if attempt < retries:
+                await asyncio.sleep(backoff_delay(attempt, backoff_factor))
+        return outcome
+
+    async def fetch_page_positions_async(self, slot: ProxySlot, category: str, page: int) -> dict[str, int] | None:
+        async with slot.semaphore:
+            html_code = await self.fetch_data_async(slot, self.get_page_url(category, page), retries=self.config.max_count_of_retry)
+        await self._run_db(self._flush_stats)
+        if not html_code:
+            return None
+        return self.positions_from_html(html_code)
+
+    async def _run_db(self, fn, *args):
+        """Выполняет fn в потоке записи"""
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, fn, *args)
+
+    def _stat_trackers(self) -> list:
+        return [tracker for tracker in (self.health, self.traffic, self.impersonation) if tracker]
+
+    def _open_writer_db(self):
+        """Выполняется в потоке записи: статистика запросов пишется только отсюда и только
+        явным flush, record на цикле событий лишь копит ее в памяти"""
+        self._writer_db = AvitoDB()
+        for tracker in self._stat_trackers():
+            tracker.db = self._writer_db
+            tracker.flush_every = 0
+
+    def _flush_stats(self):
+        for tracker in self._stat_trackers():
+            tracker.flush()
+
+    def _close_writer_db(self):
+        """Соединение закрывается в том же потоке, где создано; итоговые отчеты цикла
+        после этого снова пишут через соединение парсера"""
+        self._flush_stats()
+        for tracker in self._stat_trackers():
+            tracker.db = self.db
+        if self._writer_db is not None:
+            self._writer_db.close()
+            self._writer_db = None
+
+    def _write_positions(self, found: list[tuple[ScanTarget, int]]):
+        """Выполняется в потоке записи: цены объявлений и ad_stats страницы одной транзакцией"""
+        rows = [(target.ad_id, self.get_price_of_view(target, db=self._writer_db), position) for target, position in found]
+        self._writer_db.insert_ad_stats(rows)
+
+    async def record_positions_async(self, targets: list[ScanTarget], positions: dict[str, int], page: int) -> list[ScanTarget]:
+        found, not_found = self.split_positions(targets, positions, page)
+        if found:
+            await self._run_db(self._write_positions, found)
+            for target, position in found:
+                self.position_saved(target, position)
+        return not_found
+
+    async def scan_category(self, slot: ProxySlot, category: str, targets: list[ScanTarget]):
+        fetched: dict[int, dict[str, int] | None] = {}
+        while targets:
+            not_found = []
+            for page, page_targets in self.group_by_next_page(targets).items():
+                if self._stopped():
+                    return
+                if page not in fetched:
+                    fetched[page] = await self.fetch_page_positions_async(slot, category, page)
+                    self.traffic.charge_ads(self.get_page_url(category, page), [t.ad_id for t in page_targets])
+                if fetched[page] is None:
+                    continue
+                not_found.extend(await self.record_positions_async(page_targets, fetched[page], page))
+            targets = not_found
+
+    async def parse_async(self):
+        slots = self._slots = self._create_slots()
+        plan = self.build_scan_plan()
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="avito-db")
+        await self._run_db(self._open_writer_db)
+        try:
+            tasks = [
+                self.scan_category(slots[i % len(slots)], category, targets)
+                for i, (category, targets) in enumerate(plan.items())
+            ]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Ошибка при сканировании категории: {result}")
+        finally:
+            await self._run_db(self._close_writer_db)
+            self._db_executor.shutdown()
+            self.health.flush()
+            if self.scheduler:
+                self.scheduler.flush()
+            self.report_impersonation()
+            self.report_traffic()
+            for slot in slots:
+                if slot.cookies_confirmed:
+                    cookies = {**slot.session.cookies.get_dict(), **(slot.cookies or {})}
+                    if cookies != self._saved_cookies.get(slot.key):
+                        self._pending_cookies[slot.key] = cookies
+                await slot.session.close()
+            self.flush_cookies()
+            logger.info(f"Cookies сохранены {self.cookie_flushes} раз за цикл")
+
+    def parse(self):
+        asyncio.run(self.parse_async())
@@ -1,16 +1,17 @@
-import requests
 from typing import Optional, Tuple, Dict
 from loguru import logger
 import time
 
+from api_client import get_api_client
+
 _account_id_cache: Dict[str, Tuple[str, float]] = {}
 _ACCOUNT_ID_TTL = 3600 * 24  # 1 день
 
 USER_INFO_ENDPOINTS = [
-    "https://api.avito.ru/core/v1/accounts/self",  # предполагаемый основной
+    "/core/v1/accounts/self",  # предполагаемый основной
 ]
 
-BALANCE_URL_TEMPLATE = "https://api.avito.ru/core/v1/accounts/{account_id}/balance"
+BALANCE_PATH_TEMPLATE = "/core/v1/accounts/{account_id}/balance"
 
 
 def _extract_account_id(data: dict) -> Optional[str]:
@@ -37,22 +38,18 @@ def _get_account_id(token: str, timeout: float = 6) -> Optional[str]:
     cached = _account_id_cache.get(token)
     if cached and now - cached[1] < _ACCOUNT_ID_TTL:
         return cached[0]
-    headers = {"Authorization": f"Bearer {token}"}
-    for url in USER_INFO_ENDPOINTS:
-        try:
-            resp = requests.get(url, headers=headers, timeout=timeout)
-            if resp.status_code != 200:
-                logger.debug(f"UserInfo {url} -> {resp.status_code}")
-                continue
-            data = resp.json() if resp.text else {}
-            account_id = _extract_account_id(data)
-            if account_id:
-                _account_id_cache[token] = (account_id, now)
-                logger.debug(f"UserInfo: найден account_id={account_id}")
-                return account_id
-            logger.debug(f"UserInfo: не удалось извлечь id из ответа {data}")
-        except Exception as e:
-            logger.debug(f"UserInfo ошибка {url}: {e}")
+    for path in USER_INFO_ENDPOINTS:
+        result = get_api_client().get(path, token, timeout=timeout)
+        if not result.ok:
+            logger.debug(f"UserInfo {path} -> {result.status_code} {result.error}")
+            continue
+        data = result.data or {}
+        account_id = _extract_account_id(data)
+        if account_id:
+            _account_id_cache[token] = (account_id, now)
+            logger.debug(f"UserInfo: найден account_id={account_id}")
+            return account_id
+        logger.debug(f"UserInfo: не удалось извлечь id из ответа {data}")
     return None
 
 
@@ -62,16 +59,13 @@ def get_account_balance(token: str, timeout: float = 6) -> Optional[float]:
     account_id = _get_account_id(token, timeout=timeout)
     if not account_id:
         return None
-    headers = {"Authorization": f"Bearer {token}"}
-    url = BALANCE_URL_TEMPLATE.format(account_id=account_id)
+    path = BALANCE_PATH_TEMPLATE.format(account_id=account_id)
+    result = get_api_client().get(path, token, timeout=timeout)
+    if not result.ok:
+        logger.debug(f"Баланс {path} -> {result.status_code} {result.error}")
+        return None
     try:
-        resp = requests.get(url, headers=headers, timeout=timeout)
-        if resp.status_code != 200:
-            logger.debug(f"Баланс {url} -> {resp.status_code}")
-            return None
-        data = resp.json() if resp.text else {}
-
-        return data['real'] / 100.0
+        return result.data['real'] / 100.0
     except Exception as e:
         logger.debug(f"Баланс ошибка: {e}")
         return None
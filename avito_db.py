@@ -3,8 +3,10 @@ from typing import Any, List, Tuple, Optional
 import datetime
 
 class AvitoDB:
-    def __init__(self, db_path: str = "avito_data.db"):
-        self.conn = sqlite3.connect(db_path)
+    def __init__(self, db_path: str = "avito_data.db", check_same_thread: bool = True):
+        # timeout: при шардированном парсинге в базу пишут несколько потоков
+        # check_same_thread=False — для общего соединения под блокировкой вызывающего
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=check_same_thread)
         self.create_tables()
 
     def create_tables(self):
@@ -47,6 +49,10 @@ class AvitoDB:
                 url TEXT,
                 daily_budget INTEGER,
                 active BOOLEAN DEFAULT TRUE,
+                scan_pages INTEGER,
+                schedule_days TEXT,
+                schedule_hours TEXT,
+                schedule_tz TEXT,
                 FOREIGN KEY(profile_id) REFERENCES profiles(id)
             )
         ''')
@@ -63,6 +69,25 @@ class AvitoDB:
                 if "duplicate column name" not in str(e):
                     raise
         
+        if 'scan_pages' not in columns:
+            try:
+                cursor.execute('ALTER TABLE ads ADD COLUMN scan_pages INTEGER')
+                self.conn.commit()
+                print("Столбец 'scan_pages' успешно добавлен в таблицу 'ads'.")
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" not in str(e):
+                    raise
+
+        for column in ('schedule_days', 'schedule_hours', 'schedule_tz'):
+            if column not in columns:
+                try:
+                    cursor.execute(f'ALTER TABLE ads ADD COLUMN {column} TEXT')
+                    self.conn.commit()
+                    print(f"Столбец '{column}' успешно добавлен в таблицу 'ads'.")
+                except sqlite3.OperationalError as e:
+                    if "duplicate column name" not in str(e):
+                        raise
+
         if 'active' not in columns:
             try:
                 cursor.execute('ALTER TABLE ads ADD COLUMN active BOOLEAN DEFAULT TRUE')
@@ -83,6 +108,99 @@ class AvitoDB:
                 FOREIGN KEY (ad_id) REFERENCES ads (id)
             )
         ''')
+
+        # Сглаженные оценки здоровья мобильных прокси (proxy_rotation_mode = smart)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS proxy_health (
+                proxy_key TEXT PRIMARY KEY,
+                latency REAL,
+                success_rate REAL,
+                block_rate REAL,
+                last_ip_change REAL,
+                quarantined_until REAL,
+                samples INTEGER
+            )
+        ''')
+
+        # Cookies по каждому прокси (см. cookie_store.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cookie_store (
+                proxy_key TEXT PRIMARY KEY,
+                ip TEXT,
+                cookies TEXT,
+                harvested_at REAL,
+                expires_at REAL,
+                last_used_at REAL
+            )
+        ''')
+
+        # Доля блокировок по профилям TLS-отпечатка (см. impersonation.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS impersonation_stats (
+                profile TEXT PRIMARY KEY,
+                requests INTEGER DEFAULT 0,
+                blocks INTEGER DEFAULT 0
+            )
+        ''')
+
+        # Время следующего скана каждого объявления (см. scan_scheduler.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_schedule (
+                ad_id TEXT PRIMARY KEY,
+                next_scan_at REAL,
+                interval REAL,
+                volatility REAL
+            )
+        ''')
+
+        # Трафик прокси по запросам и по объявлениям (см. traffic.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS traffic_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cycle_started REAL,
+                timestamp REAL,
+                proxy_key TEXT,
+                url TEXT,
+                status INTEGER,
+                wire_bytes INTEGER,
+                decoded_bytes INTEGER
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_traffic_requests_cycle ON traffic_requests (cycle_started)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ad_traffic (
+                cycle_started REAL,
+                ad_id TEXT,
+                wire_bytes INTEGER,
+                decoded_bytes INTEGER,
+                PRIMARY KEY (cycle_started, ad_id)
+            )
+        ''')
+
+        # Ответы getBids по объявлению и токену (см. bid_cache.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bid_info_cache (
+                item_id TEXT,
+                token_key TEXT,
+                data TEXT,
+                fetched_at REAL,
+                PRIMARY KEY (item_id, token_key)
+            )
+        ''')
+
+        # История ставок, выставленных корректировкой цен
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bid_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ad_id TEXT,
+                timestamp DATETIME,
+                position INTEGER,
+                old_price INTEGER,
+                new_price INTEGER,
+                limit_penny INTEGER
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_bid_changes_ad ON bid_changes (ad_id, timestamp)')
         self.conn.commit()
 
     def insert_profile(self, client_id: str, client_secret: str, token: str = None, token_created_at: Optional[str] = None, name: str = None) -> int:
@@ -99,12 +217,12 @@ class AvitoDB:
         row = cursor.fetchone()
         return row[0] if row else None
 
-    def insert_ad(self, ad_id: str, category: str, profile_id: int, max_price: int = None, target_place_start: int = None, target_place_end: int = None, comment: str = None, url: str = None, daily_budget: int = None, active: bool = True):
+    def insert_ad(self, ad_id: str, category: str, profile_id: int, max_price: int = None, target_place_start: int = None, target_place_end: int = None, comment: str = None, url: str = None, daily_budget: int = None, active: bool = True, scan_pages: int = None, schedule_days: str = None, schedule_hours: str = None, schedule_tz: str = None):
         cursor = self.conn.cursor()
         cursor.execute('''
-            INSERT OR IGNORE INTO ads (id, category, profile_id, max_price, target_place_start, target_place_end, comment, url, daily_budget, active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (ad_id, category, profile_id, max_price, target_place_start, target_place_end, comment, url, daily_budget, active))
+            INSERT OR IGNORE INTO ads (id, category, profile_id, max_price, target_place_start, target_place_end, comment, url, daily_budget, active, scan_pages, schedule_days, schedule_hours, schedule_tz)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (ad_id, category, profile_id, max_price, target_place_start, target_place_end, comment, url, daily_budget, active, scan_pages, schedule_days, schedule_hours, schedule_tz))
         self.conn.commit()
 
     def insert_ad_stat(self, ad_id: str, price: int, position: int, timestamp: Optional[datetime.datetime] = None):
@@ -117,6 +235,62 @@ class AvitoDB:
         ''', (ad_id, timestamp, price, position))
         self.conn.commit()
 
+    def insert_ad_stats(self, rows: List[Tuple[str, int, int]], timestamp: Optional[datetime.datetime] = None):
+        """Пачка записей (ad_id, price, position) одной транзакцией"""
+        if not rows:
+            return
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT INTO ad_stats (ad_id, timestamp, price, position)
+            VALUES (?, ?, ?, ?)
+        ''', [(ad_id, timestamp, price, position) for ad_id, price, position in rows])
+        self.conn.commit()
+
+    def get_last_price(self, ad_id: str) -> Optional[int]:
+        """Текущая ставка объявления: последняя выставленная нами или записанная при скане"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT price FROM (
+                SELECT new_price AS price, timestamp FROM bid_changes WHERE ad_id = ?
+                UNION ALL
+                SELECT price, timestamp FROM ad_stats WHERE ad_id = ? AND price IS NOT NULL
+            )
+            ORDER BY timestamp DESC LIMIT 1
+        ''', (ad_id, ad_id))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def insert_bid_changes(self, rows: List[Tuple[Any, ...]]):
+        """Ставки, выставленные за проход корректировки: одна транзакция на весь проход.
+        Строка — (ad_id, timestamp, position, old_price, new_price, limit_penny)"""
+        if not rows:
+            return
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT INTO bid_changes (ad_id, timestamp, position, old_price, new_price, limit_penny)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        self.conn.commit()
+
+    def get_recent_positions(self, per_ad: int = 3) -> dict:
+        """Последние per_ad позиций каждого объявления, от новых к старым"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT ad_id, position FROM (
+                SELECT ad_id, position, timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY ad_id ORDER BY timestamp DESC) AS rn
+                FROM ad_stats WHERE position IS NOT NULL
+            )
+            WHERE rn <= ?
+            ORDER BY ad_id, timestamp DESC
+        ''', (per_ad,))
+        positions = {}
+        for ad_id, position in cursor.fetchall():
+            positions.setdefault(str(ad_id), []).append(position)
+        return positions
+
     def get_ad(self, ad_id: str) -> Optional[Tuple[Any, ...]]:
         cursor = self.conn.cursor()
         cursor.execute('SELECT * FROM ads WHERE id = ?', (ad_id,))
@@ -208,6 +382,153 @@ class AvitoDB:
         cursor.execute('SELECT id FROM ads')
         return [row[0] for row in cursor.fetchall()]
 
+    def get_proxy_health(self) -> List[Tuple[Any, ...]]:
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT proxy_key, latency, success_rate, block_rate, last_ip_change, quarantined_until, samples
+            FROM proxy_health
+        ''')
+        return cursor.fetchall()
+
+    def save_proxy_health(self, rows: List[Tuple[Any, ...]]):
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO proxy_health
+                (proxy_key, latency, success_rate, block_rate, last_ip_change, quarantined_until, samples)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        self.conn.commit()
+
+    def get_cookie_entry(self, proxy_key: str) -> Optional[Tuple[Any, ...]]:
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT proxy_key, ip, cookies, harvested_at, expires_at, last_used_at
+            FROM cookie_store WHERE proxy_key = ?
+        ''', (proxy_key,))
+        return cursor.fetchone()
+
+    def save_harvested_cookies(self, proxy_key: str, ip: Optional[str], cookies: str, harvested_at: float, expires_at: Optional[float]):
+        """Свежесобранные cookies полностью заменяют запись прокси"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO cookie_store (proxy_key, ip, cookies, harvested_at, expires_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, NULL)
+        ''', (proxy_key, ip, cookies, harvested_at, expires_at))
+        self.conn.commit()
+
+    def save_used_cookies(self, proxy_key: str, cookies: str, used_at: float):
+        """Обновляет cookies после успешного запроса, сохраняя время сбора и срок годности"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT INTO cookie_store (proxy_key, cookies, harvested_at, last_used_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(proxy_key) DO UPDATE SET cookies = excluded.cookies, last_used_at = excluded.last_used_at
+        ''', (proxy_key, cookies, used_at, used_at))
+        self.conn.commit()
+
+    def delete_cookie_entry(self, proxy_key: str):
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM cookie_store WHERE proxy_key = ?', (proxy_key,))
+        self.conn.commit()
+
+    def get_impersonation_stats(self) -> List[Tuple[Any, ...]]:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT profile, requests, blocks FROM impersonation_stats')
+        return cursor.fetchall()
+
+    def add_impersonation_stats(self, rows: List[Tuple[Any, ...]]):
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT INTO impersonation_stats (profile, requests, blocks) VALUES (?, ?, ?)
+            ON CONFLICT(profile) DO UPDATE SET
+                requests = requests + excluded.requests,
+                blocks = blocks + excluded.blocks
+        ''', rows)
+        self.conn.commit()
+
+    def get_scan_schedule(self) -> List[Tuple[Any, ...]]:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT ad_id, next_scan_at, interval, volatility FROM scan_schedule')
+        return cursor.fetchall()
+
+    def save_scan_schedule(self, rows: List[Tuple[Any, ...]]):
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO scan_schedule (ad_id, next_scan_at, interval, volatility)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        self.conn.commit()
+
+    def insert_traffic_requests(self, rows: List[Tuple[Any, ...]]):
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT INTO traffic_requests (cycle_started, timestamp, proxy_key, url, status, wire_bytes, decoded_bytes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        self.conn.commit()
+
+    def add_ad_traffic(self, rows: List[Tuple[Any, ...]]):
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT INTO ad_traffic (cycle_started, ad_id, wire_bytes, decoded_bytes) VALUES (?, ?, ?, ?)
+            ON CONFLICT(cycle_started, ad_id) DO UPDATE SET
+                wire_bytes = wire_bytes + excluded.wire_bytes,
+                decoded_bytes = decoded_bytes + excluded.decoded_bytes
+        ''', rows)
+        self.conn.commit()
+
+    def prune_traffic(self, before: float) -> int:
+        """Удаляет учет трафика циклов, начатых раньше before; возвращает число удаленных запросов"""
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM traffic_requests WHERE cycle_started < ?', (before,))
+        removed = cursor.rowcount
+        cursor.execute('DELETE FROM ad_traffic WHERE cycle_started < ?', (before,))
+        self.conn.commit()
+        return removed
+
+    def get_traffic_by_cycle(self, limit: int = 20) -> List[Tuple[Any, ...]]:
+        """Трафик последних циклов: (начало цикла, прокси, запросов, байт по сети, байт после распаковки)"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT cycle_started, proxy_key, COUNT(*), SUM(wire_bytes), SUM(decoded_bytes)
+            FROM traffic_requests
+            WHERE cycle_started IN (
+                SELECT DISTINCT cycle_started FROM traffic_requests ORDER BY cycle_started DESC LIMIT ?
+            )
+            GROUP BY cycle_started, proxy_key
+            ORDER BY cycle_started DESC
+        ''', (limit,))
+        return cursor.fetchall()
+
+    def get_bid_info_entries(self, keys: List[Tuple[str, str]]) -> List[Tuple[Any, ...]]:
+        """Записи кэша getBids по списку (item_id, token_key): (item_id, token_key, data, fetched_at)"""
+        if not keys:
+            return []
+        cursor = self.conn.cursor()
+        placeholders = ", ".join("(?, ?)" for _ in keys)
+        cursor.execute(
+            f'SELECT item_id, token_key, data, fetched_at FROM bid_info_cache WHERE (item_id, token_key) IN ({placeholders})',
+            [value for key in keys for value in key]
+        )
+        return cursor.fetchall()
+
+    def save_bid_info_entries(self, rows: List[Tuple[Any, ...]]):
+        """Строка — (item_id, token_key, data, fetched_at); все строки одной транзакцией"""
+        if not rows:
+            return
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO bid_info_cache (item_id, token_key, data, fetched_at) VALUES (?, ?, ?, ?)
+        ''', rows)
+        self.conn.commit()
+
+    def delete_bid_info_entries(self, keys: List[Tuple[str, str]]):
+        if not keys:
+            return
+        cursor = self.conn.cursor()
+        cursor.executemany('DELETE FROM bid_info_cache WHERE item_id = ? AND token_key = ?', keys)
+        self.conn.commit()
+
     def close(self):
         self.conn.close()
 
@@ -0,0 +1,47 @@
+"""Сравнение скорости извлечения mfe-state: быстрый поиск против BeautifulSoup.
+
+Запуск на сохраненных страницах каталога:
+    python bench_page_extractor.py m.html pages/*.html -n 20
+"""
+import argparse
+import glob
+import time
+
+from page_extractor import extract_mfe_state_fast, extract_mfe_state_soup
+
+
+def bench(func, html_code, number: int) -> float:
+    """Среднее время одного вызова в миллисекундах"""
+    start = time.perf_counter()
+    for _ in range(number):
+        func(html_code)
+    return (time.perf_counter() - start) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения JSON со страницы Авито")
+    parser.add_argument("files", nargs="+", help="сохраненные HTML страницы (поддерживаются маски)")
+    parser.add_argument("-n", "--number", type=int, default=10, help="повторов на файл")
+    args = parser.parse_args()
+
+    paths = [path for pattern in args.files for path in (glob.glob(pattern) or [pattern])]
+    total_fast = total_soup = 0.0
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            html_code = f.read()
+        fast_data = extract_mfe_state_fast(html_code)
+        soup_data = extract_mfe_state_soup(html_code)
+        same = "OK" if fast_data == soup_data else "РАЗЛИЧАЮТСЯ"
+        fast_ms = bench(extract_mfe_state_fast, html_code, args.number)
+        soup_ms = bench(extract_mfe_state_soup, html_code, args.number)
+        total_fast += fast_ms
+        total_soup += soup_ms
+        print(f"{path}: {len(html_code) / 1024:.0f} КБ | fast {fast_ms:.2f} мс | soup {soup_ms:.2f} мс | "
+              f"x{soup_ms / fast_ms if fast_ms else 0:.1f} | результат {same}")
+    if paths:
+        print(f"Итого: fast {total_fast:.2f} мс, soup {total_soup:.2f} мс, "
+              f"ускорение x{total_soup / total_fast if total_fast else 0:.1f}")
+
+
+if __name__ == "__main__":
+    main()
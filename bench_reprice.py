@@ -0,0 +1,111 @@
+"""Время одного прохода корректировки ставок на заглушке API Авито.
+
+Заглушка отвечает на getBids и setManual с заданной задержкой, поэтому
+видно, сколько дает параллельность и как ее съедает ограничитель частоты:
+    python bench_reprice.py -n 500 --latency 0.25
+    python bench_reprice.py -n 500 --per-token 4 --rate 60
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from loguru import logger
+
+import api_client
+from api_client import ApiResult, api_limiter
+from avito_db import AvitoDB
+from bid_cache import get_bid_cache
+from price_manager import REPRICE_PER_TOKEN, REPRICE_WORKERS, RepriceJob, reprice, token_concurrency
+
+
+class StubApiClient:
+    """Вместо api.avito.ru: задержка на каждый вызов и ограничитель, как у настоящего клиента"""
+    requested_http2 = False
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def request(self, method: str, path: str, token: str | None = None, **kwargs) -> ApiResult:
+        if token:
+            api_limiter.acquire(token)
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+        if "getBids" in path:
+            return ApiResult(status_code=200, data={"manual": {"minBidPenny": 100, "minLimitPenny": 1000}})
+        return ApiResult(status_code=200, data={"success": True})
+
+    def get(self, path: str, token: str | None = None, **kwargs) -> ApiResult:
+        return self.request("GET", path, token, **kwargs)
+
+    def post(self, path: str, token: str | None = None, **kwargs) -> ApiResult:
+        return self.request("POST", path, token, **kwargs)
+
+    def close(self):
+        pass
+
+
+def make_jobs(count: int, tokens: int) -> list[RepriceJob]:
+    """Объявления ниже целевой зоны: каждому нужны getBids и setManual"""
+    return [
+        RepriceJob(
+            ad_id=str(1000 + i),
+            token=f"token-{i % tokens}",
+            max_price=None,
+            target_place_start=1,
+            target_place_end=5,
+            daily_budget=5000,
+            current_place=20,
+            last_price=500,
+        )
+        for i in range(count)
+    ]
+
+
+def run(db: AvitoDB, jobs: list[RepriceJob], latency: float, max_workers: int, per_token: int) -> tuple[float, int]:
+    client = api_client._client = StubApiClient(latency)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # update_view_price печатает каждый ответ
+        reprice(db, jobs, max_workers, per_token)
+    return time.perf_counter() - started, client.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк корректировки ставок на заглушке API")
+    parser.add_argument("-n", "--ads", type=int, default=500, help="объявлений в проходе")
+    parser.add_argument("--tokens", type=int, default=1, help="кабинетов (токенов), объявления делятся поровну")
+    parser.add_argument("--latency", type=float, default=0.25, help="задержка одного вызова API, сек")
+    parser.add_argument("--workers", type=int, default=REPRICE_WORKERS, help="reprice_workers")
+    parser.add_argument("--per-token", type=int, default=REPRICE_PER_TOKEN, help="reprice_per_token")
+    parser.add_argument("--rate", type=float, default=0, help="api_rate_per_minute (0 — без ограничения)")
+    parser.add_argument("--burst", type=int, default=5, help="api_rate_burst")
+    parser.add_argument("--sequential", action="store_true", help="сравнить с последовательным проходом")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    os.chdir(tempfile.mkdtemp())  # отдельная БД и кэш getBids, рабочая база не трогается
+    get_bid_cache(ttl_minutes=0)  # холодный проход: каждый getBids идет в API
+    api_limiter.configure(args.rate, args.burst)
+    db = AvitoDB()
+    try:
+        modes = [("параллельно", args.workers, args.per_token)]
+        if args.sequential:
+            modes.insert(0, ("последовательно", 1, 1))
+        for title, max_workers, per_token in modes:
+            elapsed, calls = run(db, make_jobs(args.ads, args.tokens), args.latency, max_workers, per_token)
+            print(f"{title}: {args.ads} объявлений, {calls} вызовов API за {elapsed:.1f} сек "
+                  f"(workers={max_workers}, per_token={token_concurrency(per_token)}, лимит {args.rate or 'нет'})")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
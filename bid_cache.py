@@ -0,0 +1,133 @@
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from loguru import logger
+
+from avito_db import AvitoDB
+
+BID_CACHE_TTL_MINUTES = 30  # minBidPenny и minLimitPenny меняются медленно
+LOOKUP_CHUNK = 400  # ключей в одном SELECT (у старых SQLite не больше 999 параметров)
+
+
+def token_key(token: str) -> str:
+    """Токен в кэше хранится только в виде хеша"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+class BidInfoCache:
+    """Кэш ответов getBids по (объявление, токен) с TTL.
+
+    Записи лежат в SQLite, поэтому кэш общий для парсера, корректировки
+    ставок и GUI, даже если они запущены разными процессами. Проход
+    корректировки читает и пишет кэш пачками через свое соединение (db);
+    одиночные вызовы без db идут через одно общее соединение под блокировкой.
+    После нашего setManual запись сбрасывается."""
+
+    def __init__(self, db_path: str = "avito_data.db", ttl_minutes: float = BID_CACHE_TTL_MINUTES):
+        self.db_path = db_path
+        self.ttl = ttl_minutes * 60
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._shared: AvitoDB | None = None
+        self._shared_lock = threading.Lock()
+
+    @contextmanager
+    def _using(self, db: AvitoDB | None):
+        if db is not None:
+            yield db
+            return
+        with self._shared_lock:
+            if self._shared is None:
+                self._shared = AvitoDB(self.db_path, check_same_thread=False)
+            yield self._shared
+
+    def get_many(self, items: list[tuple], db: AvitoDB | None = None) -> dict[str, dict]:
+        """Свежие ответы getBids по списку (item_id, token): {item_id: ответ}, промахи в словарь не попадают"""
+        if self.ttl <= 0 or not items:
+            return {}
+        keys = {(str(item_id), token_key(token)) for item_id, token in items}
+        found: dict[str, dict] = {}
+        now = time.time()
+        try:
+            with self._using(db) as conn_db:
+                keys_list = list(keys)
+                for i in range(0, len(keys_list), LOOKUP_CHUNK):
+                    for item_id, _, data, fetched_at in conn_db.get_bid_info_entries(keys_list[i:i + LOOKUP_CHUNK]):
+                        if now - (fetched_at or 0) >= self.ttl:
+                            continue
+                        try:
+                            found[item_id] = json.loads(data)
+                        except (TypeError, json.JSONDecodeError):
+                            continue
+        except Exception as err:
+            logger.warning(f"Не удалось прочитать кэш ставок: {err}")
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, item_id, token: str, db: AvitoDB | None = None) -> dict | None:
+        return self.get_many([(item_id, token)], db).get(str(item_id))
+
+    def put_many(self, entries: list[tuple], db: AvitoDB | None = None):
+        """Сохраняет ответы (item_id, token, data) одной транзакцией"""
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        rows = [
+            (str(item_id), token_key(token), json.dumps(data, ensure_ascii=False), now)
+            for item_id, token, data in entries if data
+        ]
+        if not rows:
+            return
+        try:
+            with self._using(db) as conn_db:
+                conn_db.save_bid_info_entries(rows)
+        except Exception as err:
+            logger.warning(f"Не удалось сохранить кэш ставок: {err}")
+
+    def put(self, item_id, token: str, data: dict, db: AvitoDB | None = None):
+        self.put_many([(item_id, token, data)], db)
+
+    def invalidate_many(self, items: list[tuple], db: AvitoDB | None = None):
+        keys = [(str(item_id), token_key(token)) for item_id, token in items]
+        if not keys:
+            return
+        try:
+            with self._using(db) as conn_db:
+                conn_db.delete_bid_info_entries(keys)
+        except Exception as err:
+            logger.warning(f"Не удалось сбросить кэш ставок: {err}")
+
+    def invalidate(self, item_id, token: str, db: AvitoDB | None = None):
+        self.invalidate_many([(item_id, token)], db)
+
+    def hit_rate(self) -> float:
+        with self._lock:
+            total = self.hits + self.misses
+            return self.hits / total if total else 0.0
+
+    def report(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        if hits + misses:
+            logger.info(f"💾 Кэш getBids: {hits} попаданий, {misses} промахов ({self.hit_rate():.0%})")
+
+
+_bid_cache: BidInfoCache | None = None
+_bid_cache_lock = threading.Lock()
+
+
+def get_bid_cache(ttl_minutes: float | None = None) -> BidInfoCache:
+    """Общий кэш getBids процесса; ttl_minutes — обновить срок жизни записей"""
+    global _bid_cache
+    with _bid_cache_lock:
+        if _bid_cache is None:
+            _bid_cache = BidInfoCache(ttl_minutes=BID_CACHE_TTL_MINUTES if ttl_minutes is None else ttl_minutes)
+        elif ttl_minutes is not None:
+            _bid_cache.ttl = ttl_minutes * 60
+        return _bid_cache
@@ -2,6 +2,13 @@ import flet as ft
 import json
 import os
 import subprocess  # оставляем импорт если где-то еще понадобится (можно удалить при желании)
+from ad_schedule import validate_schedule
+
+# Поля объявления, которые редактируются в форме; остальные сохраняются как были
+EDITOR_URL_FIELDS = {
+    "ad", "category", "max_price", "target_place_start", "target_place_end", "comment",
+    "daily_budget", "active", "schedule_days", "schedule_hours", "schedule_tz"
+}
 
 def load_config():
     if not os.path.exists("config.json"):
@@ -59,6 +66,9 @@ def build_config_editor(page: ft.Page) -> ft.Control:
                 if val == "" or not val.isdigit():
                     return False
             # Комментарий может быть пустым, поэтому не проверяем его
+            if not validate_schedule(url_row["schedule_days"].value, url_row["schedule_hours"].value,
+                                     url_row["schedule_tz"].value):
+                return False
         return True
 
     # Кнопка save_btn должна быть объявлена заранее, чтобы использоваться в update_config_buffer
@@ -75,6 +85,7 @@ def build_config_editor(page: ft.Page) -> ft.Control:
                 daily_budget_val = safe_int(url_row["daily_budget"].value) * 100
                 
                 urls.append({
+                    **url_row["extra"],  # поля, которых нет в редакторе (например, scan_pages)
                     "ad": url_row["ad"].value,
                     "category": url_row["category"].value,
                     "max_price": max_price_val,
@@ -82,7 +93,10 @@ def build_config_editor(page: ft.Page) -> ft.Control:
                     "target_place_end": safe_int(url_row["target_place_end"].value),
                     "comment": url_row["comment"].value,
                     "daily_budget": daily_budget_val,
-                    "active": url_row["active"].value
+                    "active": url_row["active"].value,
+                    "schedule_days": url_row["schedule_days"].value.strip(),
+                    "schedule_hours": url_row["schedule_hours"].value.strip(),
+                    "schedule_tz": url_row["schedule_tz"].value.strip()
                 })
             new_profiles.append({
                 "client_id": p["client_id"].value,
@@ -151,6 +165,27 @@ def build_config_editor(page: ft.Page) -> ft.Control:
             on_change=lambda e: update_config_buffer(),
             input_filter=ft.NumbersOnlyInputFilter()
         )
+        schedule_days = ft.TextField(
+            label="days (1-5)",
+            value=str(url_data.get("schedule_days") or ""),
+            width=100,
+            tooltip="Дни недели: 1 — понедельник, 7 — воскресенье. Пусто — все дни",
+            on_change=lambda e: update_config_buffer()
+        )
+        schedule_hours = ft.TextField(
+            label="hours (22-06)",
+            value=str(url_data.get("schedule_hours") or ""),
+            width=120,
+            tooltip="Часы работы, например 9-18 или 22:00-06:00. Пусто — круглые сутки",
+            on_change=lambda e: update_config_buffer()
+        )
+        schedule_tz = ft.TextField(
+            label="tz",
+            value=str(url_data.get("schedule_tz") or ""),
+            width=140,
+            tooltip="Часовой пояс, например Europe/Moscow. Пусто — пояс компьютера",
+            on_change=lambda e: update_config_buffer()
+        )
         active_switch = ft.Switch(
             label="Active",
             value=url_data.get("active", True),
@@ -164,7 +199,11 @@ def build_config_editor(page: ft.Page) -> ft.Control:
             "target_place_end": target_place_end,
             "comment": comment,
             "daily_budget": daily_budget,
-            "active": active_switch
+            "active": active_switch,
+            "schedule_days": schedule_days,
+            "schedule_hours": schedule_hours,
+            "schedule_tz": schedule_tz,
+            "extra": {k: v for k, v in url_data.items() if k not in EDITOR_URL_FIELDS}
         }
         row_controls = None
         def delete_url_row(e):
@@ -176,7 +215,8 @@ def build_config_editor(page: ft.Page) -> ft.Control:
             page.update()
         row_controls = ft.Row([
             ad, category, max_price, target_place_start, target_place_end,
-            comment, daily_budget, active_switch, ft.IconButton(icon=ft.icons.DELETE, on_click=delete_url_row)
+            comment, daily_budget, schedule_days, schedule_hours, schedule_tz, active_switch,
+            ft.IconButton(icon=ft.icons.DELETE, on_click=delete_url_row)
         ])
         urls_column.controls.append(row_controls)
         return row
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from loguru import logger
+
+from cookie_store import COOKIES_TTL_MINUTES, DIRECT_KEY
+from dto import MobileProxy, Proxy
+from get_cookies import BrowserManager, ResourcePolicy, get_cookies
+from impersonation import pinned_profile
+
+
+@dataclass
+class CookieSet:
+    cookies: dict
+    harvested_at: float
+
+
+class CookiePool:
+    """Пул заранее полученных cookies: по size наборов на каждый прокси.
+
+    Фоновый поток пополняет пул и обновляет наборы до истечения
+    COOKIES_TTL_MINUTES, поэтому при блокировке парсер получает готовые
+    cookies сразу, без запуска браузера. Каждый сбор помечен поколением IP
+    прокси: если за время сбора IP сменили, его результат выбрасывается."""
+
+    def __init__(
+            self,
+            proxies: list[MobileProxy],
+            size: int = 2,
+            ttl_minutes: float = COOKIES_TTL_MINUTES,
+            refresh_margin_minutes: float = 10,
+            browser_manager: BrowserManager | None = None,
+            resource_policy: ResourcePolicy | None = None,
+            impersonation: bool = False
+    ):
+        self.size = max(1, size)
+        self.impersonation = impersonation  # собирать cookies с отпечатком, закрепленным за прокси
+        self.browser_manager = browser_manager
+        self.resource_policy = resource_policy
+        self.ttl = ttl_minutes * 60
+        self.refresh_margin = min(refresh_margin_minutes * 60, self.ttl / 2)
+        self._proxies: dict[str, MobileProxy | None] = {}
+        self._sets: dict[str, deque[CookieSet]] = {}
+        self._generations: dict[str, int] = {}  # растет при каждом invalidate прокси
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.set_proxies(proxies)
+
+    def set_proxies(self, proxies: list[MobileProxy]):
+        """Обновляет список прокси (конфиг перечитывается каждый цикл)"""
+        with self._cond:
+            keys = {proxy.key: proxy for proxy in proxies} if proxies else {DIRECT_KEY: None}
+            self._proxies = keys
+            for key in list(self._sets):
+                if key not in keys:
+                    del self._sets[key]
+            for key in keys:
+                self._sets.setdefault(key, deque())
+            self._cond.notify_all()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name="cookie-pool", daemon=True)
+        self._thread.start()
+        logger.info(f"🍪 Пул cookies запущен: {self.size} наборов на прокси")
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def take(self, proxy_key: str) -> dict | None:
+        """Отдает самый свежий готовый набор cookies прокси и запускает пополнение"""
+        with self._cond:
+            sets = self._sets.get(proxy_key)
+            self._drop_expired(sets)
+            if not sets:
+                self._cond.notify_all()
+                return None
+            cookie_set = sets.pop()
+            self._cond.notify_all()
+        logger.info(f"🍪 Взяли cookies из пула для {proxy_key} (возраст {time.time() - cookie_set.harvested_at:.0f} сек)")
+        return cookie_set.cookies
+
+    def invalidate(self, proxy_key: str):
+        """Сбрасывает наборы прокси, например после смены его IP"""
+        with self._cond:
+            if proxy_key in self._sets:
+                self._sets[proxy_key].clear()
+            self._generations[proxy_key] = self._generations.get(proxy_key, 0) + 1
+            self._cond.notify_all()
+
+    def available(self, proxy_key: str) -> int:
+        with self._cond:
+            return len(self._sets.get(proxy_key) or ())
+
+    def _drop_expired(self, sets: deque | None):
+        if not sets:
+            return
+        now = time.time()
+        while sets and now - sets[0].harvested_at >= self.ttl:
+            sets.popleft()
+
+    def _next_job(self) -> tuple[str, MobileProxy | None] | None:
+        """Прокси, которому нужен новый набор: не хватает наборов или старейший скоро истечет"""
+        now = time.time()
+        for key, proxy in self._proxies.items():
+            sets = self._sets[key]
+            self._drop_expired(sets)
+            if len(sets) < self.size or now - sets[0].harvested_at >= self.ttl - self.refresh_margin:
+                return key, proxy
+        return None
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                job = self._next_job()
+                if job is None:
+                    self._cond.wait(timeout=30)
+                    continue
+                key, proxy = job
+                generation = self._generations.get(key, 0)
+            cookies = self._harvest(key, proxy)
+            if cookies:
+                with self._cond:
+                    sets = self._sets.get(key)
+                    if self._generations.get(key, 0) != generation:
+                        logger.debug(f"🍪 IP прокси {key} сменился во время сбора, cookies выброшены")
+                    elif sets is not None:
+                        sets.append(CookieSet(cookies=cookies, harvested_at=time.time()))
+                        if len(sets) > self.size:
+                            sets.popleft()
+                logger.debug(f"🍪 Пул cookies для {key}: {self.available(key)}/{self.size}")
+            else:
+                # Не забиваем браузерами CPU при постоянных неудачах
+                self._stop.wait(30)
+
+    def _harvest(self, key: str, proxy: MobileProxy | None) -> dict | None:
+        proxy_obj = Proxy(proxy_string=proxy.proxy_string, change_ip_link=proxy.proxy_change_url) if proxy else None
+        try:
+            cookies = asyncio.run(get_cookies(
+                proxy=proxy_obj,
+                headless=True,
+                use_cache=False,
+                browser_manager=self.browser_manager,
+                resource_policy=self.resource_policy,
+                save=False,
+                profile=pinned_profile(key) if self.impersonation else None
+            ))
+            return cookies if cookies else None
+        except Exception as err:
+            logger.warning(f"Пул cookies: не удалось получить cookies: {err}")
+            return None
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from dataclasses import dataclass
+
+from loguru import logger
+
+from avito_db import AvitoDB
+
+DIRECT_KEY = "direct"  # ключ для работы без прокси
+COOKIES_TTL_MINUTES = 45  # срок годности cookies, если браузер не сообщил настоящий
+
+
+@dataclass
+class StoredCookies:
+    proxy_key: str
+    ip: str | None
+    cookies: dict
+    harvested_at: float
+    expires_at: float | None
+    last_used_at: float | None
+
+
+class CookieStore:
+    """Единое хранилище cookies по ключу прокси вместо cookies_meta.json и cookies.json.
+
+    Записи лежат в SQLite, поэтому запись атомарна и видна всем процессам и
+    потокам (у каждого потока свое соединение). Cookies одного прокси никогда
+    не отдаются другому, а при блокировке или смене IP запись сбрасывается."""
+
+    def __init__(self, db_path: str = "avito_data.db", ttl_minutes: float = COOKIES_TTL_MINUTES):
+        self.db_path = db_path
+        self.ttl = ttl_minutes * 60
+        self._local = threading.local()
+
+    def _db(self) -> AvitoDB:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = AvitoDB(self.db_path)
+        return db
+
+    def entry(self, proxy_key: str) -> StoredCookies | None:
+        row = self._db().get_cookie_entry(proxy_key)
+        if not row:
+            return None
+        key, ip, cookies, harvested_at, expires_at, last_used_at = row
+        try:
+            cookies = json.loads(cookies) if cookies else {}
+        except json.JSONDecodeError:
+            return None
+        return StoredCookies(key, ip, cookies, harvested_at or 0, expires_at, last_used_at)
+
+    def expires_at(self, entry: StoredCookies) -> float:
+        """Настоящий срок годности cookies, а если он неизвестен — TTL от момента сбора"""
+        return entry.expires_at if entry.expires_at else entry.harvested_at + self.ttl
+
+    def get(self, proxy_key: str, ip: str | None = None) -> dict | None:
+        """Действующие cookies прокси; None, если их нет, они истекли или получены с другого IP"""
+        try:
+            entry = self.entry(proxy_key)
+        except Exception as err:
+            logger.warning(f"Не удалось прочитать cookies прокси {proxy_key}: {err}")
+            return None
+        if not entry or not entry.cookies:
+            return None
+        if time.time() >= self.expires_at(entry):
+            return None
+        if ip and entry.ip and ip != entry.ip:
+            return None
+        return entry.cookies
+
+    def save_harvested(self, proxy_key: str, cookies: dict, expires_at: float | None = None, ip: str | None = None):
+        """Сохраняет только что собранные браузером cookies"""
+        if not cookies:
+            return
+        try:
+            self._db().save_harvested_cookies(
+                proxy_key, ip, json.dumps(cookies, ensure_ascii=False), time.time(), expires_at
+            )
+        except Exception as err:
+            logger.warning(f"Не удалось сохранить cookies прокси {proxy_key}: {err}")
+
+    def save_used(self, proxy_key: str, cookies: dict):
+        """Сохраняет актуальный набор cookies после успешного запроса"""
+        if not cookies:
+            return
+        try:
+            self._db().save_used_cookies(proxy_key, json.dumps(cookies, ensure_ascii=False), time.time())
+        except Exception as err:
+            logger.warning(f"Не удалось сохранить cookies прокси {proxy_key}: {err}")
+
+    def invalidate(self, proxy_key: str):
+        """Сбрасывает cookies прокси после блокировки или смены IP"""
+        try:
+            self._db().delete_cookie_entry(proxy_key)
+        except Exception as err:
+            logger.warning(f"Не удалось сбросить cookies прокси {proxy_key}: {err}")
+
+
+_cookie_store: CookieStore | None = None
+_cookie_store_lock = threading.Lock()
+
+
+def get_cookie_store() -> CookieStore:
+    """Общее хранилище cookies процесса"""
+    global _cookie_store
+    with _cookie_store_lock:
+        if _cookie_store is None:
+            _cookie_store = CookieStore()
+        return _cookie_store
@@ -30,7 +30,11 @@ def get_all_data():
                     a.target_place_start,
                     a.target_place_end,
                     a.url,
-                    (SELECT price / 100.0 FROM ad_stats WHERE ad_id = a.id ORDER BY timestamp DESC LIMIT 1) as current_price,
+                    (SELECT price / 100.0 FROM (
+                        SELECT new_price AS price, timestamp FROM bid_changes WHERE ad_id = a.id
+                        UNION ALL
+                        SELECT price, timestamp FROM ad_stats WHERE ad_id = a.id AND price IS NOT NULL
+                    ) ORDER BY timestamp DESC LIMIT 1) as current_price,
                     (SELECT position FROM ad_stats WHERE ad_id = a.id ORDER BY timestamp DESC LIMIT 1) as current_place,
                     (SELECT timestamp FROM ad_stats WHERE ad_id = a.id ORDER BY timestamp DESC LIMIT 1) as last_update
                 FROM ads a 
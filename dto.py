@@ -1,13 +1,43 @@
+import hashlib
 from ctypes import Union
 from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Union
 
+CATALOG_PAGE_SIZE = 50  # объявлений на странице каталога
+MAX_SCAN_PAGES = 20  # предел глубины поиска объявления (scan_max_pages, ads.scan_pages)
+# Позиция, записываемая если объявление не найдено: за пределами любой реальной позиции
+NOT_FOUND_POSITION = MAX_SCAN_PAGES * CATALOG_PAGE_SIZE + 1
+
+
+def proxy_key(proxy_string: str) -> str:
+    """host:port прокси и короткий хеш логина — стабильный идентификатор без пароля.
+    Хеш различает прокси одного шлюза с одинаковым host:port, но разными логинами"""
+    proxy_string = proxy_string.split("//")[-1]
+    login = ""
+    if "@" in proxy_string:
+        left, right = proxy_string.split("@", 1)
+        address, credentials = (right, left) if "." in right else (left, right)
+        login = credentials.split(":")[0]
+    else:
+        parts = proxy_string.split(":")
+        if len(parts) == 4:
+            address, login = (":".join(parts[:2]), parts[2]) if "." in parts[0] else (":".join(parts[2:]), parts[0])
+        else:
+            address = proxy_string
+    if not login:
+        return address
+    return f"{address}#{hashlib.sha1(login.encode('utf-8')).hexdigest()[:8]}"
+
 
 @dataclass
 class Proxy:
     proxy_string: str
     change_ip_link: str
 
+    @property
+    def key(self) -> str:
+        return proxy_key(self.proxy_string)
+
 
 @dataclass
 class ProxySplit:
@@ -17,6 +47,19 @@ class ProxySplit:
     change_ip_link: str
 
 
+@dataclass
+class ScanTarget:
+    """Объявление, позицию которого ищем на странице категории"""
+    ad_id: str
+    profile_id: int
+    token: str | None
+    category: str
+    pages: list[int] = field(default_factory=lambda: [1, 2])  # страницы категории в порядке просмотра
+    target_place_start: int | None = None
+    target_place_end: int | None = None
+    recent_positions: list[int] = field(default_factory=list)  # от новых к старым
+
+
 @dataclass
 class MobileProxy:
     proxy_string: str
@@ -24,6 +67,10 @@ class MobileProxy:
     name: str = "Mobile Proxy"
     active: bool = True
 
+    @property
+    def key(self) -> str:
+        return proxy_key(self.proxy_string)
+
 
 @dataclass
 class AvitoConfig:
@@ -44,3 +91,36 @@ class AvitoConfig:
     proxy_rotation_mode: str = "round_robin"  # round_robin, random, smart
     proxy_max_requests_per_rotation: int = 20
     proxy_switch_on_error: bool = True
+    ip_change_blocking: bool = False  # True — ждать смены IP, как раньше, вместо работы на других прокси
+    parser_mode: str = "sync"  # sync, async, sharded
+    proxy_concurrency: int = 2  # одновременных запросов на один прокси в async режиме
+    proxy_health_alpha: float = 0.2  # коэффициент сглаживания EWMA для режима smart
+    proxy_quarantine_failure_rate: float = 0.5  # доля ошибок, при которой прокси уходит в карантин
+    proxy_quarantine_minutes: int = 10
+    cookie_pool_size: int = 0  # готовых наборов cookies на прокси (0 — пул отключен, Chromium в фоне не запускается)
+    browser_persistent: bool = True  # один долгоживущий Chromium на воркер вместо запуска на каждый сбор cookies
+    browser_max_harvests: int = 20  # перезапуск браузера после стольких сборов cookies
+    impersonation_enabled: bool = True  # TLS-отпечаток curl_cffi и заголовки из одного профиля браузера
+    impersonation_max_block_rate: float = 0.3  # профиль с большей долей блокировок больше не назначается
+    harvest_block_resources: bool = True  # не грузить картинки, шрифты, медиа и трекеры при сборе cookies
+    harvest_block_resource_types: Optional[List[str]] = None  # None — image, media, font
+    harvest_block_domains: Optional[List[str]] = None  # None — TRACKER_DOMAINS из get_cookies.py
+    harvest_allow_patterns: Optional[List[str]] = None  # подстроки URL, которые никогда не блокируются
+    scan_max_pages: int = 2  # глубина поиска по умолчанию, у объявления можно задать свою (ads.scan_pages)
+    adaptive_scan: bool = False  # сканировать стабильные объявления реже, скачущие — чаще; ставки меняются только по свежим позициям
+    scan_min_interval_minutes: float = 5
+    scan_max_interval_minutes: float = 60
+    proxy_rate_per_minute: float = 20  # запросов к каталогу в минуту на один прокси
+    proxy_rate_burst: int = 2
+    api_rate_per_minute: float = 0  # запросов к API Авито в минуту на один токен (0 — без ограничения)
+    api_rate_burst: int = 5
+    api_http2: bool = False  # HTTP/2 к api.avito.ru (нужен пакет h2)
+    reprice_workers: int = 16  # одновременных запросов к API при корректировке ставок
+    reprice_per_token: int = 16  # из них на один токен (при api_rate_per_minute — не больше api_rate_burst)
+    reprice_pipeline: bool = False  # менять ставку сразу по свежей позиции, а не после всего скана (check_and_update_prices)
+    bid_cache_ttl_minutes: float = 30  # срок жизни кэша getBids (0 — без кэша)
+    traffic_retention_days: float = 14  # сколько дней хранить учет трафика по запросам (0 — без очистки)
+    rate_jitter: float = 0.5  # до стольких секунд случайной добавки к паузе (0 — без нее)
+    breaker_failure_threshold: int = 5  # ошибок подряд, после которых прокси или сайт временно исключаются
+    breaker_open_seconds: int = 60
+    position_mode: str = "fast"  # fast — только id из каталога, deep — полная валидация ItemsResponse
@@ -83,21 +83,13 @@ def fetch_and_save_to_json(url, filename='fetch.json', timeout=30, retries=3):
         return None
     finally:
         session.close()
-from bs4 import BeautifulSoup
-import html
-def find_json_on_page(html_code, data_type: str = "mime") -> dict:
-        soup = BeautifulSoup(html_code, "html.parser")
-        try:
-            for _script in soup.select('script'):
-                if data_type == 'mime':
-                    if _script.get('type') == 'mime/invalid' and _script.get(
-                            'data-mfe-state') == 'true':  # and 'sandbox' not in _script.text:
-                        mime_data = json.loads(html.unescape(_script.text)).get('data', {})
-                        return mime_data
+from page_extractor import find_mfe_state
 
-        except Exception as err:
-            print(err)
-        return {}
+
+def find_json_on_page(html_code, data_type: str = "mime") -> dict:
+    if data_type == 'mime':
+        return find_mfe_state(html_code)
+    return {}
 
 def read_html_file(filename='m.html'):
     try:
@@ -1,23 +1,63 @@
 import asyncio
+import atexit
 import random
+import threading
+import time
 import httpx
-import json
-import os
-from datetime import datetime, timedelta
+from dataclasses import dataclass, field
 from loguru import logger
 from playwright.async_api import async_playwright
 from playwright_stealth import Stealth
 from typing import Optional, Dict, List
 
+from cookie_store import DIRECT_KEY, get_cookie_store
 from dto import Proxy, ProxySplit
+from impersonation import ImpersonationProfile
+from page_extractor import BAD_IP_TITLE
 
 USER_AGENTS = [ua.strip() for ua in open("user_agent_pc.txt").readlines()]
 MAX_RETRIES = 3
 RETRY_DELAY = 10
 RETRY_DELAY_WITHOUT_PROXY = 300
-BAD_IP_TITLE = "проблема с ip"
-COOKIES_TTL_MINUTES = 45  # срок годности кеша cookie
-COOKIES_META_FILE = "cookies_meta.json"
+NAVIGATOR_PLATFORMS = {"Windows": "Win32", "macOS": "MacIntel", "Linux": "Linux x86_64"}
+BROWSER_MAX_HARVESTS = 20  # после стольких сборов браузер перезапускается
+# Сторонняя аналитика и реклама, не нужная для получения cookie ft
+TRACKER_DOMAINS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+    "mc.yandex.ru", "an.yandex.ru", "yandex.ru/ads", "adfox.ru",
+    "top-fwz1.mail.ru", "vk.com/rtrg", "tns-counter.ru", "criteo.com", "criteo.net",
+]
+POSSIBLE_VIEWPORTS = [
+    (1366, 768), (1440, 900), (1536, 864), (1600, 900), (1920, 1080)
+]
+
+
+@dataclass
+class ResourcePolicy:
+    """Какие запросы прерывать при сборе cookies, чтобы не тратить трафик прокси"""
+    block_resource_types: List[str] = field(default_factory=lambda: ["image", "media", "font"])
+    block_domains: List[str] = field(default_factory=lambda: list(TRACKER_DOMAINS))
+    allow_patterns: List[str] = field(default_factory=list)  # никогда не блокируются
+
+    @classmethod
+    def from_config(cls, config) -> Optional["ResourcePolicy"]:
+        if not getattr(config, 'harvest_block_resources', True):
+            return None
+        policy = cls()
+        if getattr(config, 'harvest_block_resource_types', None) is not None:
+            policy.block_resource_types = list(config.harvest_block_resource_types)
+        if getattr(config, 'harvest_block_domains', None) is not None:
+            policy.block_domains = list(config.harvest_block_domains)
+        if getattr(config, 'harvest_allow_patterns', None) is not None:
+            policy.allow_patterns = list(config.harvest_allow_patterns)
+        return policy
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        if any(pattern in url for pattern in self.allow_patterns):
+            return False
+        if resource_type in self.block_resource_types:
+            return True
+        return any(domain in url for domain in self.block_domains)
 
 
 class PlaywrightClient:
@@ -26,11 +66,30 @@ class PlaywrightClient:
         proxy: Proxy = None,
         headless: bool = True,
         user_agent: Optional[str] = None,
+        resource_policy: Optional[ResourcePolicy] = None,
+        profile: Optional[ImpersonationProfile] = None,
     ):
         self.proxy = proxy
+        self.resource_policy = resource_policy
+        self.harvest_started = 0.0
+        self.transferred_bytes = 0
+        self.finished_requests = 0
+        self.blocked_requests = 0
+        self._size_tasks: list = []
+        self.expires_at: float | None = None  # срок годности ft из браузера
         self.proxy_split_obj = self.get_proxy_obj()
         self.headless = headless
-        self.user_agent = user_agent or random.choice(USER_AGENTS)
+        # Cookie ft привязан к отпечатку: собираем его с тем же UA и платформой,
+        # с которыми прокси потом ходит через curl_cffi. UA Firefox или Safari
+        # в Chromium дал бы смешанный отпечаток, такой профиль не применяем
+        if profile and not profile.is_chromium:
+            logger.warning(f"Профиль {profile.name} не Chromium, cookies собираются со своим UA браузера")
+            profile = None
+        self.profile = profile
+        self.user_agent = user_agent or (profile.user_agent if profile else None) or random.choice(USER_AGENTS)
+        self.platform = (profile.platform if profile else None) or "Windows"
+        # Рандомизация окна
+        self.viewport = random.choice(POSSIBLE_VIEWPORTS)
         self.context = self.page = self.browser = None
 
     @staticmethod
@@ -79,6 +138,22 @@ class PlaywrightClient:
     def parse_cookie_string(cookie_str: str) -> dict:
         return dict(pair.split("=", 1) for pair in cookie_str.split("; ") if "=" in pair)
 
+    @staticmethod
+    def browser_launch_args(headless: bool, viewport: tuple[int, int]) -> dict:
+        vw, vh = viewport
+        # Всегда используем headless режим (убрана случайная деактивация)
+        # headless оставляем как передано в конструктор
+        return {
+            "headless": headless,
+            "chromium_sandbox": False,
+            "args": [
+                "--disable-blink-features=AutomationControlled",
+                "--no-sandbox",
+                "--disable-dev-shm-usage",
+                f"--window-size={vw},{vh}",
+            ]
+        }
+
     async def launch_browser(self):
         try:
             stealth = Stealth()
@@ -86,50 +161,71 @@ class PlaywrightClient:
             playwright = await self.playwright_context.__aenter__()
             self.playwright = playwright
 
-            # Рандомизация окна
-            possible_viewports = [
-                (1366, 768), (1440, 900), (1536, 864), (1600, 900), (1920, 1080)
-            ]
-            vw, vh = random.choice(possible_viewports)
-            # Всегда используем headless режим (убрана случайная деактивация)
-            # self.headless оставляем как передано в конструктор
-            launch_args = {
-                "headless": self.headless,
-                "chromium_sandbox": False,
-                "args": [
-                    "--disable-blink-features=AutomationControlled",
-                    "--no-sandbox",
-                    "--disable-dev-shm-usage",
-                    f"--window-size={vw},{vh}",
-                ]
-            }
-
-            self.browser = await playwright.chromium.launch(**launch_args)
-
-            context_args = {
-                "user_agent": self.user_agent,
-                "viewport": {"width": vw, "height": vh},
-                "screen": {"width": vw, "height": vh},
-                "device_scale_factor": random.choice([1, 1.25, 1.5]),
-                "is_mobile": False,
-                "has_touch": False,
-            }
-
-            if self.proxy_split_obj:
-                context_args["proxy"] = {
-                    "server": self.proxy_split_obj.ip_port,
-                    "username": self.proxy_split_obj.login,
-                    "password": self.proxy_split_obj.password
-                }
-
-            self.context = await self.browser.new_context(**context_args)
-            self.page = await self.context.new_page()
-            await self._stealth(self.page)
+            self.browser = await playwright.chromium.launch(**self.browser_launch_args(self.headless, self.viewport))
+            await self.open_context(self.browser)
         except Exception as e:
             logger.error(f"Ошибка при запуске браузера: {e}")
             await self._cleanup_on_error()
             raise
 
+    async def open_context(self, browser):
+        """Создает новый изолированный контекст с настройками прокси клиента"""
+        vw, vh = self.viewport
+        context_args = {
+            "user_agent": self.user_agent,
+            "viewport": {"width": vw, "height": vh},
+            "screen": {"width": vw, "height": vh},
+            "device_scale_factor": random.choice([1, 1.25, 1.5]),
+            "is_mobile": False,
+            "has_touch": False,
+        }
+
+        if self.profile:
+            sec_ch = {k: v for k, v in self.profile.headers().items() if k.startswith("sec-ch-")}
+            if sec_ch:
+                context_args["extra_http_headers"] = sec_ch
+
+        if self.proxy_split_obj:
+            context_args["proxy"] = {
+                "server": self.proxy_split_obj.ip_port,
+                "username": self.proxy_split_obj.login,
+                "password": self.proxy_split_obj.password
+            }
+
+        self.context = await browser.new_context(**context_args)
+        self.harvest_started = time.monotonic()
+        self.context.on("requestfinished", self._on_request_finished)
+        if self.resource_policy:
+            await self.context.route("**/*", self._route_request)
+        self.page = await self.context.new_page()
+        await self._stealth(self.page, NAVIGATOR_PLATFORMS.get(self.platform, "Win32"))
+
+    async def _route_request(self, route, request):
+        if self.resource_policy.should_block(request.url, request.resource_type):
+            self.blocked_requests += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def _on_request_finished(self, request):
+        self._size_tasks.append(asyncio.ensure_future(self._count_request_bytes(request)))
+
+    async def _count_request_bytes(self, request):
+        sizes = await request.sizes()
+        self.finished_requests += 1
+        self.transferred_bytes += sum(max(0, sizes.get(k, 0)) for k in (
+            "requestHeadersSize", "requestBodySize", "responseHeadersSize", "responseBodySize"
+        ))
+
+    async def _log_harvest_traffic(self):
+        if self._size_tasks:
+            await asyncio.gather(*self._size_tasks, return_exceptions=True)
+            self._size_tasks.clear()
+        logger.info(
+            f"Сбор cookies: {self.transferred_bytes / 1024:.0f} КБ за {self.finished_requests} запросов, "
+            f"заблокировано {self.blocked_requests}, {time.monotonic() - self.harvest_started:.1f} сек"
+        )
+
     async def _cleanup_on_error(self):
         """Очистка ресурсов при ошибке инициализации"""
         try:
@@ -170,12 +266,23 @@ class PlaywrightClient:
             cookie_dict = self.parse_cookie_string(raw_cookie)
             if cookie_dict.get("ft"):
                 logger.info("Cookies получены")
+                self.expires_at = await self._ft_expires_at()
                 return cookie_dict
             await asyncio.sleep(random.uniform(3.5, 6.0))
 
         logger.warning("Не удалось получить cookies")
         return {}
 
+    async def _ft_expires_at(self) -> float | None:
+        """Срок годности ft — без него остальные cookies бесполезны"""
+        try:
+            for cookie in await self.context.cookies():
+                if cookie.get("name") == "ft" and cookie.get("expires", -1) > 0:
+                    return float(cookie["expires"])
+        except Exception as e:
+            logger.debug(f"Не удалось прочитать срок годности cookies: {e}")
+        return None
+
     async def extract_cookies(self, url: str) -> dict:
         try:
             await self.launch_browser()
@@ -183,6 +290,11 @@ class PlaywrightClient:
             return await self.load_page(url)
         finally:
             # Безопасное закрытие ресурсов
+            try:
+                await self._log_harvest_traffic()
+            except Exception as e:
+                logger.debug(f"Не удалось посчитать трафик сбора cookies: {e}")
+
             try:
                 if hasattr(self, "context") and self.context:
                     await self.context.close()
@@ -201,6 +313,22 @@ class PlaywrightClient:
             except Exception as e:
                 logger.warning(f"Ошибка при закрытии playwright: {e}")
 
+    async def extract_cookies_in_browser(self, browser, url: str) -> dict:
+        """Сбор cookies в новом контексте уже запущенного браузера"""
+        try:
+            await self.open_context(browser)
+            return await self.load_page(url)
+        finally:
+            try:
+                await self._log_harvest_traffic()
+            except Exception as e:
+                logger.debug(f"Не удалось посчитать трафик сбора cookies: {e}")
+            try:
+                if self.context:
+                    await self.context.close()
+            except Exception as e:
+                logger.warning(f"Ошибка при закрытии context: {e}")
+
     async def get_cookies(self, url: str) -> dict:
         return await self.extract_cookies(url)
 
@@ -254,54 +382,174 @@ class PlaywrightClient:
                 return False
 
     @staticmethod
-    async def _stealth(page):
+    async def _stealth(page, navigator_platform: str = "Win32"):
         await page.add_init_script("""
             Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-            Object.defineProperty(navigator, 'platform', { get: () => 'Win32' });
+            Object.defineProperty(navigator, 'platform', { get: () => '%s' });
             Object.defineProperty(navigator, 'vendor', { get: () => 'Google Inc.' });
             window.chrome = { runtime: {} };
             Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3] });
             Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
-        """)
+        """ % navigator_platform)
 
-    @staticmethod
-    async def _block_images(route, request):
-        if request.resource_type == "image":
-            await route.abort()
-        else:
-            await route.continue_()
+
+class BrowserManager:
+    """Долгоживущий Chromium одного воркера.
+
+    Браузер запускается один раз в собственном потоке с event loop, каждый
+    сбор cookies получает новый инкогнито-контекст с прокси этого сбора.
+    Браузер перезапускается после max_harvests сборов или при падении —
+    только когда в нем не осталось открытых контекстов других сборов."""
+
+    def __init__(self, name: str, headless: bool = True, max_harvests: int = BROWSER_MAX_HARVESTS):
+        self.name = name
+        self.headless = headless
+        self.max_harvests = max(1, max_harvests)
+        self.harvests = 0
+        self.browser = None
+        self._playwright_context = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name=f"browser-{name}", daemon=True)
+        self._thread.start()
+        self._cond = asyncio.Condition()
+        self._active = 0  # сборов, у которых сейчас открыт контекст в браузере
+
+    def _needs_restart(self) -> bool:
+        return not (self.browser and self.browser.is_connected() and self.harvests < self.max_harvests)
+
+    async def _ensure_browser(self):
+        if not self._needs_restart():
+            return
+        if self.browser:
+            reason = "упал" if not self.browser.is_connected() else f"{self.harvests} сборов"
+            logger.info(f"[browser-{self.name}] Перезапуск браузера ({reason})")
+        await self._close_browser()
+        stealth = Stealth()
+        self._playwright_context = stealth.use_async(async_playwright())
+        playwright = await self._playwright_context.__aenter__()
+        self.browser = await playwright.chromium.launch(
+            **PlaywrightClient.browser_launch_args(self.headless, random.choice(POSSIBLE_VIEWPORTS))
+        )
+        self.harvests = 0
+        logger.info(f"[browser-{self.name}] Браузер запущен")
+
+    async def _close_browser(self):
+        try:
+            if self.browser:
+                await self.browser.close()
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии browser: {e}")
+        try:
+            if self._playwright_context:
+                await self._playwright_context.__aexit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии playwright: {e}")
+        self.browser = self._playwright_context = None
+
+    async def _harvest(
+            self, proxy: Proxy | None, url: str, resource_policy: ResourcePolicy | None,
+            profile: ImpersonationProfile | None = None
+    ) -> tuple[dict, float | None]:
+        async with self._cond:
+            # Перезапуск закрыл бы контексты текущих сборов — ждем, пока они закончатся
+            while self._needs_restart() and self._active:
+                await self._cond.wait()
+            await self._ensure_browser()
+            self.harvests += 1
+            self._active += 1
+            browser = self.browser
+        client = PlaywrightClient(proxy=proxy, headless=self.headless, resource_policy=resource_policy, profile=profile)
+        try:
+            cookies = await client.extract_cookies_in_browser(browser, url)
+            return cookies, client.expires_at
+        except Exception:
+            if not browser.is_connected():
+                logger.warning(f"[browser-{self.name}] Браузер упал во время сбора cookies")
+            raise
+        finally:
+            async with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    async def harvest(
+            self, proxy: Proxy | None, url: str, resource_policy: ResourcePolicy | None = None,
+            profile: ImpersonationProfile | None = None
+    ) -> tuple[dict, float | None]:
+        """Собирает cookies в браузере менеджера; можно вызывать из любого event loop.
+        Возвращает cookies и срок годности ft"""
+        future = asyncio.run_coroutine_threadsafe(self._harvest(proxy, url, resource_policy, profile), self._loop)
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        if self._loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self._close_browser(), self._loop).result(timeout=15)
+            except Exception as e:
+                logger.warning(f"Ошибка при остановке браузера {self.name}: {e}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_browser_managers: Dict[str, BrowserManager] = {}
+_browser_managers_lock = threading.Lock()
 
 
-async def get_cookies(proxy: Proxy = None, headless: bool = True) -> dict:
-    # Кеширование cookie чтобы не дергать слишком часто
-    try:
-        if os.path.exists(COOKIES_META_FILE):
-            with open(COOKIES_META_FILE, 'r', encoding='utf-8') as f:
-                meta = json.load(f)
-            ts = meta.get('timestamp')
-            cookies_cached = meta.get('cookies')
-            if ts and cookies_cached:
-                dt = datetime.fromisoformat(ts)
-                if datetime.utcnow() - dt < timedelta(minutes=COOKIES_TTL_MINUTES):
-                    logger.info("Используем кешированные cookies")
-                    return cookies_cached
-    except Exception as e:
-        logger.warning(f"Проблема чтения кеша cookies: {e}")
+def get_browser_manager(name: str, headless: bool = True, max_harvests: int = BROWSER_MAX_HARVESTS) -> BrowserManager:
+    """Возвращает браузер воркера name, создавая его при первом обращении"""
+    with _browser_managers_lock:
+        manager = _browser_managers.get(name)
+        if manager is None:
+            manager = BrowserManager(name, headless=headless, max_harvests=max_harvests)
+            _browser_managers[name] = manager
+        return manager
+
+
+@atexit.register
+def close_browser_managers():
+    with _browser_managers_lock:
+        managers = list(_browser_managers.values())
+        _browser_managers.clear()
+    for manager in managers:
+        manager.close()
+
+
+async def get_cookies(
+        proxy: Proxy = None,
+        headless: bool = True,
+        use_cache: bool = True,
+        browser_manager: BrowserManager | None = None,
+        resource_policy: ResourcePolicy | None = None,
+        save: bool = True,
+        profile: ImpersonationProfile | None = None
+) -> dict:
+    """Cookies прокси: use_cache — сначала взять действующие из хранилища,
+    save — записать собранные браузером в хранилище (пул хранит свои наборы сам),
+    profile — профиль отпечатка, закрепленный за прокси (UA и sec-ch браузера)"""
+    # Кеширование cookie чтобы не дергать слишком часто: только cookies этого же прокси
+    store = get_cookie_store()
+    proxy_key = proxy.key if proxy else DIRECT_KEY
+    if use_cache:
+        cookies_cached = store.get(proxy_key)
+        if cookies_cached:
+            logger.info(f"Используем кешированные cookies прокси {proxy_key}")
+            return cookies_cached
 
     logger.info("Пытаюсь обновить cookies через Playwright")
-    client = PlaywrightClient(
-        proxy=proxy,
-        headless=headless
-    )
     ads_id = str(random.randint(1111111111, 9999999999))
-    cookies = await client.get_cookies(f"https://www.avito.ru/{ads_id}")
-
-    # Сохраняем кеш
-    try:
-        with open(COOKIES_META_FILE, 'w', encoding='utf-8') as f:
-            json.dump({"timestamp": datetime.utcnow().isoformat(), "cookies": cookies}, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.warning(f"Не удалось сохранить кеш cookies: {e}")
+    if browser_manager:
+        cookies, expires_at = await browser_manager.harvest(
+            proxy, f"https://www.avito.ru/{ads_id}", resource_policy, profile
+        )
+    else:
+        client = PlaywrightClient(
+            proxy=proxy,
+            headless=headless,
+            resource_policy=resource_policy,
+            profile=profile
+        )
+        cookies = await client.get_cookies(f"https://www.avito.ru/{ads_id}")
+        expires_at = client.expires_at
+
+    if save:
+        store.save_harvested(proxy_key, cookies, expires_at)
 
     return cookies
-
@@ -0,0 +1,232 @@
+import random
+import re
+import threading
+from dataclasses import dataclass
+
+from loguru import logger
+
+from common_data import HEADERS
+
+BLOCK_STATUSES = (302, 401, 403, 422, 429)  # ответы, которые fetch_data считает блокировкой
+MIN_SAMPLES_FOR_DROP = 20
+FLUSH_EVERY = 20  # сохранять статистику в БД каждые N запросов
+SEC_CH_HEADERS = ('sec-ch-ua', 'sec-ch-ua-mobile', 'sec-ch-ua-platform')
+
+
+@dataclass(frozen=True)
+class ImpersonationProfile:
+    """Согласованный отпечаток браузера: TLS/HTTP2 цель curl_cffi, User-Agent и sec-ch заголовки"""
+    name: str
+    impersonate: str  # цель impersonate= в curl_cffi
+    user_agent: str
+    sec_ch_ua: str | None = None  # только у Chromium-браузеров
+    platform: str | None = None
+
+    @property
+    def is_chromium(self) -> bool:
+        return self.sec_ch_ua is not None
+
+    def headers(self) -> dict:
+        # accept-encoding не задаем: curl_cffi выставляет его по цели impersonate и сам распаковывает ответ
+        headers = {k: v for k, v in HEADERS.items() if k not in SEC_CH_HEADERS}
+        headers['user-agent'] = self.user_agent
+        if self.sec_ch_ua:
+            headers['sec-ch-ua'] = self.sec_ch_ua
+            headers['sec-ch-ua-mobile'] = '?0'
+            headers['sec-ch-ua-platform'] = f'"{self.platform or "Windows"}"'
+        return headers
+
+
+def _chrome_sec_ch_ua(version: int) -> str:
+    return f'"Chromium";v="{version}", "Google Chrome";v="{version}", "Not.A/Brand";v="99"'
+
+
+def _chrome(version: int, target: str, platform: str, os_token: str) -> ImpersonationProfile:
+    return ImpersonationProfile(
+        name=f"{target}-{platform.lower()}",
+        impersonate=target,
+        user_agent=f"Mozilla/5.0 ({os_token}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{version}.0.0.0 Safari/537.36",
+        sec_ch_ua=_chrome_sec_ch_ua(version),
+        platform=platform,
+    )
+
+
+WINDOWS = "Windows NT 10.0; Win64; x64"
+MACOS = "Macintosh; Intel Mac OS X 10_15_7"
+
+BUILTIN_PROFILES = [
+    _chrome(136, "chrome136", "Windows", WINDOWS),
+    _chrome(131, "chrome131", "Windows", WINDOWS),
+    _chrome(131, "chrome131", "macOS", MACOS),
+    _chrome(124, "chrome124", "Windows", WINDOWS),
+    ImpersonationProfile(
+        name="safari17_0-macos",
+        impersonate="safari17_0",
+        user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 "
+                   "(KHTML, like Gecko) Version/17.0 Safari/605.1.15",
+    ),
+    ImpersonationProfile(
+        name="firefox133-windows",
+        impersonate="firefox133",
+        user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:133.0) Gecko/20100101 Firefox/133.0",
+    ),
+]
+
+
+def _ua_platform(user_agent: str) -> str:
+    if "Windows" in user_agent:
+        return "Windows"
+    if "Macintosh" in user_agent:
+        return "macOS"
+    return "Linux"
+
+
+def profiles_from_user_agents(path: str = "user_agent_pc.txt") -> list[ImpersonationProfile]:
+    """Профили для строк user_agent_pc.txt, у которых есть подходящая цель curl_cffi.
+
+    Берутся только чистый Chrome 104 и Safari 15: для Firefox 103, Edge, Opera,
+    Vivaldi и Яндекс.Браузера нет отпечатка той же версии и тех же sec-ch брендов."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            user_agents = [line.strip() for line in f if line.strip()]
+    except OSError:
+        return []
+    profiles = []
+    for i, ua in enumerate(user_agents):
+        platform = _ua_platform(ua)
+        chrome = re.search(r"Chrome/(\d+)\.0\.0\.0 Safari/537\.36$", ua)
+        if chrome and chrome.group(1) == "104":
+            profiles.append(ImpersonationProfile(
+                name=f"chrome104-{platform.lower()}-{i}",
+                impersonate="chrome104",
+                user_agent=ua,
+                sec_ch_ua=_chrome_sec_ch_ua(104),
+                platform=platform,
+            ))
+        elif "Version/15" in ua and "Chrome" not in ua:
+            profiles.append(ImpersonationProfile(
+                name=f"safari15_5-{i}", impersonate="safari15_5", user_agent=ua
+            ))
+    return profiles
+
+
+ALL_PROFILES = BUILTIN_PROFILES + profiles_from_user_agents()
+# Cookies собирает Playwright Chromium, поэтому за прокси закрепляются только
+# Chromium-профили: UA Firefox или Safari не сходится с TLS и navigator браузера
+HARVESTABLE_PROFILES = [p for p in ALL_PROFILES if p.is_chromium]
+
+# Закрепление профилей за прокси живет весь процесс, а не один цикл парсера
+_pins: dict[str, str] = {}
+_pins_lock = threading.Lock()
+
+
+@dataclass
+class ProfileStats:
+    requests: int = 0
+    blocks: int = 0
+
+    @property
+    def block_rate(self) -> float:
+        return self.blocks / self.requests if self.requests else 0.0
+
+
+def pinned_profile(proxy_key: str) -> ImpersonationProfile:
+    """Профиль прокси для сбора cookies вне трекера (например, в пуле):
+    закрепленный, а если его еще нет — случайный, который сразу закрепляется"""
+    profiles = {p.name: p for p in HARVESTABLE_PROFILES}
+    with _pins_lock:
+        name = _pins.get(proxy_key)
+        if name not in profiles:
+            name = _pins[proxy_key] = random.choice(HARVESTABLE_PROFILES).name
+        return profiles[name]
+
+
+class ImpersonationTracker:
+    """Выдает каждому прокси один профиль и считает долю блокировок по профилям.
+
+    Профиль закреплен за прокси до смены IP, чтобы TLS-отпечаток и cookies
+    одной "сессии" не менялись. Профили, у которых доля блокировок выше
+    max_block_rate, больше не назначаются. По умолчанию выбор идет только
+    из HARVESTABLE_PROFILES. Статистика копится в таблице impersonation_stats."""
+
+    def __init__(self, db, max_block_rate: float = 0.3, profiles: list[ImpersonationProfile] | None = None):
+        self.db = db
+        self.max_block_rate = max_block_rate
+        self.profiles = {p.name: p for p in (profiles or HARVESTABLE_PROFILES)}
+        self.stats: dict[str, ProfileStats] = {name: ProfileStats() for name in self.profiles}
+        self._pending: dict[str, ProfileStats] = {}
+        self._records_since_flush = 0
+        self.flush_every = FLUSH_EVERY  # 0 — сохранять только явным flush()
+        self._lock = threading.Lock()  # flush может идти из другого потока (async режим)
+        try:
+            for name, requests_count, blocks in db.get_impersonation_stats():
+                if name in self.stats:
+                    self.stats[name] = ProfileStats(requests_count, blocks)
+        except Exception as err:
+            logger.warning(f"Не удалось загрузить статистику профилей: {err}")
+
+    def is_flagged(self, name: str) -> bool:
+        stats = self.stats[name]
+        return stats.requests >= MIN_SAMPLES_FOR_DROP and stats.block_rate > self.max_block_rate
+
+    def _pick(self, exclude: str | None = None) -> ImpersonationProfile:
+        candidates = [n for n in self.profiles if n != exclude and not self.is_flagged(n)]
+        if not candidates:
+            # Все профили помечены — берем наименее блокируемый
+            candidates = [min(self.profiles, key=lambda n: self.stats[n].block_rate)]
+        return self.profiles[random.choice(candidates)]
+
+    def profile_for(self, proxy_key: str) -> ImpersonationProfile:
+        with _pins_lock:
+            name = _pins.get(proxy_key)
+            if name not in self.profiles or self.is_flagged(name):
+                if name in self.profiles:
+                    logger.warning(f"🎭 Профиль {name} блокируется слишком часто, меняю для {proxy_key}")
+                name = self._pick(exclude=name).name
+                _pins[proxy_key] = name
+                logger.info(f"🎭 Прокси {proxy_key} работает с профилем {name}")
+            return self.profiles[name]
+
+    def repin(self, proxy_key: str):
+        """Новый IP — новая сессия, можно сменить и отпечаток"""
+        with _pins_lock:
+            old = _pins.pop(proxy_key, None)
+            if old in self.profiles:
+                _pins[proxy_key] = self._pick(exclude=old).name
+
+    def record(self, name: str, status_code: int | None, blocked: bool = False):
+        if status_code is None or name not in self.stats:
+            return
+        blocked = 1 if blocked or status_code in BLOCK_STATUSES else 0
+        with self._lock:
+            for stats in (self.stats[name], self._pending.setdefault(name, ProfileStats())):
+                stats.requests += 1
+                stats.blocks += blocked
+            self._records_since_flush += 1
+            due = self.flush_every and self._records_since_flush >= self.flush_every
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Сохраняет приращения, поэтому воркеры шардов не затирают счетчики друг друга"""
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [(n, s.requests, s.blocks) for n, s in self._pending.items()]
+            self._pending.clear()
+            self._records_since_flush = 0
+        try:
+            self.db.add_impersonation_stats(rows)
+        except Exception as err:
+            with self._lock:
+                for name, requests_count, blocks in rows:
+                    pending = self._pending.setdefault(name, ProfileStats())
+                    pending.requests += requests_count
+                    pending.blocks += blocks
+            logger.warning(f"Не удалось сохранить статистику профилей: {err}")
+
+    def report(self):
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1].requests):
+            if stats.requests:
+                flag = " — не используется" if self.is_flagged(name) else ""
+                logger.info(f"🎭 {name}: {stats.requests} запросов, блокировки {stats.block_rate:.1%}{flag}")
@@ -45,6 +45,11 @@ def init_db_from_config(config_path: str = "config.json", db_path: str = "avito_
             comment = url_pair.get("comment")
             daily_budget = url_pair.get("daily_budget")
             active = url_pair.get("active", True)  # По умолчанию True для обратной совместимости
+            scan_pages = url_pair.get("scan_pages")  # None — глубина поиска из scan_max_pages
+            # Окно работы объявления (см. ad_schedule.py), пусто — всегда
+            schedule_days = url_pair.get("schedule_days") or None
+            schedule_hours = url_pair.get("schedule_hours") or None
+            schedule_tz = url_pair.get("schedule_tz") or None
             
             if not all([ad_url, category, max_price is not None, 
                        target_place_start is not None, target_place_end is not None]):
@@ -63,7 +68,11 @@ def init_db_from_config(config_path: str = "config.json", db_path: str = "avito_
                 'target_place_end': int(target_place_end),
                 'comment': comment,
                 'daily_budget': daily_budget,
-                'active': active
+                'active': active,
+                'scan_pages': int(scan_pages) if scan_pages else None,
+                'schedule_days': schedule_days,
+                'schedule_hours': schedule_hours,
+                'schedule_tz': schedule_tz
             }
     
     print(f"📊 В конфиге найдено: {len(config_profiles)} профилей, {len(config_ads)} объявлений")
@@ -169,13 +178,15 @@ def init_db_from_config(config_path: str = "config.json", db_path: str = "avito_
                     UPDATE ads 
                     SET category = ?, profile_id = ?, max_price = ?, 
                         target_place_start = ?, target_place_end = ?, 
-                        comment = ?, url = ?, daily_budget = ?, active = ?
+                        comment = ?, url = ?, daily_budget = ?, active = ?, scan_pages = ?,
+                        schedule_days = ?, schedule_hours = ?, schedule_tz = ?
                     WHERE id = ?
                 """, (
                     ad_data['category'], profile_id, ad_data['max_price'],
                     ad_data['target_place_start'], ad_data['target_place_end'],
                     ad_data['comment'], ad_data['ad_url'], ad_data.get('daily_budget'),
-                    ad_data.get('active', True), ad_id
+                    ad_data.get('active', True), ad_data.get('scan_pages'),
+                    ad_data.get('schedule_days'), ad_data.get('schedule_hours'), ad_data.get('schedule_tz'), ad_id
                 ))
                 print(f"  🔄 Обновлено объявление: {ad_id}")
             else:
@@ -185,7 +196,8 @@ def init_db_from_config(config_path: str = "config.json", db_path: str = "avito_
                     ad_data['max_price'], 
                     ad_data['target_place_start'], ad_data['target_place_end'], 
                     ad_data['comment'], ad_data['ad_url'], ad_data.get('daily_budget'),
-                    ad_data.get('active', True)
+                    ad_data.get('active', True), ad_data.get('scan_pages'),
+                    ad_data.get('schedule_days'), ad_data.get('schedule_hours'), ad_data.get('schedule_tz')
                 )
                 print(f"  ✅ Добавлено объявление: {ad_id}")
         except Exception as e:
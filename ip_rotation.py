@@ -0,0 +1,78 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from loguru import logger
+
+
+@dataclass
+class IpChangeResult:
+    """Итог фоновой смены IP одного прокси"""
+    proxy_key: str
+    success: bool
+    cookies: dict | None = None
+
+
+class IpChangeManager:
+    """Смена IP в фоне: не больше одной операции на прокси одновременно.
+
+    Пока прокси меняет IP, парсер продолжает работу на других прокси, а
+    запросы к этому прокси дожидаются результата через wait()."""
+
+    def __init__(self, max_workers: int = 4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ip-change")
+        self._futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def request(self, proxy_key: str, task: Callable[[], IpChangeResult]) -> Future:
+        """Запускает смену IP, если для прокси она еще не идет"""
+        with self._lock:
+            future = self._futures.get(proxy_key)
+            if future is None or future.done():
+                logger.info(f"🔄 Фоновая смена IP для прокси {proxy_key}")
+                future = self._executor.submit(task)
+                self._futures[proxy_key] = future
+            return future
+
+    def is_changing(self, proxy_key: str) -> bool:
+        with self._lock:
+            future = self._futures.get(proxy_key)
+            return future is not None and not future.done()
+
+    def pop_finished(self) -> list[IpChangeResult]:
+        """Забирает результаты завершившихся смен IP"""
+        results = []
+        with self._lock:
+            for key, future in list(self._futures.items()):
+                if future.done():
+                    del self._futures[key]
+                    results.append(self._result(key, future))
+        return results
+
+    def wait(self, proxy_key: str, timeout: float | None = None) -> IpChangeResult | None:
+        with self._lock:
+            future = self._futures.get(proxy_key)
+        if future is None:
+            return None
+        try:
+            future.result(timeout=timeout)
+        except TimeoutError:
+            return None
+        except Exception:
+            pass
+        with self._lock:
+            if self._futures.get(proxy_key) is future:
+                del self._futures[proxy_key]
+        return self._result(proxy_key, future)
+
+    @staticmethod
+    def _result(proxy_key: str, future: Future) -> IpChangeResult:
+        try:
+            return future.result()
+        except Exception as err:
+            logger.error(f"Ошибка фоновой смены IP для прокси {proxy_key}: {err}")
+            return IpChangeResult(proxy_key=proxy_key, success=False)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
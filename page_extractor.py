@@ -0,0 +1,135 @@
+import html
+import json
+
+from bs4 import BeautifulSoup
+from loguru import logger
+
+SCRIPT_OPEN = "<script"
+SCRIPT_CLOSE = "</script>"
+MFE_STATE_ATTR = 'data-mfe-state="true"'
+MIME_TYPE_ATTR = 'type="mime/invalid"'
+BAD_IP_TITLE = "проблема с ip"
+# Заголовки страниц-заглушек, которые Авито отдает со статусом 200
+BLOCK_TITLES = (BAD_IP_TITLE, "доступ ограничен", "доступ временно ограничен", "captcha", "капча")
+MIN_PAGE_SIZE = 20_000  # страница каталога весит сотни КБ, заглушка — единицы
+
+
+def _find_mfe_payload(page, script_open, script_close, state_attr, mime_attr, tag_close):
+    """Возвращает содержимое первого <script type="mime/invalid" data-mfe-state="true">
+    или None. Работает одинаково для str и bytes — маркеры передаются того же типа."""
+    pos = 0
+    while True:
+        marker = page.find(state_attr, pos)
+        if marker == -1:
+            return None
+        tag_start = page.rfind(script_open, 0, marker)
+        tag_end = page.find(tag_close, marker)
+        if tag_end == -1:
+            return None
+        pos = tag_end
+        # Маркер должен стоять внутри открывающего тега <script ...>
+        if tag_start == -1 or page.find(tag_close, tag_start, marker) != -1:
+            continue
+        if page.find(mime_attr, tag_start, tag_end) == -1:
+            continue
+        body_end = page.find(script_close, tag_end)
+        if body_end == -1:
+            return None
+        return page[tag_end + 1:body_end]
+
+
+def extract_mfe_state_fast(html_code: str | bytes) -> dict | None:
+    """Быстрый путь: поиск скрипта mfe-state сканированием строки без построения DOM.
+    Возвращает None, если тег не найден в ожидаемом виде."""
+    if isinstance(html_code, bytes):
+        payload = _find_mfe_payload(
+            html_code, SCRIPT_OPEN.encode(), SCRIPT_CLOSE.encode(), MFE_STATE_ATTR.encode(), MIME_TYPE_ATTR.encode(), b">"
+        )
+        if payload is not None:
+            payload = payload.decode("utf-8")
+    else:
+        payload = _find_mfe_payload(html_code, SCRIPT_OPEN, SCRIPT_CLOSE, MFE_STATE_ATTR, MIME_TYPE_ATTR, ">")
+    if payload is None:
+        return None
+    return json.loads(html.unescape(payload)).get('data', {})
+
+
+def extract_mfe_state_soup(html_code: str | bytes) -> dict:
+    """Медленный путь через BeautifulSoup (прежняя реализация find_json_on_page)"""
+    soup = BeautifulSoup(html_code, "html.parser")
+    for _script in soup.select('script'):
+        if _script.get('type') == 'mime/invalid' and _script.get('data-mfe-state') == 'true':
+            return json.loads(html.unescape(_script.text)).get('data', {})
+    return {}
+
+
+def find_mfe_state(html_code: str | bytes) -> dict:
+    """Достает data из mfe-state скрипта страницы: сначала быстрым сканированием,
+    при неудаче — через BeautifulSoup"""
+    try:
+        data = extract_mfe_state_fast(html_code)
+        if data is not None:
+            return data
+        logger.debug("mfe-state не найден быстрым поиском, пробуем BeautifulSoup")
+    except Exception as err:
+        logger.debug(f"Быстрый разбор mfe-state не удался: {err}, пробуем BeautifulSoup")
+    try:
+        return extract_mfe_state_soup(html_code)
+    except Exception as err:
+        logger.error(f"Ошибка при поиске информации на странице: {err}")
+    return {}
+
+
+def _page_title(html_code: str | bytes) -> str:
+    head = html_code[:20_000]
+    if isinstance(head, bytes):
+        head = head.decode("utf-8", errors="ignore")
+    start = head.lower().find("<title")
+    if start == -1:
+        return ""
+    start = head.find(">", start) + 1
+    end = head.find("</title>", start)
+    return html.unescape(head[start:end if end != -1 else start + 300]).strip()
+
+
+def soft_block_reason(html_code: str | bytes | None) -> str | None:
+    """Дешевая проверка ответа 200 до разбора: None — похоже на настоящую страницу,
+    иначе причина, по которой это заглушка (капча, блокировка IP, пустой ответ)"""
+    if not html_code:
+        return "пустой ответ"
+    marker = MFE_STATE_ATTR.encode() if isinstance(html_code, bytes) else MFE_STATE_ATTR
+    if marker in html_code:
+        return None
+    title = _page_title(html_code)
+    lowered = title.lower()
+    for block_title in BLOCK_TITLES:
+        if block_title in lowered:
+            return f"заглушка «{title}»"
+    if len(html_code) < MIN_PAGE_SIZE:
+        return f"маленький ответ без mfe-state ({len(html_code)} байт)"
+    return "нет mfe-state"
+
+
+def extract_catalog_ids(catalog: dict, with_flags: bool = False) -> list:
+    """Упорядоченный список id объявлений каталога без pydantic-валидации.
+
+    Элементы без id пропускаются так же, как в AvitoParse._clean_null_ads, поэтому
+    позиции совпадают с режимом полной валидации. С with_flags возвращает словари
+    с id, type и признаком VIP-размещения."""
+    items = catalog.get("items") if isinstance(catalog, dict) else None
+    if not isinstance(items, list):
+        return []
+    result = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get("id"):
+            continue
+        if with_flags:
+            item_type = item.get("type")
+            result.append({
+                "id": str(item["id"]),
+                "type": item_type,
+                "vip": bool(item.get("isVip") or item_type == "vip"),
+            })
+        else:
+            result.append(str(item["id"]))
+    return result
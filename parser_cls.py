@@ -1,28 +1,40 @@
 import asyncio
-import html
-import json
 import random
+import sys
 import time
 import urllib3
 from urllib.parse import unquote, urlparse, parse_qs, urlencode, urlunparse
-from bs4 import BeautifulSoup
 from curl_cffi import requests
-from curl_cffi.requests import RequestsError
 from loguru import logger
 from pydantic import ValidationError
-from requests.cookies import RequestsCookieJar
 from common_data import HEADERS
-from dto import Proxy, AvitoConfig
-from get_cookies import get_cookies
+from dto import CATALOG_PAGE_SIZE, MAX_SCAN_PAGES, NOT_FOUND_POSITION, Proxy, AvitoConfig, ScanTarget, MobileProxy
+from get_cookies import ResourcePolicy, get_cookies, get_browser_manager
+from cookie_store import DIRECT_KEY, get_cookie_store
 from load_config import load_avito_config
 from models import ItemsResponse, Item
+from page_extractor import find_mfe_state, extract_catalog_ids, soft_block_reason
+from proxy_health import ProxyHealthTracker
+from impersonation import ImpersonationTracker
+from traffic import CURL_INFOS, TrafficMeter
+from rate_limiter import get_rate_limiter
+from retry_policy import ErrorKind, FetchOutcome, backoff_delay, classify_exception, classify_status, get_breakers
+from scan_scheduler import ScanScheduler
+from ad_schedule import is_within_schedule
+from ip_rotation import IpChangeManager, IpChangeResult
+from cookie_pool import CookiePool
 from avito_db import AvitoDB
-from price_manager import check_and_update_prices, get_bid_info
+from price_manager import check_and_update_prices, get_bid_info, get_reprice_pipeline, refresh_tokens
+from api_client import get_api_client
+from bid_cache import get_bid_cache
 from init_ads import init_db_from_config
 # Отключаем предупреждения SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 DEBUG_MODE = False
+MAX_PAGES = 2  # сколько страниц категории просматриваем в поиске объявления (по умолчанию)
+POSITION_HISTORY = 3  # сколько последних позиций учитываем при выборе стартовой страницы
+COOKIE_FLUSH_INTERVAL = 30  # секунд между сохранениями изменившихся cookies
 
 logger.add("logs/app.log", rotation="5 MB", retention="10 days", level="DEBUG")
 
@@ -31,20 +43,34 @@ class AvitoParse:
     def __init__(
             self,
             config: AvitoConfig,
-            stop_event=None
+            stop_event=None,
+            proxies: list[MobileProxy] | None = None,
+            cookie_pool: CookiePool | None = None,
+            worker_name: str = "main"
     ):
         # Базовая конфигурация
         self.config = config
         self.stop_event = stop_event
 
-        # Прокси
-        self.mobile_proxies = self._load_mobile_proxies()
+        # Прокси (proxies задается при работе воркером шарда на одном прокси)
+        self.mobile_proxies = proxies if proxies is not None else self._load_mobile_proxies()
         self.current_proxy_index = 0
         self.proxy_obj = self.get_current_proxy_obj()
 
         # HTTP / сессия / cookies
         self.cookies = None
-        self.session = requests.Session()
+        self.proxy_cookies: dict[str, dict] = {}  # cookies, полученные при смене IP каждого прокси
+        self.cookie_store = get_cookie_store()
+        self._pending_cookies: dict[str, dict] = {}  # изменившиеся, но еще не сохраненные cookies
+        self._saved_cookies: dict[str, dict] = {}
+        self._last_cookie_flush = time.time()
+        self.cookie_flushes = 0  # сохранений cookies за цикл
+        self.cookie_pool = cookie_pool
+        self.resource_policy = ResourcePolicy.from_config(config)
+        self.browser_manager = get_browser_manager(
+            worker_name, max_harvests=getattr(config, 'browser_max_harvests', 20)
+        ) if getattr(config, 'browser_persistent', True) else None
+        self.sessions: dict[str, requests.Session] = {}  # своя сессия и cookie jar на каждый прокси
 
         # Счетчики и состояния
         self.requests_count = 0
@@ -53,20 +79,77 @@ class AvitoParse:
         self.proxy_requests_count = 0  # Счетчик запросов для текущего прокси
         self.last_ip_change = 0  # метка времени последней смены IP
 
+        # Предохранители прокси и сайта, общие для всех воркеров
+        self.breakers = get_breakers(
+            failure_threshold=getattr(config, 'breaker_failure_threshold', 5),
+            open_seconds=getattr(config, 'breaker_open_seconds', 60)
+        )
+
+        # Темп запросов к каталогу: корзина токенов на каждый прокси, общая для всех воркеров
+        self.rate_limiter = get_rate_limiter(
+            "proxy",
+            rate_per_minute=getattr(config, 'proxy_rate_per_minute', 20),
+            burst=getattr(config, 'proxy_rate_burst', 2),
+            jitter=getattr(config, 'rate_jitter', 0.5)
+        )
+
         # Работа с БД
         self.db = AvitoDB()
 
+        # Фоновая смена IP: прокси меняет IP, остальные продолжают работу
+        self.ip_changes = IpChangeManager(max_workers=max(1, len(self.mobile_proxies)))
+
+        # Оценки здоровья прокси для режима ротации "smart"
+        self.health = ProxyHealthTracker(
+            self.db,
+            alpha=getattr(config, 'proxy_health_alpha', 0.2),
+            quarantine_failure_rate=getattr(config, 'proxy_quarantine_failure_rate', 0.5),
+            quarantine_minutes=getattr(config, 'proxy_quarantine_minutes', 10)
+        )
+
+        # Адаптивное расписание сканов по объявлениям
+        self.scheduler = ScanScheduler(
+            self.db,
+            min_interval_minutes=getattr(config, 'scan_min_interval_minutes', 5),
+            max_interval_minutes=getattr(config, 'scan_max_interval_minutes', 60)
+        ) if getattr(config, 'adaptive_scan', False) else None
+
+        self.scanned_ads: set[str] = set()  # объявления со свежей позицией за этот цикл
+
+        # Корректировка ставок сразу по свежим позициям, параллельно со сканом
+        self.repricer = get_reprice_pipeline(
+            max_workers=getattr(config, 'reprice_workers', 16),
+            per_token=getattr(config, 'reprice_per_token', 16)
+        ) if getattr(config, 'reprice_pipeline', False) else None
+
+        # Учет трафика прокси по запросам, объявлениям и циклам
+        self.traffic = TrafficMeter(self.db, retention_days=getattr(config, 'traffic_retention_days', 14))
+
+        # Отпечатки браузера (TLS + заголовки), закрепленные за прокси
+        self.impersonation = ImpersonationTracker(
+            self.db, max_block_rate=getattr(config, 'impersonation_max_block_rate', 0.3)
+        ) if getattr(config, 'impersonation_enabled', True) else None
+
     def _load_mobile_proxies(self) -> list:
         """Загружает активные мобильные прокси из конфига"""
         if hasattr(self.config, 'mobile_proxies') and self.config.mobile_proxies:
-            active_proxies = [proxy for proxy in self.config.mobile_proxies if proxy.active]
+            active_proxies = []
+            seen_keys = set()
+            for proxy in self.config.mobile_proxies:
+                if not proxy.active:
+                    continue
+                if proxy.key in seen_keys:
+                    # Один и тот же прокси дважды делил бы cookies, здоровье и шард
+                    logger.warning(f"Прокси {proxy.name} ({proxy.key}) указан повторно — пропускаем")
+                    continue
+                seen_keys.add(proxy.key)
+                active_proxies.append(proxy)
             if active_proxies:
                 logger.info(f"Загружено {len(active_proxies)} активных мобильных прокси")
                 return active_proxies
 
         # Fallback к старой конфигурации
         if all([self.config.proxy_string, self.config.proxy_change_url]):
-            from dto import MobileProxy
             fallback_proxy = MobileProxy(
                 proxy_string=self.config.proxy_string,
                 proxy_change_url=self.config.proxy_change_url,
@@ -90,31 +173,96 @@ class AvitoParse:
             change_ip_link=current_proxy.proxy_change_url
         )
 
+    @property
+    def current_proxy_key(self) -> str:
+        if not self.mobile_proxies:
+            return DIRECT_KEY
+        return self.mobile_proxies[self.current_proxy_index].key
+
+    @property
+    def session(self) -> requests.Session:
+        """Сессия текущего прокси: cookies, выставленные Авито через один прокси, не уходят через другой"""
+        key = self.current_proxy_key
+        session = self.sessions.get(key)
+        if session is None:
+            session = self.sessions[key] = requests.Session(curl_infos=CURL_INFOS)
+        return session
+
+    def _clear_session_cookies(self, proxy_key: str) -> None:
+        session = self.sessions.get(proxy_key)
+        if session is not None:
+            session.cookies.clear()
+
+    def _switch_proxy(self, index: int):
+        old_index = self.current_proxy_index
+        if self.cookies:
+            self.proxy_cookies[self.current_proxy_key] = self.cookies
+        self.current_proxy_index = index
+        # Cookies другого прокси получены с чужого IP — их не подставляем
+        self.cookies = self.proxy_cookies.get(self.current_proxy_key) or self.cookie_store.get(self.current_proxy_key)
+        self.proxy_obj = self.get_current_proxy_obj()
+        self.proxy_requests_count = 0
+        current_proxy = self.mobile_proxies[self.current_proxy_index]
+        logger.info(f"🔄 Переключились с прокси #{old_index} на прокси #{self.current_proxy_index} ({current_proxy.name})")
+
+    def route_to_healthiest_proxy(self):
+        """В режиме smart перед каждым запросом выбирает самый здоровый прокси"""
+        if len(self.mobile_proxies) <= 1 or getattr(self.config, 'proxy_rotation_mode', 'round_robin') != 'smart':
+            return
+        keys = [proxy.key for proxy in self.mobile_proxies]
+        ready_keys = [key for key in keys if not self.ip_changes.is_changing(key)]
+        best = self.health.choose(ready_keys)
+        if best is not None and best != self.current_proxy_key:
+            self._switch_proxy(keys.index(best))
+
     def rotate_proxy(self) -> bool:
         """Переключается на следующий прокси в списке"""
         if len(self.mobile_proxies) <= 1:
             return False
-        old_index = self.current_proxy_index
         rotation_mode = getattr(self.config, 'proxy_rotation_mode', 'round_robin')
+        if rotation_mode == 'smart':
+            keys = [proxy.key for proxy in self.mobile_proxies]
+            best = self.health.choose(keys, exclude=self.current_proxy_key)
+            self._switch_proxy(keys.index(best))
+            return True
+        new_index = self.current_proxy_index
         if rotation_mode == 'random':
             available_indices = [i for i in range(len(self.mobile_proxies)) if i != self.current_proxy_index]
             if available_indices:
-                self.current_proxy_index = random.choice(available_indices)
+                new_index = random.choice(available_indices)
         else:
-            self.current_proxy_index = (self.current_proxy_index + 1) % len(self.mobile_proxies)
-        self.proxy_obj = self.get_current_proxy_obj()
-        self.proxy_requests_count = 0
-        current_proxy = self.mobile_proxies[self.current_proxy_index]
-        logger.info(f"🔄 Переключились с прокси #{old_index} на прокси #{self.current_proxy_index} ({current_proxy.name})")
+            new_index = (self.current_proxy_index + 1) % len(self.mobile_proxies)
+        self._switch_proxy(new_index)
         return True
 
     def get_proxy_obj(self) -> Proxy | None:
         return self.get_current_proxy_obj()
 
-    def get_cookies(self, max_retries: int = 5, delay: float = 2.0) -> dict | None:
+    def get_cookies(
+            self,
+            max_retries: int = 5,
+            delay: float = 2.0,
+            proxy_obj: Proxy | None = None,
+            use_pool: bool = True
+    ) -> dict | None:
+        if use_pool and self.cookie_pool and proxy_obj is None:
+            cookies = self.cookie_pool.take(self.current_proxy_key)
+            if cookies:
+                return cookies
+        proxy_obj = proxy_obj or self.proxy_obj
+        proxy_key = proxy_obj.key if proxy_obj else DIRECT_KEY
+        # Браузер собирает cookies с отпечатком, который закреплен за этим прокси
+        profile = self.impersonation.profile_for(proxy_key) if self.impersonation else None
         for attempt in range(1, max_retries + 1):
             try:
-                cookies = asyncio.run(get_cookies(proxy=self.proxy_obj, headless=True))
+                cookies = asyncio.run(get_cookies(
+                    proxy=proxy_obj,
+                    headless=True,
+                    use_cache=not self.cookie_pool,
+                    browser_manager=self.browser_manager,
+                    resource_policy=self.resource_policy,
+                    profile=profile
+                ))
                 if cookies and isinstance(cookies, dict) and len(cookies) > 0:
                     logger.info(f"[get_cookies] Успешно получены cookies с попытки {attempt}")
                     return cookies
@@ -129,133 +277,382 @@ class AvitoParse:
                     logger.error(f"[get_cookies] Все {max_retries} попытки не удались")
                     return None
 
+    def refresh_cookies_from_pool(self) -> bool:
+        """Заменяет cookies текущего прокси готовым набором из пула"""
+        if not self.cookie_pool:
+            return False
+        cookies = self.cookie_pool.take(self.current_proxy_key)
+        if not cookies:
+            return False
+        self.cookies = cookies
+        return True
+
+    def request_profile(self, proxy_key: str) -> tuple[dict, str | None, str | None]:
+        """Заголовки, цель impersonate и имя профиля для запроса через прокси"""
+        if not self.impersonation:
+            return HEADERS, None, None
+        profile = self.impersonation.profile_for(proxy_key)
+        return profile.headers(), profile.impersonate, profile.name
+
     def save_cookies(self) -> None:
-        with open("cookies.json", "w") as f:
-            json.dump(self.session.cookies.get_dict(), f)
+        """Запоминает cookies текущего прокси после успешного запроса; в хранилище они попадут при flush_cookies.
+        Jar берется из сессии этого же прокси, поэтому чужие cookies в его запись не попадают"""
+        key = self.current_proxy_key
+        cookies = {**self.session.cookies.get_dict(), **(self.cookies or {})}
+        if cookies != self._saved_cookies.get(key):
+            self._pending_cookies[key] = cookies
+        if self._pending_cookies and time.time() - self._last_cookie_flush >= COOKIE_FLUSH_INTERVAL:
+            self.flush_cookies()
+
+    def report_traffic(self) -> None:
+        self.traffic.flush()
+        self.traffic.report()
+
+    def report_impersonation(self) -> None:
+        if self.impersonation:
+            self.impersonation.flush()
+            self.impersonation.report()
+
+    def flush_cookies(self) -> None:
+        """Сохраняет только изменившиеся cookies — по таймеру и при завершении цикла"""
+        self._last_cookie_flush = time.time()
+        for key, cookies in self._pending_cookies.items():
+            self.cookie_store.save_used(key, cookies)
+            self._saved_cookies[key] = cookies
+            self.cookie_flushes += 1
+        self._pending_cookies.clear()
+
+    def invalidate_cookies(self, proxy_key: str) -> None:
+        """Сбрасывает cookies прокси после блокировки"""
+        self.cookie_store.invalidate(proxy_key)
+        self._clear_session_cookies(proxy_key)
+        self.proxy_cookies.pop(proxy_key, None)
+        self._pending_cookies.pop(proxy_key, None)
+        self._saved_cookies.pop(proxy_key, None)
 
     def load_cookies(self) -> None:
-        try:
-            with open("cookies.json", "r") as f:
-                cookies = json.load(f)
-                jar = RequestsCookieJar()
-                for k, v in cookies.items():
-                    jar.set(k, v)
-                self.session.cookies.update(jar)
-        except FileNotFoundError:
-            pass
+        """Подгружает сохраненные cookies каждого прокси из общего хранилища"""
+        keys = [proxy.key for proxy in self.mobile_proxies] or [DIRECT_KEY]
+        for key in keys:
+            cookies = self.cookie_store.get(key)
+            if cookies:
+                self.proxy_cookies[key] = cookies
+                self._saved_cookies[key] = cookies
+        self.cookies = self.proxy_cookies.get(self.current_proxy_key, self.cookies)
 
     def fetch_data(self, url: str, retries: int = 5, backoff_factor: float = 1) -> str | None:
-        proxy_data = None
-        if self.proxy_obj:
-            proxy_data = {"https": f"http://{self.proxy_obj.proxy_string}"}
-        base_jitter = random.uniform(0.15, 0.4)
-        time.sleep(base_jitter)
+        outcome = self.fetch(url, retries=retries, backoff_factor=backoff_factor)
+        return outcome.text if outcome.ok else None
+
+    def _proxy_breaker_allows(self) -> bool:
+        """Если предохранитель текущего прокси открыт, переходим на прокси с закрытым"""
+        if self.breakers.proxy(self.current_proxy_key).allow():
+            return True
+        for index, proxy in enumerate(self.mobile_proxies):
+            if index == self.current_proxy_index or self.ip_changes.is_changing(proxy.key):
+                continue
+            if self.breakers.proxy(proxy.key).allow():
+                logger.info(f"🔌 Прокси {self.current_proxy_key} исключен предохранителем, работаем через {proxy.name}")
+                self._switch_proxy(index)
+                return True
+        return False
+
+    def _recover_ip(self) -> bool:
+        """Смена IP, если она не делалась последние 15 секунд"""
+        if time.time() - self.last_ip_change <= 15:
+            return False
+        if self.change_ip(max_attempts=2):
+            self.last_ip_change = time.time()
+            return True
+        return False
+
+    def fetch(self, url: str, retries: int = 5, backoff_factor: float = 1) -> FetchOutcome:
+        """Скачивает url с повторами; ошибки классифицируются, предохранители
+        прокси и сайта не дают тратить цикл на заведомо неработающий маршрут"""
+        host = urlparse(url).netloc
+        pool_cookies_used = False
+        outcome = FetchOutcome(kind=ErrorKind.UNEXPECTED)
         for attempt in range(1, retries + 1):
             if self.stop_event and self.stop_event.is_set():
-                return
+                return FetchOutcome(kind=ErrorKind.CANCELLED, attempts=attempt - 1)
+            self.wait_for_current_proxy()
+            self.route_to_healthiest_proxy()
+            # Сначала прокси: пробный слот сайта занимаем, только если запрос точно уйдет
+            if not self._proxy_breaker_allows():
+                return FetchOutcome(kind=ErrorKind.CIRCUIT_OPEN, attempts=attempt - 1, error="все прокси исключены")
+            if not self.breakers.host(host).allow():
+                self.breakers.proxy(self.current_proxy_key).release()
+                return FetchOutcome(kind=ErrorKind.CIRCUIT_OPEN, attempts=attempt - 1, error=f"сайт {host} недоступен")
+            proxy_data = None
+            if self.proxy_obj:
+                proxy_data = {"https": f"http://{self.proxy_obj.proxy_string}"}
+            proxy_key = self.current_proxy_key
+            headers, impersonate, profile_name = self.request_profile(proxy_key)
+            self.rate_limiter.acquire(proxy_key)
+            started = time.time()
             try:
                 response = self.session.get(
                     url=url,
-                    headers=HEADERS,
+                    headers=headers,
+                    impersonate=impersonate,
                     proxies=proxy_data,
                     cookies=self.cookies,
                     timeout=30,
                     verify=False,
                     allow_redirects=True
                 )
+            except Exception as err:
+                kind = classify_exception(err)
+                outcome = FetchOutcome(kind=kind, attempts=attempt, proxy_key=proxy_key, error=str(err))
+                logger.warning(f"Попытка {attempt}: ошибка {kind.value}: {err}")
+                self.health.record(proxy_key, None, None)
+            else:
+                kind = classify_status(response.status_code)
+                # Капча или «проблема с IP» со статусом 200 — блокировка, а не страница без объявлений
+                reason = soft_block_reason(response.text) if kind == ErrorKind.OK else None
+                if reason:
+                    kind = ErrorKind.SOFT_BLOCK
+                outcome = FetchOutcome(kind=kind, status_code=response.status_code, attempts=attempt, proxy_key=proxy_key,
+                                       error=reason)
                 logger.debug(f"Попытка {attempt}: {response.status_code}")
-                if response.status_code == 200:
-                    self.failed_requests_count = 0
-                    self.save_cookies()
-                    time.sleep(random.uniform(0.25, 0.8))
-                    return response.text
-                if response.status_code >= 500:
-                    logger.warning(f"Ошибка сервера {response.status_code}")
-                    raise RequestsError(f"Ошибка сервера: {response.status_code}")
-                if response.status_code == 429:
-                    logger.warning(f"Rate limit {response.status_code}")
-                    self.failed_requests_count += 1
-                    if time.time() - self.last_ip_change > 15:
-                        if self.change_ip(max_attempts=2):
-                            self.last_ip_change = time.time()
-                            continue
-                    raise RequestsError(f"Слишком много запросов: {response.status_code}")
-                if response.status_code in [403, 302, 401, 422]:
+                self.health.record(proxy_key, time.time() - started, response.status_code, blocked=bool(reason))
+                self.traffic.record(proxy_key, url, response.status_code, response)
+                if self.impersonation:
+                    self.impersonation.record(profile_name, response.status_code, blocked=bool(reason))
+                if kind == ErrorKind.OK:
+                    outcome.text = response.text
+            self.breakers.record(proxy_key, host, kind)
+
+            if kind == ErrorKind.OK:
+                self.failed_requests_count = 0
+                self.rate_limiter.succeeded(proxy_key)
+                self.save_cookies()
+                return outcome
+            self.failed_requests_count += 1
+            if kind == ErrorKind.RATE_LIMITED:
+                logger.warning(f"Rate limit {response.status_code}")
+                self.rate_limiter.throttled(proxy_key)
+                if self._recover_ip():
+                    continue
+            elif kind in (ErrorKind.BLOCKED, ErrorKind.SOFT_BLOCK):
+                if kind == ErrorKind.SOFT_BLOCK:
+                    logger.warning(f"Мягкая блокировка: {reason}")
+                else:
                     logger.warning(f"Блокировка {response.status_code}")
-                    self.failed_requests_count += 1
-                    time.sleep(random.uniform(2.0, 5.0))
-                    if time.time() - self.last_ip_change > 15:
-                        if self.change_ip(max_attempts=2):
-                            self.last_ip_change = time.time()
-                            continue
-                    raise RequestsError(f"Заблокирован: {response.status_code}")
+                self.invalidate_cookies(proxy_key)
+                if not pool_cookies_used and self.refresh_cookies_from_pool():
+                    # Сначала пробуем готовые cookies из пула — это миллисекунды вместо смены IP
+                    pool_cookies_used = True
+                    continue
+                if self._recover_ip():
+                    continue
+            elif kind in (ErrorKind.TRANSPORT, ErrorKind.TLS, ErrorKind.TIMEOUT):
+                if self.failed_requests_count >= 2 and self._recover_ip():
+                    continue
+            elif kind == ErrorKind.UNEXPECTED:
                 logger.warning(f"⚠️ Неожиданный статус {response.status_code}")
-                self.failed_requests_count += 1
-                raise RequestsError(f"Неожиданный статус: {response.status_code}")
-            except (RequestsError, Exception) as e:
-                error_msg = str(e)
-                mult = 3 if any(k in error_msg.upper() for k in ["SSL", "TIMEOUT", "CONNECTION"]) else 1
-                sleep_time = backoff_factor * attempt * mult + random.uniform(0.1, 0.6)
-                if self.failed_requests_count >= 2 and time.time() - self.last_ip_change > 15:
-                    if self.change_ip(max_attempts=2):
-                        self.last_ip_change = time.time()
-                        continue
-                if attempt < retries:
-                    time.sleep(min(sleep_time, 15))
-                else:
-                    return None
+            if attempt < retries:
+                time.sleep(backoff_delay(attempt, backoff_factor))
+        return outcome
+
+    @staticmethod
+    def predict_start_page(positions: list[int], depth: int) -> int:
+        """Страница, где объявление скорее всего сейчас: по медиане последних найденных позиций"""
+        if not positions or positions[0] == NOT_FOUND_POSITION:
+            return 1
+        found = sorted(p for p in positions if p != NOT_FOUND_POSITION)
+        median = found[len(found) // 2]
+        return min(max(1, (median - 1) // CATALOG_PAGE_SIZE + 1), depth)
 
-    def parse(self):
+    @staticmethod
+    def page_order(start_page: int, depth: int) -> list[int]:
+        """Сначала предсказанная страница, затем соседние — поиск расширяется, только если объявления там нет"""
+        return sorted(range(1, depth + 1), key=lambda page: (abs(page - start_page), page))
+
+    def build_scan_plan(self) -> dict[str, list[ScanTarget]]:
+        """Группирует активные объявления всех профилей по URL категории"""
+        rows = self.db.conn.execute(
+            "SELECT a.id, a.profile_id, p.token, a.category, a.scan_pages, a.target_place_start, a.target_place_end, "
+            "a.schedule_days, a.schedule_hours, a.schedule_tz "
+            "FROM ads a JOIN profiles p ON p.id = a.profile_id WHERE a.active = TRUE"
+        ).fetchall()
+        default_depth = max(1, int(getattr(self.config, 'scan_max_pages', MAX_PAGES) or MAX_PAGES))
+        history = self.db.get_recent_positions(POSITION_HISTORY)
+        plan: dict[str, list[ScanTarget]] = {}
+        deep_starts = 0
+        not_due = 0
+        off_hours = 0
+        now = time.time()
+        for (ad_id, profile_id, token, category, scan_pages, place_start, place_end,
+             schedule_days, schedule_hours, schedule_tz) in rows:
+            if not category:
+                continue
+            if not is_within_schedule(schedule_days, schedule_hours, schedule_tz):
+                off_hours += 1
+                continue
+            if self.scheduler and not self.scheduler.is_due(str(ad_id), now):
+                not_due += 1
+                continue
+            depth = min(max(1, scan_pages or default_depth), MAX_SCAN_PAGES)
+            recent_positions = history.get(str(ad_id), [])
+            start_page = self.predict_start_page(recent_positions, depth)
+            deep_starts += start_page > 1
+            plan.setdefault(category, []).append(ScanTarget(
+                ad_id=str(ad_id),
+                profile_id=profile_id,
+                token=token,
+                category=category,
+                pages=self.page_order(start_page, depth),
+                target_place_start=place_start,
+                target_place_end=place_end,
+                recent_positions=recent_positions
+            ))
+        categories = list(plan.items())
+        random.shuffle(categories)
+        logger.info(f"План сканирования: {len(rows) - not_due - off_hours} объявлений в {len(categories)} категориях, "
+                    f"{deep_starts} начинают не с первой страницы, {not_due} еще рано сканировать, "
+                    f"{off_hours} вне расписания")
+        return dict(categories)
+
+    def get_price_of_view(self, target: ScanTarget, db: AvitoDB | None = None) -> int:
+        db = db or self.db
+        last_price = db.get_last_price(target.ad_id)
+        if last_price is not None:
+            return int(last_price)
+        bid_info = get_bid_info(target.token, target.ad_id, db=db)
+        if bid_info and bid_info.get('manual', {}).get('minBidPenny') is not None:
+            return bid_info.get('manual', {}).get('minBidPenny')
+        return 0
+
+    def get_page_url(self, category: str, page: int) -> str:
+        url = category
+        for _ in range(page - 1):
+            url = self.get_next_page_url(url=url)
+        return url
+
+    def positions_from_html(self, html_code: str) -> dict[str, int] | None:
+        """Строит индекс id -> позиция на странице по HTML страницы категории"""
+        data_from_page = self.find_json_on_page(html_code=html_code)
+        catalog = data_from_page.get("catalog", {})
+        if getattr(self.config, 'position_mode', 'fast') == 'deep':
+            try:
+                ads_models = ItemsResponse(**catalog)
+            except ValidationError as err:
+                logger.error(f"Ошибка валидации: {err}")
+                return None
+            ad_ids = [str(ad.id) for ad in self._clean_null_ads(ads=ads_models.items)]
+        else:
+            ad_ids = extract_catalog_ids(catalog)
+        positions = {}
+        for i, ad_id in enumerate(ad_ids):
+            positions.setdefault(ad_id, i + 1)
+        return positions
+
+    def fetch_page_positions(self, category: str, page: int) -> dict[str, int] | None:
+        """Скачивает страницу категории и возвращает индекс id -> позиция на странице"""
+        html_code = self.fetch_data(url=self.get_page_url(category, page), retries=self.config.max_count_of_retry)
+        if not html_code:
+            return None
+        return self.positions_from_html(html_code)
+
+    def record_positions(self, targets: list[ScanTarget], positions: dict[str, int], page: int) -> list[ScanTarget]:
+        """Пишет ad_stats для найденных на странице объявлений, возвращает те, что ищем дальше"""
+        found, not_found = self.split_positions(targets, positions, page)
+        for target, position in found:
+            self.save_position(target, position)
+        return not_found
+
+    @staticmethod
+    def split_positions(
+            targets: list[ScanTarget],
+            positions: dict[str, int],
+            page: int
+    ) -> tuple[list[tuple[ScanTarget, int]], list[ScanTarget]]:
+        """Делит объявления страницы на записываемые (с позицией) и те, что ищем дальше.
+        Объявление, не найденное ни на одной из своих страниц, получает NOT_FOUND_POSITION"""
+        offset = (page - 1) * CATALOG_PAGE_SIZE
+        found, not_found = [], []
+        for target in targets:
+            current_index = positions.get(target.ad_id, 0)
+            logger.debug(f"id: {target.ad_id}, страница {page}, позиция на странице: {current_index}")
+            if current_index != 0:
+                found.append((target, offset + current_index))
+            elif not target.pages:
+                found.append((target, NOT_FOUND_POSITION))
+            else:
+                not_found.append(target)
+        return found, not_found
+
+    def save_position(self, target: ScanTarget, position: int):
+        self.db.insert_ad_stat(target.ad_id, self.get_price_of_view(target), position)
+        self.position_saved(target, position)
+
+    def position_saved(self, target: ScanTarget, position: int):
+        """Учет уже записанной позиции: расписание сканов и очередь корректировки ставок"""
+        self.scanned_ads.add(target.ad_id)
+        if self.scheduler:
+            self.scheduler.reschedule(
+                target.ad_id,
+                [position] + target.recent_positions,
+                target.target_place_start,
+                target.target_place_end
+            )
+        if self.repricer:
+            self.repricer.submit(target.ad_id)
+
+    def seconds_until_next_scan(self) -> float | None:
+        """Через сколько секунд подойдет время скана ближайшего объявления (None — расписание выключено)"""
+        if not self.scheduler:
+            return None
+        rows = self.db.conn.execute(
+            "SELECT id, schedule_days, schedule_hours, schedule_tz FROM ads WHERE active = TRUE"
+        ).fetchall()
+        ad_ids = [row[0] for row in rows if is_within_schedule(*row[1:])]
+        return self.scheduler.seconds_until_next_due(ad_ids)
+
+    @staticmethod
+    def group_by_next_page(targets: list[ScanTarget]) -> dict[int, list[ScanTarget]]:
+        """Забирает у каждого объявления следующую страницу поиска и группирует по ней"""
+        by_page: dict[int, list[ScanTarget]] = {}
+        for target in targets:
+            by_page.setdefault(target.pages.pop(0), []).append(target)
+        return by_page
+
+    def parse(self, plan: dict[str, list[ScanTarget]] | None = None):
         self.load_cookies()
-        profiles = self.db.conn.execute("SELECT id, client_id, client_secret, token FROM profiles").fetchall()
-        throttle_factor = 1.0
-        for profile in profiles:
-            profile_id, client_id, client_secret, token = profile
-            ads = self.db.conn.execute("SELECT id, category, max_price, target_place_start, target_place_end, comment, url FROM ads WHERE profile_id = ? AND active = TRUE", (profile_id,)).fetchall()
-            ads = list(ads)
-            random.shuffle(ads)
-            for ad in ads:
-                ad_id, category, max_price, target_place_start, target_place_end, comment, url = ad
-                last_stat = self.db.conn.execute(
-                    "SELECT price FROM ad_stats WHERE ad_id = ? ORDER BY timestamp DESC LIMIT 1",
-                    (ad_id,)
-                ).fetchone()
-                if last_stat and last_stat[0] is not None:
-                    price_of_view = int(last_stat[0])
-                else:
-                    bid_info = get_bid_info(token, ad_id)
-                    if bid_info and bid_info.get('manual', {}).get('minBidPenny') is not None:
-                        price_of_view = bid_info.get('manual', {}).get('minBidPenny')
-                    else:
-                        price_of_view = 0
-                target_id = ad_id
-                for pages in range(1, 3):
+        try:
+            self.scan(plan if plan is not None else self.build_scan_plan())
+        finally:
+            self.collect_ip_changes()
+            self.ip_changes.shutdown()
+            self.health.flush()
+            if self.scheduler:
+                self.scheduler.flush()
+            self.report_impersonation()
+            self.report_traffic()
+            self.flush_cookies()
+            logger.info(f"Cookies сохранены {self.cookie_flushes} раз за цикл")
+
+    def scan(self, pending: dict[str, list[ScanTarget]]):
+        # Каждая страница категории скачивается за цикл не больше одного раза
+        fetched: dict[tuple[str, int], dict[str, int] | None] = {}
+        while pending:
+            next_pending: dict[str, list[ScanTarget]] = {}
+            for category, targets in pending.items():
+                for page, page_targets in self.group_by_next_page(targets).items():
                     if self.stop_event and self.stop_event.is_set():
                         return
-                    time.sleep(random.uniform(1.2, 2.8) * throttle_factor)
-                    html_code = self.fetch_data(url=category, retries=self.config.max_count_of_retry)
-                    if not html_code:
-                        throttle_factor = min(throttle_factor * 1.3, 5.0)
-                        break
-                    throttle_factor = max(throttle_factor * 0.95, 0.7)
-                    data_from_page = self.find_json_on_page(html_code=html_code)
-                    try:
-                        ads_models = ItemsResponse(**data_from_page.get("catalog", {}))
-                    except ValidationError as err:
-                        logger.error(f"Ошибка валидации: {err}")
-                        break
-                    ads_list = self._clean_null_ads(ads=ads_models.items)
-                    current_index = self.find_place_of_target_ad(target_id, ads_list)
-                    print("id: ", target_id)
-                    print("Current index: ", current_index)
-                    
-                    if current_index != 0:
-                        self.db.insert_ad_stat(ad_id, price_of_view, current_index)
-                        break
-                    if pages == 2:
-                        self.db.insert_ad_stat(ad_id, price_of_view, 100)
-                        break
-                    url = self.get_next_page_url(url=url)
+                    if (category, page) not in fetched:
+                        fetched[(category, page)] = self.fetch_page_positions(category, page)
+                        self.traffic.charge_ads(self.get_page_url(category, page), [t.ad_id for t in page_targets])
+                    positions = fetched[(category, page)]
+                    if positions is None:
+                        # Страница не получена — не пишем ложную статистику
+                        continue
+                    not_found = self.record_positions(page_targets, positions, page)
+                    if not_found:
+                        next_pending.setdefault(category, []).extend(not_found)
+            pending = next_pending
 
     @staticmethod
     def _clean_null_ads(ads: list[Item]) -> list[Item]:
@@ -274,71 +671,118 @@ class AvitoParse:
 
     @staticmethod
     def find_json_on_page(html_code, data_type: str = "mime") -> dict:
-        soup = BeautifulSoup(html_code, "html.parser")
-        try:
-            for _script in soup.select('script'):
-                if data_type == 'mime':
-                    if _script.get('type') == 'mime/invalid' and _script.get('data-mfe-state') == 'true':
-                        mime_data = json.loads(html.unescape(_script.text)).get('data', {})
-                        return mime_data
-        except Exception as err:
-            logger.error(f"Ошибка при поиске информации на странице: {err}")
+        if data_type == 'mime':
+            return find_mfe_state(html_code)
         return {}
 
-    def change_ip(self, max_attempts: int = 3) -> bool:
-        if not self.mobile_proxies:
-            logger.warning("⚠️ Смена IP невозможна - мобильные прокси не настроены")
-            return False
-        current_proxy = self.mobile_proxies[self.current_proxy_index]
-        logger.info(f"🔄 Начинаю агрессивную смену IP для прокси {current_proxy.name}...")
+    def _change_proxy_ip(self, proxy: MobileProxy, max_attempts: int) -> IpChangeResult:
+        """Смена IP одного прокси: вызов proxy_change_url, пауза на стабилизацию и новые cookies.
+        Выполняется в фоновом потоке, поэтому не трогает сессию и БД парсера"""
+        proxy_obj = Proxy(proxy_string=proxy.proxy_string, change_ip_link=proxy.proxy_change_url)
         for attempt in range(1, max_attempts + 1):
             try:
-                logger.info(f"Попытка смены IP {attempt}/{max_attempts} на прокси {current_proxy.name}")
+                logger.info(f"Попытка смены IP {attempt}/{max_attempts} на прокси {proxy.name}")
                 res = requests.get(
-                    url=current_proxy.proxy_change_url,
+                    url=proxy.proxy_change_url,
                     timeout=20,
                     verify=False
                 )
                 if res.status_code == 200:
-                    self.requests_count = 0
-                    self.failed_requests_count = 0
-                    self.proxy_requests_count = 0
                     wait_time = random.randint(1, 5)
-                    logger.info(f"✅ IP успешно изменен на прокси {current_proxy.name}! Пауза {wait_time} сек для стабилизации")
+                    logger.info(f"✅ IP успешно изменен на прокси {proxy.name}! Пауза {wait_time} сек для стабилизации")
                     time.sleep(wait_time)
-                    logger.info("🍪 Обновляю cookies с новым IP...")
-                    self.cookies = self.get_cookies(max_retries=2)
-                    return True
-                else:
-                    logger.warning(f"Ошибка смены IP на прокси {current_proxy.name}: статус {res.status_code}")
+                    # Сохраненные cookies и наборы из пула получены со старого IP
+                    self.cookie_store.invalidate(proxy.key)
+                    if self.cookie_pool:
+                        self.cookie_pool.invalidate(proxy.key)
+                    # Новый IP — новый отпечаток; меняем его до сбора cookies, чтобы они собирались уже с ним
+                    if self.impersonation:
+                        self.impersonation.repin(proxy.key)
+                    logger.info(f"🍪 Обновляю cookies с новым IP для прокси {proxy.name}...")
+                    cookies = self.get_cookies(max_retries=2, proxy_obj=proxy_obj, use_pool=False)
+                    return IpChangeResult(proxy_key=proxy.key, success=True, cookies=cookies)
+                logger.warning(f"Ошибка смены IP на прокси {proxy.name}: статус {res.status_code}")
             except Exception as err:
-                logger.error(f"Ошибка при смене IP на прокси {current_proxy.name} (попытка {attempt}): {err}")
+                logger.error(f"Ошибка при смене IP на прокси {proxy.name} (попытка {attempt}): {err}")
             if attempt < max_attempts:
                 wait_time = random.randint(1, 2) * attempt
                 logger.info(f"Повтор смены IP через {wait_time} секунд...")
                 time.sleep(wait_time)
+        return IpChangeResult(proxy_key=proxy.key, success=False)
+
+    def _apply_ip_change(self, result: IpChangeResult | None) -> bool:
+        if not result or not result.success:
+            return False
+        self.health.record_ip_change(result.proxy_key)
+        # Новый IP — прокси снова можно пробовать
+        self.breakers.proxy(result.proxy_key).record_success()
+        # Запись в хранилище сброшена при смене IP, несохраненные cookies тоже со старого IP
+        self._pending_cookies.pop(result.proxy_key, None)
+        self._saved_cookies.pop(result.proxy_key, None)
+        self._clear_session_cookies(result.proxy_key)
+        if result.cookies:
+            self.proxy_cookies[result.proxy_key] = result.cookies
+        if result.proxy_key == self.current_proxy_key:
+            self.requests_count = 0
+            self.failed_requests_count = 0
+            self.proxy_requests_count = 0
+            if result.cookies:
+                self.cookies = result.cookies
+        return True
+
+    def collect_ip_changes(self):
+        """Применяет результаты завершившихся фоновых смен IP"""
+        for result in self.ip_changes.pop_finished():
+            self._apply_ip_change(result)
+
+    def _pick_ready_proxy(self) -> int | None:
+        """Индекс прокси, который сейчас не меняет IP"""
+        ready = [i for i, proxy in enumerate(self.mobile_proxies)
+                 if i != self.current_proxy_index and not self.ip_changes.is_changing(proxy.key)]
+        if not ready:
+            return None
+        if getattr(self.config, 'proxy_rotation_mode', 'round_robin') == 'smart':
+            best = self.health.choose([self.mobile_proxies[i].key for i in ready])
+            return next(i for i in ready if self.mobile_proxies[i].key == best)
+        return min(ready, key=lambda i: (i - self.current_proxy_index) % len(self.mobile_proxies))
+
+    def wait_for_current_proxy(self):
+        """Запросы к прокси, который меняет IP, уходят на другой прокси или ждут конца смены"""
+        self.collect_ip_changes()
+        if not self.mobile_proxies or not self.ip_changes.is_changing(self.current_proxy_key):
+            return
+        ready_index = self._pick_ready_proxy()
+        if ready_index is not None:
+            self._switch_proxy(ready_index)
+            return
+        logger.info(f"⏳ Прокси {self.mobile_proxies[self.current_proxy_index].name} меняет IP, других свободных нет — ждем")
+        self._apply_ip_change(self.ip_changes.wait(self.current_proxy_key))
+
+    def change_ip(self, max_attempts: int = 3, blocking: bool | None = None) -> bool:
+        if not self.mobile_proxies:
+            logger.warning("⚠️ Смена IP невозможна - мобильные прокси не настроены")
+            return False
+        if blocking is None:
+            blocking = getattr(self.config, 'ip_change_blocking', False)
+        current_proxy = self.mobile_proxies[self.current_proxy_index]
+        logger.info(f"🔄 Начинаю смену IP для прокси {current_proxy.name}...")
+        self.ip_changes.request(current_proxy.key, lambda: self._change_proxy_ip(current_proxy, max_attempts))
+        if not blocking:
+            ready_index = self._pick_ready_proxy()
+            if ready_index is not None:
+                # IP меняется в фоне, сканирование продолжается на другом прокси
+                self._switch_proxy(ready_index)
+                return True
+        if self._apply_ip_change(self.ip_changes.wait(current_proxy.key)):
+            return True
         logger.warning("Смена IP на текущем прокси не удалась, пробуем ротацию прокси...")
         if len(self.mobile_proxies) > 1 and getattr(self.config, 'proxy_switch_on_error', True):
             if self.rotate_proxy():
                 logger.info("🔄 Прокси переключен, пробуем смену IP на новом прокси...")
                 new_proxy = self.mobile_proxies[self.current_proxy_index]
-                try:
-                    res = requests.get(
-                        url=new_proxy.proxy_change_url,
-                        timeout=20,
-                        verify=False
-                    )
-                    if res.status_code == 200:
-                        self.requests_count = 0
-                        self.failed_requests_count = 0
-                        self.proxy_requests_count = 0
-                        wait_time = random.randint(1, 5)
-                        logger.info(f"✅ IP успешно изменен на новом прокси {new_proxy.name}! Пауза {wait_time} сек")
-                        time.sleep(wait_time)
-                        self.cookies = self.get_cookies(max_retries=2)
-                        return True
-                except Exception as err:
-                    logger.error(f"Ошибка смены IP на новом прокси {new_proxy.name}: {err}")
+                self.ip_changes.request(new_proxy.key, lambda: self._change_proxy_ip(new_proxy, 1))
+                if self._apply_ip_change(self.ip_changes.wait(new_proxy.key)):
+                    return True
         logger.error("Все попытки смены IP и ротации прокси неуспешны!")
         logger.info("Принудительное обновление cookies...")
         self.cookies = self.get_cookies(max_retries=1)
@@ -357,20 +801,57 @@ class AvitoParse:
         except Exception as err:
             logger.error(f"Не смог сформировать ссылку на следующую страницу для {url}. Ошибка: {err}")
 
-import requests  # уже используется curl_cffi.requests выше; этот импорт может быть лишним для стандартного requests, оставлен если где-то нужен
 
+def create_parser(config: AvitoConfig, stop_event=None, cookie_pool: CookiePool | None = None) -> AvitoParse:
+    """Создает парсер в режиме из config.parser_mode"""
+    if config.parser_mode == "async":
+        from async_parser import AsyncAvitoParse
+        return AsyncAvitoParse(config, stop_event, cookie_pool=cookie_pool)
+    if config.parser_mode == "sharded":
+        from proxy_shards import ShardedAvitoParse
+        return ShardedAvitoParse(config, stop_event, cookie_pool=cookie_pool)
+    return AvitoParse(config, stop_event, cookie_pool=cookie_pool)
 
 
 if __name__ == "__main__":
+    # Модули режимов импортируют parser_cls — не даем выполнить его повторно
+    sys.modules.setdefault("parser_cls", sys.modules[__name__])
     print("Запуск инициализации бд")
     init_db_from_config()
     print("Успешно инициализирована")
-    
+    cookie_pool = None
+
     while True:
         try:
             config = load_avito_config("config.json")
-            parser = AvitoParse(config)
+            get_rate_limiter(
+                "avito-api",
+                rate_per_minute=config.api_rate_per_minute,
+                burst=config.api_rate_burst,
+                jitter=config.rate_jitter
+            )
+            get_api_client(http2=config.api_http2)
+            get_bid_cache(ttl_minutes=config.bid_cache_ttl_minutes)
+            if config.cookie_pool_size > 0 and cookie_pool is None:
+                cookie_pool = CookiePool(
+                    [],
+                    size=config.cookie_pool_size,
+                    resource_policy=ResourcePolicy.from_config(config),
+                    impersonation=config.impersonation_enabled,
+                    browser_manager=get_browser_manager(
+                        "cookie-pool", max_harvests=config.browser_max_harvests
+                    ) if config.browser_persistent else None
+                )
+            parser = create_parser(config, cookie_pool=cookie_pool)
+            if cookie_pool:
+                cookie_pool.set_proxies(parser.mobile_proxies)
+                cookie_pool.start()
+            if parser.repricer:
+                # Конвейер ставок стартует вместе со сканом — токены нужны заранее
+                refresh_tokens()
+            cycle_start = time.time()
             parser.parse()
+            logger.info(f"Цикл сканирования ({config.parser_mode}) завершен за {time.time() - cycle_start:.1f} сек")
             
             # Нормализуем паузу (защита от отрицательных/None значений, вызывающих OSError: [Errno 22] Invalid argument)
             raw_pause = getattr(config, 'pause_general', 60)
@@ -382,9 +863,26 @@ if __name__ == "__main__":
                 logger.warning(f"Получено отрицательное значение pause_general={raw_pause}. Принудительно устанавливаем 30 сек")
                 pause_val = 30
 
+            next_scan = parser.seconds_until_next_scan()
+            if next_scan is not None and next_scan < pause_val:
+                # Не ждем полную паузу, если раньше подойдет время скана какого-то объявления
+                pause_val = max(10, int(next_scan))
+
             logger.info(f"Парсинг завершен. Пауза {pause_val} сек")
-            print("Updating prices")
-            check_and_update_prices()
+            if parser.repricer:
+                # Ставки уже менялись по ходу скана — дожидаемся хвоста очереди
+                if not parser.repricer.drain(timeout=max(60, pause_val)):
+                    logger.warning("Конвейер ставок не успел разобрать очередь до паузы")
+                parser.repricer.report()
+            else:
+                print("Updating prices")
+                # При адаптивном расписании цену меняем только по свежим позициям,
+                # иначе одна и та же старая позиция поднимала бы ставку каждый цикл
+                check_and_update_prices(
+                    ad_ids=parser.scanned_ads if parser.scheduler else None,
+                    max_workers=config.reprice_workers,
+                    per_token=config.reprice_per_token
+                )
             
             try:
                 time.sleep(pause_val)
@@ -400,7 +898,7 @@ if __name__ == "__main__":
                 if config and hasattr(config, 'proxy_change_url') and config.proxy_change_url:
                     logger.warning("Экстренная смена IP из-за ошибки")
                     emergency_parser = AvitoParse(config)
-                    emergency_parser.change_ip(max_attempts=3)
+                    emergency_parser.change_ip(max_attempts=3, blocking=True)
             except:
                 pass
             
@@ -1,86 +1,228 @@
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
 from loguru import logger
 from avito_db import AvitoDB
+from ad_schedule import is_within_schedule
+from api_client import api_limiter, get_api_client
+from bid_cache import get_bid_cache
 import datetime
 
-def get_bid_info(token: str, item_id: int):
-    url = f"https://api.avito.ru/cpxpromo/1/getBids/{item_id}"
-    headers = {"Authorization": f"Bearer {token}"}
-    
-    try:
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"❌ Ошибка получения информации о ставках: {response.status_code}")
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Ошибка при получении информации о ставках: {e}")
-        return None
+REPRICE_WORKERS = 16  # одновременных запросов к API при корректировке ставок
+REPRICE_PER_TOKEN = 16  # из них на один токен (кабинет): 500 объявлений — около 16 сек при 250 мс на вызов
+REPRICE_LINGER_SECONDS = 0.5  # сколько конвейер копит очередь перед пачкой
 
-def update_view_price(token: str, item_id: int, new_price: int, limit : int):
-    url = "https://api.avito.ru/cpxpromo/1/setManual"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    
+def get_bid_info(token: str, item_id: int, use_cache: bool = True, db: AvitoDB | None = None):
+    """Ответ getBids; при use_cache сначала смотрит в общий кэш (см. bid_cache.py) через db,
+    use_cache=False — только API, кэш ведет вызывающий"""
+    cache = get_bid_cache()
+    if use_cache:
+        cached = cache.get(item_id, token, db)
+        if cached is not None:
+            return cached
+    result = get_api_client().get(f"/cpxpromo/1/getBids/{item_id}", token)
+    if result.ok:
+        if use_cache:
+            cache.put(item_id, token, result.data, db)
+        return result.data
+    if result.status_code is None:
+        print(f"❌ Ошибка при получении информации о ставках: {result.error}")
+    else:
+        print(f"❌ Ошибка получения информации о ставках: {result.status_code}")
+    return None
+
+def update_view_price(token: str, item_id: int, new_price: int, limit : int, invalidate_cache: bool = True):
     payload = {
         "actionTypeID": 5,
         "bidPenny": new_price,
         "itemID": item_id,
         "limitPenny": limit
     }
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        
-        # print(f"Status Code: {response.status_code}")
-        # print(f"Response Text: {response.text}")
-        
-        if response.status_code == 200:
-            print("✅ Цена успешно обновлена")
-            db = AvitoDB()
-            try:
-                latest_stat = db.conn.execute(
-                    "SELECT id FROM ad_stats WHERE ad_id = ? ORDER BY timestamp DESC LIMIT 1",
-                    (item_id,)
-                ).fetchone()
-                
-                if latest_stat:
-                    latest_stat_id = latest_stat[0]
-                    db.conn.execute(
-                        "UPDATE ad_stats SET price = ? WHERE id = ?",
-                        (new_price, latest_stat_id)
-                    )
-                    db.conn.commit()
-                    print(f"✅ Цена в базе данных для объявления {item_id} обновлена на {new_price}")
-                else:
-                    print(f"⚠️ Не найдено записей статистики для объявления {item_id} для обновления цены.")
-            except Exception as e:
-                print(f"❌ Ошибка при обновлении цены в базе данных: {e}")
-            finally:
-                db.close()
-            try:
-                return response.json() if response.text.strip() else {"success": True}
-            except:
-                return {"success": True}
+
+    result = get_api_client().post("/cpxpromo/1/setManual", token, json=payload)
+    if result.status_code is None:
+        print(f"❌ Ошибка при обновлении цены просмотра: {result.error}")
+        return None
+    if not result.ok:
+        print(f"❌ Ошибка API: {result.status_code} , {result.data}")
+        print(f"Сообщение об ошибке: {result.error}")
+        return None
+
+    print("✅ Цена успешно обновлена")
+    if invalidate_cache:
+        # Наша ставка изменила ответ getBids — следующий запрос должен идти в API
+        get_bid_cache().invalidate(item_id, token)
+    return result.data if result.data is not None else {"success": True}
+
+
+@dataclass
+class RepriceJob:
+    """Объявление, ставку которого надо проверить, с его последней позицией и ценой"""
+    ad_id: str
+    token: str
+    max_price: int | None
+    target_place_start: int
+    target_place_end: int
+    daily_budget: int | None
+    current_place: int
+    last_price: int | None
+
+
+def collect_reprice_jobs(db: AvitoDB, ad_ids: set[str] | None = None) -> list[RepriceJob]:
+    """Активные объявления в расписании, у которых есть последняя позиция"""
+    jobs = []
+    profiles = db.conn.execute("SELECT id, token FROM profiles").fetchall()
+    for profile_id, token in profiles:
+        ads = db.conn.execute(
+            "SELECT id, max_price, target_place_start, target_place_end, daily_budget, "
+            "schedule_days, schedule_hours, schedule_tz FROM ads WHERE profile_id = ? AND active = TRUE",
+            (profile_id,)
+        ).fetchall()
+        for ad in ads:
+            ad_id, max_price, target_place_start, target_place_end, daily_budget = ad[:5]
+            if ad_ids is not None and str(ad_id) not in ad_ids:
+                continue
+            if not is_within_schedule(*ad[5:]):
+                logger.debug(f"{ad_id}: вне расписания — ставку не трогаем")
+                continue
+            last_stat = db.conn.execute(
+                "SELECT position FROM ad_stats WHERE ad_id = ? ORDER BY timestamp DESC LIMIT 1",
+                (ad_id,)
+            ).fetchone()
+            if not last_stat:
+                logger.debug(f"Нет статистики для объявления {ad_id}")
+                continue
+            current_place = last_stat[0]
+            last_price = db.get_last_price(ad_id)
+            if current_place is None:
+                logger.debug(f"Позиция None для объявления {ad_id}")
+                continue
+            jobs.append(RepriceJob(
+                ad_id=str(ad_id),
+                token=token,
+                max_price=max_price,
+                target_place_start=target_place_start,
+                target_place_end=target_place_end,
+                daily_budget=daily_budget,
+                current_place=current_place,
+                last_price=last_price
+            ))
+    return jobs
+
+
+def decide_new_price(job: RepriceJob, bid_info: dict) -> tuple[int, int] | None:
+    """Новая ставка и лимит по позиции объявления и минимальным ставкам; None — ставку не менять"""
+    ad_id, current_place, last_price = job.ad_id, job.current_place, job.last_price
+    target_place_start, target_place_end = job.target_place_start, job.target_place_end
+    logger.debug(f"Ad {ad_id}: pos={current_place} target={target_place_start}-{target_place_end} last_price={last_price}")
+
+    min_bid = bid_info.get('manual', {}).get('minBidPenny')
+    min_limit = bid_info.get('manual', {}).get('minLimitPenny')
+    if min_bid is None:
+        min_bid = 0
+    if not (target_place_start <= current_place <= target_place_end):
+        if current_place > target_place_end:
+            base = int(last_price) if last_price else min_bid
+            new_price = max(base + 50, min_bid)
         else:
-            print(f"❌ Ошибка API: {response.status_code} , {response.json()}")
-            try:
-                error_data = response.json()
-                print(f"Сообщение об ошибке: {error_data.get('message', 'Неизвестная ошибка')}")
-            except:
-                print(f"Не удалось распарсить ответ: {response.text}")
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Ошибка при обновлении цены просмотра: {e}")
+            base = int(last_price) if last_price else min_bid
+            dec = base - 50
+            new_price = max(dec, min_bid)
+    else:
+        if last_price:
+            new_price = int(last_price)
+        else:
+            new_price = max(min_bid, 0)
+        mid_point = (target_place_start + target_place_end) / 2
+        if current_place <= mid_point:  # слишком высоко внутри зоны
+            base = int(last_price) if last_price else min_bid
+            new_price = max(base - 50, min_bid)
+
+    # Финальные ограничения
+    if job.max_price:
+        try:
+            max_p = int(job.max_price)
+            if new_price > max_p:
+                logger.debug(f"{ad_id}: ограничено max_price {max_p}")
+                new_price = max_p
+        except Exception as e:
+            logger.warning(f"Не удалось привести max_price к int для {ad_id}: {e}")
+
+    logger.info(f"Объявление {ad_id}: позиция {current_place} -> новая цена {new_price} (старая {last_price})")
+
+    # Если цена не изменилась – не дергаем API
+    if last_price is not None and int(last_price) == new_price:
+        logger.debug(f"{ad_id}: цена без изменений ({new_price}) – пропуск обновления")
         return None
+    if new_price < min_bid:
+        new_price = min_bid + 50
+    return int(new_price), int(max(int(min_limit + 50), int(job.daily_budget)))
+
+
+def token_concurrency(per_token: int) -> int:
+    """Потоков на токен с учетом лимита API: при заданном api_rate_per_minute потоки
+    сверх запаса корзины только ждут своей очереди и занимают общие слоты"""
+    if api_limiter.unlimited:
+        return max(1, per_token)
+    return max(1, min(per_token, int(api_limiter.burst)))
+
+
+def run_per_token(jobs: list[RepriceJob], fn, max_workers: int = REPRICE_WORKERS,
+                  per_token: int = REPRICE_PER_TOKEN) -> dict[str, object]:
+    """Вызывает fn(job) параллельно: не больше max_workers запросов всего и per_token на токен.
+    Ошибка одного объявления не мешает остальным — его просто нет в результате"""
+    slots = threading.BoundedSemaphore(max(1, max_workers))
+
+    def guarded(job: RepriceJob):
+        with slots:
+            return fn(job)
+
+    by_token: dict[str, list[RepriceJob]] = {}
+    for job in jobs:
+        by_token.setdefault(job.token, []).append(job)
+    executors = []
+    futures = {}
+    results = {}
+    try:
+        for token_jobs in by_token.values():
+            executor = ThreadPoolExecutor(
+                max_workers=max(1, min(per_token, len(token_jobs))), thread_name_prefix="reprice"
+            )
+            executors.append(executor)
+            for job in token_jobs:
+                futures[executor.submit(guarded, job)] = job
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                results[job.ad_id] = future.result()
+            except Exception as err:
+                logger.exception(f"Ошибка при обработке объявления {job.ad_id}: {err}")
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=False)
+    return results
+
 
-def check_and_update_prices():
+def check_and_update_prices(ad_ids: set[str] | None = None, max_workers: int = REPRICE_WORKERS,
+                            per_token: int = REPRICE_PER_TOKEN):
+    """Корректирует ставки активных объявлений; ad_ids — только эти объявления (None — все).
+
+    Запросы getBids и setManual идут параллельно, решение о новой цене
+    принимается в одном месте по собранным ответам"""
+    refresh_tokens()
+    db = AvitoDB()
+    try:
+        jobs = collect_reprice_jobs(db, ad_ids)
+        if jobs:
+            reprice(db, jobs, max_workers, per_token)
+    finally:
+        db.close()
+    get_bid_cache().report()
+
+
+def refresh_tokens():
     try:
         from token_utils import refresh_tokens_for_all_profiles
         try:
@@ -90,88 +232,164 @@ def check_and_update_prices():
     except ImportError:
         logger.warning("token_utils.refresh_tokens_for_all_profiles не найден – пропускаем обновление токенов")
 
-    db = AvitoDB()
-    try:
-        profiles = db.conn.execute("SELECT id, token FROM profiles").fetchall()
-        for profile in profiles:
-            profile_id, token = profile
-            ads = db.conn.execute(
-                "SELECT id, max_price, target_place_start, target_place_end, comment, url, daily_budget FROM ads WHERE profile_id = ? AND active = TRUE",
-                (profile_id,)
-            ).fetchall()
-
-            for ad in ads:
-                ad_id, max_price, target_place_start, target_place_end, comment, url, daily_budget = ad
+
+class RepricePipeline:
+    """Корректировка ставок по мере сканирования: каждая свежая позиция сразу
+    ставит объявление в очередь, фоновый поток забирает очередь пачками и
+    корректирует их ставки, не дожидаясь конца цикла сканирования.
+
+    У потока свое соединение с БД; позиции, записанные парсером, уже
+    закоммичены к моменту постановки в очередь."""
+
+    def __init__(self, max_workers: int = REPRICE_WORKERS, per_token: int = REPRICE_PER_TOKEN,
+                 linger_seconds: float = REPRICE_LINGER_SECONDS):
+        self.max_workers = max_workers
+        self.per_token = per_token
+        self.linger = linger_seconds
+        self._pending: dict[str, float] = {}  # ad_id -> время первой постановки в очередь
+        self._busy = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.processed = 0
+        self._latency_total = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="reprice-pipeline", daemon=True)
+        self._thread.start()
+        logger.info("💸 Конвейер корректировки ставок запущен")
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def submit(self, ad_id: str):
+        """Ставит объявление со свежей позицией в очередь; повтор до обработки не дублируется"""
+        with self._cond:
+            self._pending.setdefault(str(ad_id), time.time())
+            self._cond.notify_all()
+        self.start()
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """Ждет, пока очередь опустеет и текущая пачка обработается; False — не дождались"""
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while self._pending or self._busy:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(timeout=remaining)
+        return True
+
+    def report(self):
+        with self._cond:
+            processed, latency_total = self.processed, self._latency_total
+            self.processed, self._latency_total = 0, 0.0
+        if processed:
+            logger.info(f"💸 Конвейер ставок: {processed} объявлений, "
+                        f"в среднем {latency_total / processed:.1f} сек от позиции до ставки")
+        get_bid_cache().report()
+
+    def _loop(self):
+        db = AvitoDB()
+        try:
+            while not self._stop.is_set():
+                with self._cond:
+                    self._cond.wait_for(lambda: self._pending or self._stop.is_set())
+                    if self._stop.is_set():
+                        break
+                # Позиции объявлений одной страницы приходят почти одновременно — собираем их в пачку
+                self._stop.wait(self.linger)
+                with self._cond:
+                    batch, self._pending = self._pending, {}
+                    self._busy = True
                 try:
-                    # Проверка дневного бюджета
-                    last_stat = db.conn.execute(
-                        "SELECT position, price FROM ad_stats WHERE ad_id = ? ORDER BY timestamp DESC LIMIT 1",
-                        (ad_id,)
-                    ).fetchone()
-                    if not last_stat:
-                        logger.debug(f"Нет статистики для объявления {ad_id}")
-                        continue
-                    current_place, last_price = last_stat
-                    if current_place is None:
-                        logger.debug(f"Позиция None для объявления {ad_id}")
-                        continue
-                    logger.debug(f"Ad {ad_id}: pos={current_place} target={target_place_start}-{target_place_end} last_price={last_price}")
-
-                    new_price = None  # гарантируем наличие переменной
-                    bid_info = get_bid_info(token, ad_id)
-                    if not bid_info:
-                        logger.debug(f"Нет bid_info для {ad_id}")
-                        continue
-                    min_bid = bid_info.get('manual', {}).get('minBidPenny')
-                    min_limit = bid_info.get('manual', {}).get('minLimitPenny')
-                    if min_bid is None:
-                        min_bid = 0
-                    if not (target_place_start <= current_place <= target_place_end):
-                        if current_place > target_place_end:
-                            base = int(last_price) if last_price else min_bid
-                            new_price = max(base + 50, min_bid)
-                        else:
-                            base = int(last_price) if last_price else min_bid
-                            dec = base - 50
-                            new_price = max(dec, min_bid)
-                    else:
-                        if last_price:
-                            new_price = int(last_price)
-                        else:
-                            new_price = max(min_bid, 0)
-                        mid_point = (target_place_start + target_place_end) / 2
-                        if current_place <= mid_point:  # слишком высоко внутри зоны
-                            base = int(last_price) if last_price else min_bid
-                            new_price = max(base - 50, min_bid)
-
-                    # Финальные ограничения
-                    if new_price is None:
-                        logger.warning(f"new_price не вычислен для объявления {ad_id} – пропуск")
-                        continue
-                    if max_price:
-                        try:
-                            max_p = int(max_price)
-                            if new_price > max_p:
-                                logger.debug(f"{ad_id}: ограничено max_price {max_p}")
-                                new_price = max_p
-                        except Exception as e:
-                            logger.warning(f"Не удалось привести max_price к int для {ad_id}: {e}")
-
-                    logger.info(f"Объявление {ad_id}: позиция {current_place} -> новая цена {new_price} (старая {last_price})")
-
-                    # Если цена не изменилась – не дергаем API
-                    if last_price is not None and int(last_price) == new_price:
-                        logger.debug(f"{ad_id}: цена без изменений ({new_price}) – пропуск обновления")
-                        continue
-                    if new_price < min_bid:
-                        new_price = min_bid + 50
-                    result = update_view_price(token, int(ad_id), int(new_price), int(max(int(min_limit + 50), int(daily_budget))))
-                    if result is None:
-                        logger.warning(f"{ad_id}: не удалось обновить цену")
-                except Exception as ad_err:
-                    logger.exception(f"Ошибка при обработке объявления {ad_id}: {ad_err}")
-    finally:
-        db.close()
+                    jobs = collect_reprice_jobs(db, set(batch))
+                    if jobs:
+                        reprice(db, jobs, self.max_workers, self.per_token)
+                except Exception as err:
+                    logger.exception(f"Ошибка конвейера корректировки ставок: {err}")
+                finally:
+                    now = time.time()
+                    with self._cond:
+                        self._busy = False
+                        self.processed += len(batch)
+                        self._latency_total += sum(now - submitted for submitted in batch.values())
+                        self._cond.notify_all()
+        finally:
+            db.close()
+
+
+_pipeline: RepricePipeline | None = None
+_pipeline_lock = threading.Lock()
+
+
+def get_reprice_pipeline(max_workers: int = REPRICE_WORKERS, per_token: int = REPRICE_PER_TOKEN) -> RepricePipeline:
+    """Общий конвейер процесса (его используют и воркеры шардов); обновляет его лимиты"""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = RepricePipeline(max_workers, per_token)
+        else:
+            _pipeline.max_workers, _pipeline.per_token = max_workers, per_token
+        return _pipeline
+
+
+def reprice(db: AvitoDB, jobs: list[RepriceJob], max_workers: int = REPRICE_WORKERS,
+            per_token: int = REPRICE_PER_TOKEN):
+    """Один проход корректировки по собранным объявлениям; выставленные ставки
+    пишутся в bid_changes одной транзакцией через соединение db"""
+    started = time.time()
+    per_token = token_concurrency(per_token)
+    # Кэш getBids читается и пополняется пачкой через соединение прохода, потоки пула в БД не ходят
+    cache = get_bid_cache()
+    bids = cache.get_many([(job.ad_id, job.token) for job in jobs], db)
+    misses = [job for job in jobs if job.ad_id not in bids]
+    fetched = run_per_token(
+        misses, lambda job: get_bid_info(job.token, job.ad_id, use_cache=False), max_workers, per_token
+    )
+    cache.put_many([(job.ad_id, job.token, fetched.get(job.ad_id)) for job in misses], db)
+    bids.update(fetched)
+    decisions: dict[str, tuple[int, int]] = {}
+    for job in jobs:
+        bid_info = bids.get(job.ad_id)
+        if not bid_info:
+            logger.debug(f"Нет bid_info для {job.ad_id}")
+            continue
+        try:
+            decision = decide_new_price(job, bid_info)
+        except Exception as ad_err:
+            logger.exception(f"Ошибка при обработке объявления {job.ad_id}: {ad_err}")
+            continue
+        if decision:
+            decisions[job.ad_id] = decision
+
+    to_update = [job for job in jobs if job.ad_id in decisions]
+    results = run_per_token(
+        to_update,
+        lambda job: update_view_price(job.token, int(job.ad_id), *decisions[job.ad_id], invalidate_cache=False),
+        max_workers,
+        per_token
+    )
+    changes = []
+    now = datetime.datetime.now()
+    for job in to_update:
+        if results.get(job.ad_id) is None:
+            logger.warning(f"{job.ad_id}: не удалось обновить цену")
+            continue
+        new_price, limit = decisions[job.ad_id]
+        changes.append((job.ad_id, now, job.current_place, job.last_price, new_price, limit))
+    try:
+        db.insert_bid_changes(changes)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при сохранении истории ставок: {e}")
+    cache.invalidate_many([(job.ad_id, job.token) for job in to_update if results.get(job.ad_id) is not None], db)
+    logger.info(f"Корректировка ставок: {len(jobs)} объявлений, {len(changes)} изменено, "
+                f"{len(to_update) - len(changes)} ошибок за {time.time() - started:.1f} сек")
 
 # Пример вызова:
 # check_and_update_prices()
@@ -0,0 +1,129 @@
+import threading
+import time
+from dataclasses import dataclass
+
+from loguru import logger
+
+BLOCK_STATUSES = (403, 429)
+MIN_SAMPLES_FOR_QUARANTINE = 5
+FLUSH_EVERY = 10  # сохранять оценки в БД каждые N запросов
+
+
+@dataclass
+class ProxyHealth:
+    """Экспоненциально сглаженные показатели одного прокси"""
+    key: str
+    latency: float = 1.0  # сек
+    success_rate: float = 1.0
+    block_rate: float = 0.0  # доля ответов 403/429 и заглушек
+    last_ip_change: float = 0.0
+    quarantined_until: float = 0.0
+    samples: int = 0
+
+    def score(self, now: float | None = None) -> float:
+        """Чем больше, тем здоровее прокси"""
+        now = now or time.time()
+        # Давно не менявшийся IP чаще оказывается "подгоревшим"
+        ip_age_hours = (now - self.last_ip_change) / 3600 if self.last_ip_change else 1.0
+        ip_factor = max(0.5, 1.0 - 0.1 * ip_age_hours)
+        return self.success_rate * (1.0 - self.block_rate) * ip_factor / (1.0 + self.latency)
+
+
+class ProxyHealthTracker:
+    """Оценка здоровья прокси для proxy_rotation_mode = "smart".
+
+    Задержка, доля успешных ответов и доля 403/429 считаются как EWMA,
+    прокси с высокой долей ошибок уходит в карантин. Оценки хранятся в
+    таблице proxy_health, поэтому переживают циклы и перезапуски."""
+
+    def __init__(self, db, alpha: float = 0.2, quarantine_failure_rate: float = 0.5, quarantine_minutes: float = 10):
+        self.db = db
+        self.alpha = alpha
+        self.quarantine_failure_rate = quarantine_failure_rate
+        self.quarantine_seconds = quarantine_minutes * 60
+        self.stats: dict[str, ProxyHealth] = {}
+        self._dirty: set[str] = set()
+        self._records_since_flush = 0
+        self.flush_every = FLUSH_EVERY  # 0 — сохранять только явным flush()
+        self._lock = threading.Lock()  # flush может идти из другого потока (async режим)
+        try:
+            for row in db.get_proxy_health():
+                self.stats[row[0]] = ProxyHealth(*row)
+        except Exception as err:
+            logger.warning(f"Не удалось загрузить оценки прокси: {err}")
+
+    def get(self, key: str) -> ProxyHealth:
+        if key not in self.stats:
+            self.stats[key] = ProxyHealth(key=key)
+        return self.stats[key]
+
+    def _ewma(self, old: float, value: float) -> float:
+        return (1 - self.alpha) * old + self.alpha * value
+
+    def record(self, key: str, latency: float | None, status_code: int | None = None, blocked: bool = False):
+        """Учитывает результат запроса; status_code None — ошибка транспорта,
+        blocked — заглушка вместо страницы при статусе 200"""
+        health = self.get(key)
+        blocked = blocked or status_code in BLOCK_STATUSES
+        ok = status_code == 200 and not blocked
+        if latency is not None:
+            health.latency = self._ewma(health.latency, latency)
+        health.success_rate = self._ewma(health.success_rate, 1.0 if ok else 0.0)
+        health.block_rate = self._ewma(health.block_rate, 1.0 if blocked else 0.0)
+        health.samples += 1
+        if (not ok and health.samples >= MIN_SAMPLES_FOR_QUARANTINE
+                and 1.0 - health.success_rate >= self.quarantine_failure_rate
+                and not self.is_quarantined(key)):
+            health.quarantined_until = time.time() + self.quarantine_seconds
+            logger.warning(f"🚧 Прокси {key} в карантине на {self.quarantine_seconds // 60:.0f} мин "
+                           f"(успешность {health.success_rate:.2f}, блокировки {health.block_rate:.2f})")
+        self._mark_dirty(key)
+
+    def record_ip_change(self, key: str):
+        health = self.get(key)
+        health.last_ip_change = time.time()
+        # Новый IP — даем прокси шанс выйти из карантина досрочно
+        health.quarantined_until = 0.0
+        health.block_rate = self._ewma(health.block_rate, 0.0)
+        self._mark_dirty(key)
+
+    def is_quarantined(self, key: str) -> bool:
+        return self.get(key).quarantined_until > time.time()
+
+    def choose(self, keys: list[str], exclude: str | None = None) -> str | None:
+        """Возвращает самый здоровый прокси вне карантина"""
+        candidates = [k for k in keys if k != exclude] or list(keys)
+        if not candidates:
+            return None
+        healthy = [k for k in candidates if not self.is_quarantined(k)]
+        if not healthy:
+            # Все в карантине — берем тот, что освободится раньше
+            return min(candidates, key=lambda k: self.get(k).quarantined_until)
+        now = time.time()
+        return max(healthy, key=lambda k: self.get(k).score(now))
+
+    def _mark_dirty(self, key: str):
+        with self._lock:
+            self._dirty.add(key)
+            self._records_since_flush += 1
+            due = self.flush_every and self._records_since_flush >= self.flush_every
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            keys = set(self._dirty)
+            rows = [
+                (h.key, h.latency, h.success_rate, h.block_rate, h.last_ip_change, h.quarantined_until, h.samples)
+                for h in (self.stats[k] for k in keys)
+            ]
+            self._dirty.clear()
+            self._records_since_flush = 0
+        try:
+            self.db.save_proxy_health(rows)
+        except Exception as err:
+            with self._lock:
+                self._dirty |= keys
+            logger.warning(f"Не удалось сохранить оценки прокси: {err}")
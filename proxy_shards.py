@@ -0,0 +1,94 @@
+import bisect
+import hashlib
+import threading
+
+from loguru import logger
+
+from cookie_pool import CookiePool
+from dto import AvitoConfig, MobileProxy, ScanTarget
+from parser_cls import AvitoParse
+
+
+class ConsistentHashRing:
+    """Кольцо консистентного хеширования: при добавлении прокси
+    переезжает только часть категорий, а не весь план"""
+
+    def __init__(self, nodes: list[str], replicas: int = 100):
+        self._ring = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._keys = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+    def get_node(self, key: str) -> str:
+        idx = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[idx][1]
+
+
+class ShardedAvitoParse(AvitoParse):
+    """Шардированный режим: один воркер на каждый активный мобильный прокси.
+
+    Воркер — отдельный AvitoParse в своем потоке со своей сессией, cookies,
+    счетчиками, сменой IP и соединением с БД. Категории плана распределяются
+    по воркерам консистентным хешированием, так что одну страницу категории
+    по-прежнему скачивает ровно один воркер."""
+
+    def __init__(self, config: AvitoConfig, stop_event=None, cookie_pool: CookiePool | None = None):
+        super().__init__(config, stop_event, cookie_pool=cookie_pool)
+        self._scanned_lock = threading.Lock()
+        self.ring = ConsistentHashRing([proxy.key for proxy in self.mobile_proxies]) if self.mobile_proxies else None
+
+    def partition_plan(self, plan: dict[str, list[ScanTarget]]) -> dict[str, dict[str, list[ScanTarget]]]:
+        shards: dict[str, dict[str, list[ScanTarget]]] = {proxy.key: {} for proxy in self.mobile_proxies}
+        for category, targets in plan.items():
+            shards[self.ring.get_node(category)][category] = targets
+        return shards
+
+    def _run_worker(self, proxy: MobileProxy, plan: dict[str, list[ScanTarget]]):
+        worker = AvitoParse(
+            self.config,
+            self.stop_event,
+            proxies=[proxy],
+            cookie_pool=self.cookie_pool,
+            worker_name=proxy.key
+        )
+        # Трафик всех шардов учитывается как один цикл
+        worker.traffic.cycle_started = self.traffic.cycle_started
+        try:
+            worker.parse(plan)
+        except Exception as err:
+            logger.exception(f"[{proxy.name}] Ошибка воркера шарда: {err}")
+        finally:
+            with self._scanned_lock:
+                self.scanned_ads |= worker.scanned_ads
+                # Пауза основного цикла считается по расписанию родителя
+                if self.scheduler and worker.scheduler:
+                    self.scheduler.merge(worker.scheduler)
+            worker.db.close()
+
+    def parse(self, plan: dict[str, list[ScanTarget]] | None = None):
+        plan = plan if plan is not None else self.build_scan_plan()
+        if len(self.mobile_proxies) <= 1:
+            # Шардировать нечего — работаем как обычный парсер
+            return super().parse(plan)
+        shards = self.partition_plan(plan)
+        threads = []
+        for proxy in self.mobile_proxies:
+            shard_plan = shards[proxy.key]
+            if not shard_plan:
+                continue
+            logger.info(f"[{proxy.name}] Шард: {len(shard_plan)} категорий, "
+                        f"{sum(len(t) for t in shard_plan.values())} объявлений")
+            thread = threading.Thread(
+                target=self._run_worker,
+                args=(proxy, shard_plan),
+                name=f"shard-{proxy.name}",
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
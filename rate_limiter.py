@@ -0,0 +1,132 @@
+import asyncio
+import random
+import threading
+import time
+
+from loguru import logger
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst про запас.
+
+    reserve() сразу занимает токен (запас может уйти в минус) и возвращает,
+    сколько нужно подождать, — так параллельные потоки встают в очередь,
+    а не просыпаются одновременно."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, rate: float | None = None) -> float:
+        with self.lock:
+            now = time.monotonic()
+            rate = rate or self.rate
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / rate)
+
+
+class RateLimiter:
+    """Центральный ограничитель частоты запросов с корзиной на каждый ключ
+    (прокси для каталога, OAuth токен для API Авито).
+
+    На 429 скорость ключа уменьшается вдвое (не ниже min_factor от заданной),
+    после успешных ответов постепенно возвращается к заданной.
+    rate_per_minute <= 0 — без ограничения: acquire не ждет."""
+
+    def __init__(
+            self,
+            name: str,
+            rate_per_minute: float,
+            burst: float = 1,
+            jitter: float = 0.0,
+            min_factor: float = 0.1,
+            recovery: float = 0.05
+    ):
+        self.name = name
+        self.min_factor = min_factor
+        self.recovery = recovery
+        self._buckets: dict[str, TokenBucket] = {}
+        self._factors: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.configure(rate_per_minute, burst, jitter)
+
+    def configure(self, rate_per_minute: float, burst: float = 1, jitter: float = 0.0):
+        """Обновляет лимиты (конфиг перечитывается каждый цикл), адаптация по ключам сохраняется"""
+        with self._lock:
+            self.rate = max(rate_per_minute, 0) / 60
+            self.burst = burst
+            self.jitter = max(0.0, jitter)
+            for bucket in self._buckets.values():
+                bucket.rate = self.rate
+                bucket.burst = max(1.0, burst)
+
+    def _bucket(self, key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def factor(self, key: str) -> float:
+        return self._factors.get(key, 1.0)
+
+    def _delay(self, key: str) -> float:
+        if self.unlimited:
+            return 0.0
+        delay = self._bucket(key).reserve(self.rate * self.factor(key))
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        return delay
+
+    def acquire(self, key: str) -> float:
+        """Ждет своей очереди на запрос; возвращает время ожидания"""
+        delay = self._delay(key)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, key: str) -> float:
+        delay = self._delay(key)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def throttled(self, key: str):
+        """Ответ 429 — снижаем скорость ключа"""
+        if self.unlimited:
+            logger.warning(f"⏱️ [{self.name}] 429 для {key}: лимит не задан, снижать нечего")
+            return
+        with self._lock:
+            factor = max(self.min_factor, self.factor(key) / 2)
+            self._factors[key] = factor
+        logger.warning(f"⏱️ [{self.name}] 429 для {key}: скорость снижена до {self.rate * factor * 60:.1f} запр/мин")
+
+    def succeeded(self, key: str):
+        with self._lock:
+            factor = self.factor(key)
+            if factor < 1.0:
+                self._factors[key] = min(1.0, factor + self.recovery)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, rate_per_minute: float, burst: float = 1, jitter: float = 0.0) -> RateLimiter:
+    """Общий на процесс ограничитель name; при повторном вызове обновляет его лимиты"""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = RateLimiter(name, rate_per_minute, burst, jitter)
+        else:
+            limiter.configure(rate_per_minute, burst, jitter)
+        return limiter
@@ -0,0 +1,199 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+
+from loguru import logger
+
+
+class ErrorKind(str, Enum):
+    OK = "ok"
+    TRANSPORT = "transport"  # соединение, прокси, DNS, обрыв
+    TLS = "tls"
+    TIMEOUT = "timeout"
+    BLOCKED = "blocked"  # 403, 401, 422, редирект на проверку
+    RATE_LIMITED = "rate_limited"  # 429
+    SERVER = "server"  # 5xx
+    SOFT_BLOCK = "soft_block"  # 200, но вместо страницы заглушка
+    UNEXPECTED = "unexpected"
+    CIRCUIT_OPEN = "circuit_open"  # запрос не отправлялся: прокси или сайт временно исключены
+    CANCELLED = "cancelled"
+
+
+# Ошибки, за которые отвечает прокси, а не сайт
+PROXY_ERRORS = {ErrorKind.TRANSPORT, ErrorKind.TLS, ErrorKind.TIMEOUT, ErrorKind.BLOCKED,
+                ErrorKind.RATE_LIMITED, ErrorKind.SOFT_BLOCK}
+
+# Коды CURLE_*: https://curl.se/libcurl/c/libcurl-errors.html
+_CURL_TIMEOUT = {28}
+_CURL_TLS = {35, 53, 54, 58, 59, 60, 64, 66, 77, 80, 83, 90, 91}
+
+
+def classify_status(status_code: int) -> ErrorKind:
+    if status_code == 200:
+        return ErrorKind.OK
+    if status_code == 429:
+        return ErrorKind.RATE_LIMITED
+    if status_code in (302, 401, 403, 422):
+        return ErrorKind.BLOCKED
+    if status_code >= 500:
+        return ErrorKind.SERVER
+    return ErrorKind.UNEXPECTED
+
+
+def classify_exception(err: Exception) -> ErrorKind:
+    code = getattr(err, "code", None)
+    try:
+        code = int(code) if code is not None else None
+    except (TypeError, ValueError):
+        code = None
+    if code in _CURL_TIMEOUT:
+        return ErrorKind.TIMEOUT
+    if code in _CURL_TLS:
+        return ErrorKind.TLS
+    message = str(err).upper()
+    if "TIMEOUT" in message or "TIMED OUT" in message:
+        return ErrorKind.TIMEOUT
+    if "SSL" in message or "TLS" in message:
+        return ErrorKind.TLS
+    return ErrorKind.TRANSPORT
+
+
+@dataclass
+class FetchOutcome:
+    """Итог fetch_data: текст страницы или причина, по которой его нет"""
+    kind: ErrorKind
+    text: str | None = None
+    status_code: int | None = None
+    attempts: int = 0
+    proxy_key: str | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.kind == ErrorKind.OK
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 15.0) -> float:
+    """Ограниченная экспоненциальная пауза с "полным" джиттером"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1))) + 0.1
+
+
+class CircuitBreaker:
+    """Предохранитель одного прокси или сайта.
+
+    closed — запросы идут; после failure_threshold ошибок подряд — open, и
+    запросы не отправляются open_seconds; затем half_open — один пробный
+    запрос: успех закрывает предохранитель, ошибка снова открывает его на
+    вдвое больший срок (не больше max_open_seconds)."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, open_seconds: float = 60, max_open_seconds: float = 600):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """Пробный запрос не отправлен или ничего не сказал об этом предохранителе —
+        освобождаем слот, иначе half_open не пропустит больше ни одного запроса"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"🔌 {self.name}: предохранитель закрыт")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.open_seconds = self.base_open_seconds
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.open_seconds = min(self.open_seconds * 2, self.max_open_seconds)
+            elif self.failures < self.failure_threshold:
+                return
+            self.state = self.OPEN
+            self.opened_at = time.time()
+            self._trial_in_flight = False
+        logger.warning(f"🔌 {self.name}: предохранитель открыт на {self.open_seconds:.0f} сек ({self.failures} ошибок подряд)")
+
+
+class BreakerRegistry:
+    """Предохранители по ключу: "proxy:<ключ прокси>" и "host:<сайт>", общие для всех воркеров"""
+
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 60):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(key, self.failure_threshold, self.open_seconds)
+            return breaker
+
+    def proxy(self, proxy_key: str) -> CircuitBreaker:
+        return self.get(f"proxy:{proxy_key}")
+
+    def host(self, host: str) -> CircuitBreaker:
+        return self.get(f"host:{host}")
+
+    def record(self, proxy_key: str, host: str, kind: ErrorKind):
+        """Успех закрывает оба предохранителя; ошибка идет на прокси или на сайт по ее типу.
+        Пробный запрос второго предохранителя всегда завершается — успехом или освобождением слота"""
+        if kind == ErrorKind.OK:
+            self.proxy(proxy_key).record_success()
+            self.host(host).record_success()
+        elif kind in PROXY_ERRORS:
+            self.proxy(proxy_key).record_failure()
+            self.host(host).release()
+        elif kind in (ErrorKind.SERVER, ErrorKind.UNEXPECTED):
+            # Ответ сайта пришел — прокси работает
+            self.proxy(proxy_key).record_success()
+            self.host(host).record_failure()
+        else:
+            self.proxy(proxy_key).release()
+            self.host(host).release()
+
+
+_registry: BreakerRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_breakers(failure_threshold: int = 5, open_seconds: float = 60) -> BreakerRegistry:
+    """Общий на процесс набор предохранителей; пороги обновляются из конфига"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = BreakerRegistry(failure_threshold, open_seconds)
+        _registry.failure_threshold = failure_threshold
+        _registry.open_seconds = open_seconds
+        return _registry
@@ -0,0 +1,98 @@
+import time
+from dataclasses import dataclass
+
+from loguru import logger
+
+from dto import NOT_FOUND_POSITION
+
+
+@dataclass
+class AdSchedule:
+    ad_id: str
+    next_scan_at: float = 0.0
+    interval: float = 0.0  # сек
+    volatility: float = 0.0  # среднее изменение позиции между сканами
+
+
+class ScanScheduler:
+    """Время следующего скана для каждого объявления.
+
+    Объявление, которое стабильно держится в середине целевого диапазона
+    target_place_start..target_place_end, сканируется реже (до max_interval),
+    а скачущее или стоящее у края диапазона — чаще (до min_interval).
+    Расписание хранится в таблице scan_schedule."""
+
+    def __init__(self, db, min_interval_minutes: float = 5, max_interval_minutes: float = 60):
+        self.db = db
+        self.min_interval = min_interval_minutes * 60
+        self.max_interval = max(max_interval_minutes * 60, self.min_interval)
+        self.schedule: dict[str, AdSchedule] = {}
+        self._dirty: set[str] = set()
+        try:
+            for row in db.get_scan_schedule():
+                self.schedule[str(row[0])] = AdSchedule(str(row[0]), *row[1:])
+        except Exception as err:
+            logger.warning(f"Не удалось загрузить расписание сканов: {err}")
+
+    def is_due(self, ad_id: str, now: float | None = None) -> bool:
+        entry = self.schedule.get(str(ad_id))
+        return entry is None or entry.next_scan_at <= (now or time.time())
+
+    def seconds_until_next_due(self, ad_ids: list[str]) -> float | None:
+        if not ad_ids:
+            return None
+        now = time.time()
+        return max(0.0, min(
+            (self.schedule[a].next_scan_at if a in self.schedule else now) - now for a in map(str, ad_ids)
+        ))
+
+    @staticmethod
+    def volatility(positions: list[int]) -> float:
+        found = [p for p in positions if p != NOT_FOUND_POSITION]
+        if len(found) < 2:
+            return float(NOT_FOUND_POSITION)
+        return sum(abs(a - b) for a, b in zip(found, found[1:])) / (len(found) - 1)
+
+    @staticmethod
+    def band_margin(position: int, band_start: int | None, band_end: int | None) -> float:
+        """0 — объявление вне диапазона или у его края, 1 — ровно в середине"""
+        if position == NOT_FOUND_POSITION or band_start is None or band_end is None:
+            return 0.0
+        if not band_start <= position <= band_end:
+            return 0.0
+        half_width = (band_end - band_start) / 2
+        if half_width <= 0:
+            return 0.0
+        return min(position - band_start, band_end - position) / half_width
+
+    def reschedule(self, ad_id: str, positions: list[int], band_start: int | None, band_end: int | None):
+        """positions — позиции от новых к старым, первая только что записана"""
+        volatility = self.volatility(positions)
+        stability = self.band_margin(positions[0], band_start, band_end) / (1.0 + volatility)
+        interval = self.min_interval + (self.max_interval - self.min_interval) * stability
+        entry = self.schedule.setdefault(str(ad_id), AdSchedule(str(ad_id)))
+        entry.interval = interval
+        entry.volatility = volatility
+        entry.next_scan_at = time.time() + interval
+        self._dirty.add(entry.ad_id)
+        logger.debug(f"id: {ad_id}, следующий скан через {interval / 60:.1f} мин (колебания {volatility:.1f})")
+
+    def merge(self, other: "ScanScheduler"):
+        """Переносит расписание другого экземпляра (воркера шарда): перепланированная
+        запись всегда позже загруженной, поэтому из двух берется более поздняя"""
+        for ad_id, entry in other.schedule.items():
+            current = self.schedule.get(ad_id)
+            if current is None or entry.next_scan_at > current.next_scan_at:
+                self.schedule[ad_id] = entry
+
+    def flush(self):
+        if not self._dirty:
+            return
+        try:
+            self.db.save_scan_schedule([
+                (e.ad_id, e.next_scan_at, e.interval, e.volatility)
+                for e in (self.schedule[a] for a in self._dirty)
+            ])
+            self._dirty.clear()
+        except Exception as err:
+            logger.warning(f"Не удалось сохранить расписание сканов: {err}")
@@ -0,0 +1,88 @@
+import datetime
+
+import pytest
+
+from ad_schedule import is_within_schedule, parse_days, parse_hours, validate_schedule
+
+TZ = "Europe/Moscow"
+MSK = datetime.timezone(datetime.timedelta(hours=3))
+
+
+def at(day: int, hour: int, minute: int = 0) -> datetime.datetime:
+    """Момент по Москве; 12.10.2026 — понедельник, поэтому day — ISO день недели"""
+    return datetime.datetime(2026, 10, 11 + day, hour, minute, tzinfo=MSK)
+
+
+@pytest.mark.parametrize("now, expected", [
+    (at(5, 23), True),       # пятница, окно началось в пятницу
+    (at(6, 3), True),        # суббота ночью — хвост пятничного окна
+    (at(6, 6), False),       # конец окна не входит
+    (at(6, 23), False),      # субботнее окно не открывается
+    (at(7, 3), False),       # хвост субботы
+    (at(1, 3), False),       # хвост воскресенья
+    (at(1, 22), True),       # понедельник, начало окна
+    (at(3, 12), False),      # среда днем — вне окна
+])
+def test_overnight_window_on_weekdays(now, expected):
+    assert is_within_schedule("1-5", "22-06", TZ, now=now) is expected
+
+
+@pytest.mark.parametrize("now, expected", [
+    (at(4, 23, 45), False),  # четверга нет в списке
+    (at(5, 7), False),
+    (at(5, 23, 30), True),   # пятница уже в списке
+    (at(6, 12), True),
+    (at(7, 23, 59), True),
+    (at(1, 0, 30), True),    # хвост воскресного окна в понедельник
+    (at(1, 1), False),
+    (at(1, 23, 30), True),   # понедельник тоже в списке
+])
+def test_day_list_across_weekend(now, expected):
+    assert is_within_schedule("5-7,1", "23:30-01:00,8-22", TZ, now=now) is expected
+
+
+def test_day_window_boundaries():
+    assert is_within_schedule("", "9-18", TZ, now=at(2, 9))
+    assert is_within_schedule("", "9-18", TZ, now=at(2, 17, 59))
+    assert not is_within_schedule("", "9-18", TZ, now=at(2, 18))
+    assert not is_within_schedule("", "9-18", TZ, now=at(2, 8, 59))
+
+
+def test_days_without_hours_mean_whole_day():
+    assert is_within_schedule("6,7", None, TZ, now=at(6, 0))
+    assert is_within_schedule("6,7", None, TZ, now=at(7, 23, 59))
+    assert not is_within_schedule("6,7", None, TZ, now=at(1, 0))
+
+
+def test_empty_schedule_is_always_active():
+    assert is_within_schedule(None, None, None, now=at(3, 4))
+    assert is_within_schedule("", "", TZ, now=at(3, 4))
+
+
+def test_time_zone_is_applied():
+    # 20:30 UTC пятницы — 23:30 по Москве
+    now = datetime.datetime(2026, 10, 16, 20, 30, tzinfo=datetime.timezone.utc)
+    assert is_within_schedule("1-5", "22-06", TZ, now=now)
+    assert not is_within_schedule("1-5", "22-06", "UTC", now=now)
+
+
+def test_parsers():
+    assert parse_days("1-3,5") == {1, 2, 3, 5}
+    assert parse_days(" 6, 7 ") == {6, 7}
+    assert parse_hours("22:00-06:30,8-12") == [(22 * 60, 6 * 60 + 30), (8 * 60, 12 * 60)]
+
+
+@pytest.mark.parametrize("days, hours, tz", [
+    ("6-1", None, TZ),          # диапазон дней через неделю задается списком
+    ("0", None, TZ),
+    ("1-8", None, TZ),
+    ("пн", None, TZ),
+    (None, "9", TZ),
+    (None, "9-", TZ),
+    (None, "25-26", TZ),
+    (None, "9:75-18", TZ),
+    (None, "9-18", "Mars/Phobos"),
+])
+def test_malformed_schedule_keeps_ad_active(days, hours, tz):
+    assert not validate_schedule(days, hours, tz)
+    assert is_within_schedule(days, hours, tz, now=at(3, 4))
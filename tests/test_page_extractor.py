@@ -0,0 +1,124 @@
+import html
+import json
+
+import pytest
+
+from page_extractor import (
+    MIN_PAGE_SIZE,
+    extract_catalog_ids,
+    extract_mfe_state_fast,
+    extract_mfe_state_soup,
+    find_mfe_state,
+    soft_block_reason,
+)
+
+STATE = {
+    "data": {
+        "catalog": {
+            "items": [
+                {"id": 4001, "type": "item", "title": "Диван «Лофт» & кресло", "isVip": True},
+                {"id": None, "type": "banner"},
+                {"id": 4002, "type": "item", "title": "Стол <дуб>"},
+                {"type": "witcher"},
+                {"id": 4003, "type": "vip", "title": "Шкаф 'купе'"},
+            ]
+        },
+        "searchCore": {"query": "мебель", "page": 1},
+    }
+}
+STANDARD_TAG = '<script type="mime/invalid" data-mfe-state="true">'
+
+
+def state_script(open_tag: str = STANDARD_TAG, state: dict = STATE) -> str:
+    # Авито кладет JSON в тег с HTML-экранированием кавычек, угловых скобок и амперсандов
+    return f"{open_tag}{html.escape(json.dumps(state, ensure_ascii=False))}</script>"
+
+
+def catalog_page(*scripts: str, title: str = "Купить мебель в Москве | Авито") -> str:
+    """Страница в разметке каталога: бандлы и инлайн-скрипты до mfe-state, объем больше MIN_PAGE_SIZE"""
+    filler = '<div class="iva-item-root"><a href="/moskva/mebel/item_1">Объявление</a></div>' * 400
+    return (
+        f"<!DOCTYPE html><html lang=\"ru\"><head><meta charset=\"utf-8\"><title>{title}</title>"
+        '<script async src="https://www.avito.st/s/cc/bundles/main.js"></script>'
+        '<script nonce="x1">window.__initialData__ = {"ab": "catalog-v2"};</script>'
+        f"</head><body>{filler}{''.join(scripts)}"
+        '<script type="application/json" data-name="footer">{"links": []}</script>'
+        "</body></html>"
+    )
+
+
+@pytest.mark.parametrize("open_tag", [
+    STANDARD_TAG,
+    '<script data-mfe-state="true" type="mime/invalid">',
+    '<script nonce="abc" type="mime/invalid" data-mfe-state="true" data-marker="state">',
+])
+def test_fast_scan_matches_soup(open_tag):
+    page = catalog_page(state_script(open_tag))
+    assert extract_mfe_state_fast(page) == extract_mfe_state_soup(page) == STATE["data"]
+
+
+def test_fast_scan_matches_soup_on_bytes():
+    page = catalog_page(state_script()).encode("utf-8")
+    assert extract_mfe_state_fast(page) == extract_mfe_state_soup(page) == STATE["data"]
+
+
+def test_non_mime_script_with_state_marker_is_skipped():
+    decoy = state_script('<script type="application/json" data-mfe-state="true">', {"data": {"decoy": True}})
+    page = catalog_page(decoy, state_script())
+    assert extract_mfe_state_fast(page) == extract_mfe_state_soup(page) == STATE["data"]
+
+
+def test_marker_inside_other_script_text_is_skipped():
+    page = catalog_page("<script>var selector = 'script[data-mfe-state=\"true\"]';</script>", state_script())
+    assert extract_mfe_state_fast(page) == extract_mfe_state_soup(page) == STATE["data"]
+
+
+def test_first_state_script_wins():
+    second = state_script(state={"data": {"catalog": {"items": [{"id": 1}]}}})
+    page = catalog_page(state_script(), second)
+    assert extract_mfe_state_fast(page) == extract_mfe_state_soup(page) == STATE["data"]
+
+
+def test_single_quoted_attributes_fall_back_to_soup():
+    page = catalog_page(state_script("<script type='mime/invalid' data-mfe-state='true'>"))
+    assert extract_mfe_state_fast(page) is None
+    assert find_mfe_state(page) == extract_mfe_state_soup(page) == STATE["data"]
+
+
+def test_broken_json_in_fast_path_falls_back():
+    page = catalog_page(f"{STANDARD_TAG}{{not json</script>")
+    with pytest.raises(json.JSONDecodeError):
+        extract_mfe_state_fast(page)
+    assert find_mfe_state(page) == {}
+
+
+def test_catalog_ids_keep_page_order():
+    page = catalog_page(state_script())
+    assert extract_catalog_ids(find_mfe_state(page)["catalog"]) == ["4001", "4002", "4003"]
+    assert soft_block_reason(page) is None
+
+
+def test_page_without_state():
+    page = catalog_page()
+    assert len(page) >= MIN_PAGE_SIZE
+    assert extract_mfe_state_fast(page) is None
+    assert find_mfe_state(page) == extract_mfe_state_soup(page) == {}
+    assert soft_block_reason(page) == "нет mfe-state"
+
+
+@pytest.mark.parametrize("title", [
+    "Доступ ограничен: проблема с IP",
+    "Доступ временно ограничен",
+    "Captcha",
+])
+def test_block_stub_is_soft_block(title):
+    page = f"<html><head><title>{title}</title></head><body><form>Подтвердите, что вы не робот</form></body></html>"
+    assert soft_block_reason(page) == f"заглушка «{title}»"
+    assert soft_block_reason(page.encode("utf-8")) == f"заглушка «{title}»"
+    assert find_mfe_state(page) == {}
+
+
+def test_small_or_empty_response_is_soft_block():
+    assert soft_block_reason("") == "пустой ответ"
+    assert soft_block_reason(None) == "пустой ответ"
+    assert soft_block_reason("<html><body>ok</body></html>").startswith("маленький ответ без mfe-state")
@@ -0,0 +1,77 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from avito_db import AvitoDB
+from dto import CATALOG_PAGE_SIZE, MAX_SCAN_PAGES, NOT_FOUND_POSITION
+from parser_cls import AvitoParse
+
+predict_start_page = AvitoParse.predict_start_page
+page_order = AvitoParse.page_order
+
+
+@pytest.mark.parametrize("positions, expected", [
+    ([1], 1),
+    ([CATALOG_PAGE_SIZE], 1),            # последнее место первой страницы
+    ([CATALOG_PAGE_SIZE + 1], 2),        # первое место второй
+    ([120], 3),
+    ([400, 120, 130], 3),                # медиана, а не последняя позиция
+    ([120, NOT_FOUND_POSITION, 130], 3), # старые промахи в медиану не входят
+])
+def test_predicted_page(positions, expected):
+    assert predict_start_page(positions, depth=10) == expected
+
+
+@pytest.mark.parametrize("positions", [
+    [],
+    [NOT_FOUND_POSITION],
+    [NOT_FOUND_POSITION, 120, 130],      # в последний раз не нашли — начинаем сначала
+])
+def test_not_found_starts_from_first_page(positions):
+    assert predict_start_page(positions, depth=MAX_SCAN_PAGES) == 1
+
+
+def test_predicted_page_is_clamped_to_depth():
+    assert predict_start_page([900], depth=5) == 5
+    assert predict_start_page([NOT_FOUND_POSITION - 1], depth=MAX_SCAN_PAGES) == MAX_SCAN_PAGES
+    assert predict_start_page([NOT_FOUND_POSITION - 1], depth=1) == 1
+
+
+def test_page_order_widens_around_start():
+    assert page_order(3, 6) == [3, 2, 4, 1, 5, 6]
+    assert page_order(1, 4) == [1, 2, 3, 4]
+    assert page_order(MAX_SCAN_PAGES, MAX_SCAN_PAGES) == list(range(MAX_SCAN_PAGES, 0, -1))
+
+
+@pytest.mark.parametrize("start_page, depth", [(1, 1), (2, 2), (7, 10), (10, MAX_SCAN_PAGES), (MAX_SCAN_PAGES, MAX_SCAN_PAGES)])
+def test_page_order_covers_every_page_once(start_page, depth):
+    order = page_order(start_page, depth)
+    assert order[0] == start_page
+    assert sorted(order) == list(range(1, depth + 1))
+
+
+def test_scan_plan_uses_history_and_caps_depth():
+    db = AvitoDB(":memory:")
+    profile_id = db.insert_profile("client", "secret", token="token")
+    category = "https://www.avito.ru/moskva/mebel"
+    db.insert_ad("101", category, profile_id, scan_pages=MAX_SCAN_PAGES + 10)
+    db.insert_ad("102", category, profile_id, scan_pages=4)
+    db.insert_ad("103", category, profile_id)
+    started = datetime.datetime(2026, 10, 12, 12, 0)
+    # Позиции пишутся от старых к новым: у 102 последний скан не нашел объявление
+    db.insert_ad_stats([("101", 0, 990), ("102", 0, 120)], timestamp=started)
+    db.insert_ad_stats([("101", 0, 980), ("102", 0, NOT_FOUND_POSITION)], timestamp=started + datetime.timedelta(hours=1))
+    parser = AvitoParse.__new__(AvitoParse)
+    parser.db = db
+    parser.config = SimpleNamespace(scan_max_pages=3)
+    parser.scheduler = None
+    try:
+        targets = {t.ad_id: t for t in parser.build_scan_plan()[category]}
+    finally:
+        db.close()
+    assert targets["101"].recent_positions == [980, 990]
+    assert targets["101"].pages[0] == MAX_SCAN_PAGES
+    assert sorted(targets["101"].pages) == list(range(1, MAX_SCAN_PAGES + 1))
+    assert targets["102"].pages == [1, 2, 3, 4]
+    assert targets["103"].pages == [1, 2, 3]
@@ -0,0 +1,54 @@
+import time
+
+from retry_policy import BreakerRegistry, CircuitBreaker, ErrorKind
+
+HOST = "www.avito.ru"
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    # Срок open истек — следующий allow переводит в half_open
+    breaker.opened_at = time.time() - breaker.open_seconds
+
+
+def test_half_open_allows_single_trial():
+    breaker = CircuitBreaker("test", failure_threshold=2, open_seconds=60)
+    open_breaker(breaker)
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_release_returns_trial_slot():
+    breaker = CircuitBreaker("test", failure_threshold=2, open_seconds=60)
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_host_trial_released_when_proxy_fails():
+    registry = BreakerRegistry(failure_threshold=2, open_seconds=60)
+    open_breaker(registry.host(HOST))
+    assert registry.host(HOST).allow()
+    registry.record("proxy-a", HOST, ErrorKind.TIMEOUT)
+    assert registry.host(HOST).allow()
+
+
+def test_proxy_trial_closed_by_server_error():
+    registry = BreakerRegistry(failure_threshold=2, open_seconds=60)
+    open_breaker(registry.proxy("proxy-a"))
+    assert registry.proxy("proxy-a").allow()
+    registry.record("proxy-a", HOST, ErrorKind.SERVER)
+    assert registry.proxy("proxy-a").state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_request_releases_both_trials():
+    registry = BreakerRegistry(failure_threshold=2, open_seconds=60)
+    open_breaker(registry.proxy("proxy-a"))
+    open_breaker(registry.host(HOST))
+    assert registry.proxy("proxy-a").allow()
+    assert registry.host(HOST).allow()
+    registry.record("proxy-a", HOST, ErrorKind.CANCELLED)
+    assert registry.proxy("proxy-a").allow()
+    assert registry.host(HOST).allow()
@@ -1,5 +1,5 @@
 import datetime
-import requests
+from api_client import get_api_client
 from avito_db import AvitoDB
 
 def refresh_tokens_for_all_profiles(db_path: str = "avito_data.db"):
@@ -17,24 +17,21 @@ def refresh_tokens_for_all_profiles(db_path: str = "avito_data.db"):
         else:
             hours_passed = 24  # если нет даты, считаем что давно
         if hours_passed >= 23:
-            url = 'https://api.avito.ru/token'
             payload = {
                 "client_id": client_id,
                 "client_secret": client_secret,
                 "grant_type": "client_credentials"
             }
-            headers = {"content-type": "application/x-www-form-urlencoded"}
-            try:
-                response = requests.post(url, headers=headers, data=payload)
-                response.raise_for_status()
-                data = response.json()
-                print(data)
-                if 'access_token' not in data:
-                    print(f"Ошибка в ответе Avito API для профиля {client_id}: {data}")
-                    continue
-                new_token = data['access_token']
-                db.update_profile_token(client_id, new_token)
-                print(f"Токен для профиля {client_id} обновлён.")
-            except requests.exceptions.RequestException as e:
-                print(f"Ошибка при обновлении токена для профиля {client_id}: {e}")
+            result = get_api_client().post("/token", data=payload)
+            if not result.ok:
+                print(f"Ошибка при обновлении токена для профиля {client_id}: {result.status_code} {result.error}")
+                continue
+            data = result.data or {}
+            print(data)
+            if 'access_token' not in data:
+                print(f"Ошибка в ответе Avito API для профиля {client_id}: {data}")
+                continue
+            new_token = data['access_token']
+            db.update_profile_token(client_id, new_token)
+            print(f"Токен для профиля {client_id} обновлён.")
     db.close()
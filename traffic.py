@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import defaultdict
+
+from curl_cffi import CurlInfo
+from loguru import logger
+
+FLUSH_EVERY = 20  # сохранять учет трафика в БД каждые N запросов
+# Размеры, которые curl_cffi кладет в response.infos, если сессия создана с curl_infos=CURL_INFOS
+CURL_INFOS = [CurlInfo.SIZE_DOWNLOAD_T, CurlInfo.HEADER_SIZE, CurlInfo.REQUEST_SIZE]
+RETENTION_DAYS = 14
+
+
+def response_bytes(response) -> tuple[int, int]:
+    """Байты по сети (заголовки, запрос и сжатое тело) и размер распакованного тела"""
+    decoded = len(response.content or b"")
+    infos = getattr(response, "infos", None) or {}
+    body = infos.get(CurlInfo.SIZE_DOWNLOAD_T) or 0
+    if not body:
+        body = int(response.headers.get("content-length") or decoded)
+    wire = body + (infos.get(CurlInfo.HEADER_SIZE) or 0) + (infos.get(CurlInfo.REQUEST_SIZE) or 0)
+    return int(wire), decoded
+
+
+class TrafficMeter:
+    """Учет трафика мобильных прокси, которые оплачиваются за гигабайт.
+
+    Каждый запрос пишется в traffic_requests (цикл, прокси, URL, статус,
+    байты по сети и после распаковки). Трафик страницы каталога, включая
+    повторные попытки, делится поровну между объявлениями, которые на ней
+    искали, и копится в ad_traffic — так видна стоимость каждого объявления.
+    Циклы старше retention_days удаляются из обеих таблиц при первом сохранении."""
+
+    def __init__(self, db, cycle_started: float | None = None, retention_days: float = RETENTION_DAYS):
+        self.db = db
+        self.cycle_started = cycle_started or time.time()
+        self.retention_days = retention_days  # 0 — хранить все
+        self.flush_every = FLUSH_EVERY  # 0 — сохранять только явным flush()
+        self._pruned = False
+        self._lock = threading.Lock()  # flush может идти из другого потока (async режим)
+        self._requests: list[tuple] = []
+        self._by_url: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+        self._ads: dict[str, list[float]] = defaultdict(lambda: [0.0, 0.0])
+        self.by_proxy: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+
+    def record(self, proxy_key: str, url: str, status_code: int, response) -> None:
+        wire, decoded = response_bytes(response)
+        with self._lock:
+            self._requests.append((self.cycle_started, time.time(), proxy_key, url, status_code, wire, decoded))
+            due = self.flush_every and len(self._requests) >= self.flush_every
+        for totals in (self._by_url[url], self.by_proxy[proxy_key]):
+            totals[0] += wire
+            totals[1] += decoded
+        if due:
+            self.flush()
+
+    def charge_ads(self, url: str, ad_ids: list[str]) -> None:
+        """Относит трафик страницы url на объявления, которые на ней искали"""
+        wire, decoded = self._by_url.pop(url, (0, 0))
+        if not ad_ids or not wire:
+            return
+        with self._lock:
+            for ad_id in ad_ids:
+                self._ads[ad_id][0] += wire / len(ad_ids)
+                self._ads[ad_id][1] += decoded / len(ad_ids)
+
+    def flush(self) -> None:
+        with self._lock:
+            requests, self._requests = self._requests, []
+            ads = dict(self._ads)
+            self._ads.clear()
+        try:
+            if requests:
+                self.db.insert_traffic_requests(requests)
+                requests = []
+            if ads:
+                self.db.add_ad_traffic([
+                    (self.cycle_started, ad_id, round(wire), round(decoded))
+                    for ad_id, (wire, decoded) in ads.items()
+                ])
+                ads = {}
+        except Exception as err:
+            # Несохраненное вернется в следующий flush
+            with self._lock:
+                self._requests[:0] = requests
+                for ad_id, (wire, decoded) in ads.items():
+                    self._ads[ad_id][0] += wire
+                    self._ads[ad_id][1] += decoded
+            logger.warning(f"Не удалось сохранить учет трафика: {err}")
+        self._prune()
+
+    def _prune(self) -> None:
+        """Один раз за цикл удаляет учет трафика старых циклов"""
+        if self._pruned or self.retention_days <= 0:
+            return
+        self._pruned = True
+        try:
+            removed = self.db.prune_traffic(self.cycle_started - self.retention_days * 86400)
+            if removed:
+                logger.debug(f"📶 Удалено {removed} записей трафика старше {self.retention_days:g} дн.")
+        except Exception as err:
+            logger.warning(f"Не удалось очистить старый учет трафика: {err}")
+
+    def report(self) -> None:
+        for proxy_key, (wire, decoded) in self.by_proxy.items():
+            saved = 1 - wire / decoded if decoded else 0.0
+            logger.info(f"📶 {proxy_key}: {wire / 1024 / 1024:.2f} МБ по сети, "
+                        f"{decoded / 1024 / 1024:.2f} МБ после распаковки (экономия {saved:.0%})")